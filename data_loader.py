@@ -14,10 +14,13 @@ from sqlalchemy import create_engine
 
 from src.db_load import load_forecast_to_db, load_to_db
 from src.entsoe_collector import Generation, Load, Prices
+from src.factor_store import EmissionFactors
 from src.forecast_calculator import Next3DaysForecast
 from src.weatherapi_collector import WeatherForecast
 from utils.logger import CustomFormatter
-from src.db_cleanup import insert_dataframe, update_dataframe
+from src.db_cleanup import upsert_dataframe
+from src.rollups import update_rollups
+from src.average_cei import update_average_cei
 
 load_dotenv()
 
@@ -49,17 +52,21 @@ def main(country_code, country, city, timezone):
         f"fetching generation data from {start_date} to {end_date} for a country {country}")
     try:
         generation, emissions = Generation(
-            start_date, end_date, country_code).fetch_process_and_calculate_emissions()
+            start_date, end_date, country_code,
+            factors=EmissionFactors.load(alchemyEngine)).fetch_process_and_calculate_emissions()
         print("---------------Generation-----------------")
         generation.columns = generation.columns.str.lower()
         generation["country_code"] = country_code
         print(generation)
-        update_dataframe(generation, alchemyEngine, country_code, "generation")
+        upsert_dataframe(generation, alchemyEngine, "generation")
+        update_rollups(alchemyEngine, "generation", generation, country_code, tz=timezone)
         #generation.to_sql(name='generation', con=alchemyEngine,if_exists="append")
         print("---------------Emission-----------------")
         print(emissions)
         emissions["country_code"] = country_code
-        update_dataframe(emissions, alchemyEngine, country_code, "emissions")
+        upsert_dataframe(emissions, alchemyEngine, "emissions")
+        update_rollups(alchemyEngine, "emissions", emissions, country_code, tz=timezone)
+        update_average_cei(alchemyEngine, country_code, emissions)
         #emissions.to_sql(name='emissions', con=alchemyEngine, if_exists="append")
     except Exception as e:
         logger.exception(f"error while fetching generation data: {e}")
@@ -73,7 +80,8 @@ def main(country_code, country, city, timezone):
         print(load)
         load["country_code"] = country_code
         #load.to_sql(name="load", con=alchemyEngine, if_exists="append")
-        update_dataframe(load, alchemyEngine, country_code, "load")
+        upsert_dataframe(load, alchemyEngine, "load")
+        update_rollups(alchemyEngine, "load", load, country_code, tz=timezone)
         logger.info("loading consumption data to database")
     
     except Exception as e:
@@ -88,7 +96,8 @@ def main(country_code, country, city, timezone):
         print("---------------Prices-----------------")
         print(prices)
         prices["country_code"] = country_code
-        update_dataframe(prices, alchemyEngine, country_code, "prices")
+        upsert_dataframe(prices, alchemyEngine, "prices")
+        update_rollups(alchemyEngine, "prices", prices, country_code, tz=timezone)
         #prices.to_sql(name = "prices", con=alchemyEngine, if_exists="append")
         logger.info("loading prices data to database")
     except Exception as e:
@@ -102,7 +111,7 @@ def main(country_code, country, city, timezone):
         print("---------------weather-----------------")
         print(forecast)
         forecast["country_code"] = country_code
-        update_dataframe(forecast, alchemyEngine, country_code, "forecast", "time")
+        upsert_dataframe(forecast, alchemyEngine, "forecast", "time")
         #forecast.to_sql(name="forecast", con=alchemyEngine, if_exists="append")
         logger.info("loading weather data to database")
     except Exception as e:
@@ -118,7 +127,7 @@ def main(country_code, country, city, timezone):
         print("---------------Forecast-----------------")
         print(forecast_data)
         forecast_data["country_code"] = country_code
-        update_dataframe(forecast_data, alchemyEngine, country_code, "forecast_data", "time")
+        upsert_dataframe(forecast_data, alchemyEngine, "forecast_data", "time")
         #forecast_data.to_sql(name="forecast_data", con=alchemyEngine, if_exists="append")
     except Exception as e:
         logger.exception(f"error while fetching weather forecast data: {e}")
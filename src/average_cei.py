@@ -0,0 +1,227 @@
+import os
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+TARGET = "Carbon_Intensity_CEI"
+STATE_TABLE = "average_cei_state"
+TOTALS_TABLE = "average_cei_totals"
+HOURLY_TABLE = "average_cei_hourly"
+# baseline written to average_cei: all_time, trailing or hour_of_day
+BASELINE = os.environ.get("AVERAGE_CEI_BASELINE", "all_time")
+# length of the trailing baseline in days
+WINDOW_DAYS = int(os.environ.get("AVERAGE_CEI_WINDOW_DAYS", 30))
+# emissions tables the baselines are computed from; an hour stored in several of them
+# counts once, with the value of the first table
+SOURCE_TABLES = ("emissions", "emissions_historical")
+
+_prepared = False
+_prepared_lock = threading.Lock()
+
+
+def ensure_tables(engine):
+    """Creates the state tables once per process
+
+    average_cei_state holds the sum and count of the carbon intensity per country, UTC day
+    and hour; average_cei_totals the running sum and count per country and hour of day.
+    average_cei itself, read by the API, is created too on a new database.
+    """
+    global _prepared
+    with _prepared_lock:
+        if _prepared:
+            return
+        with engine.begin() as connection:
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS average_cei (
+                    country_code TEXT PRIMARY KEY,
+                    average_cei DOUBLE PRECISION
+                )
+            """))
+            connection.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {STATE_TABLE} (
+                    country_code TEXT NOT NULL,
+                    day DATE NOT NULL,
+                    hour INTEGER NOT NULL,
+                    total DOUBLE PRECISION NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (country_code, day, hour)
+                )
+            """))
+            connection.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {TOTALS_TABLE} (
+                    country_code TEXT NOT NULL,
+                    hour INTEGER NOT NULL,
+                    total DOUBLE PRECISION NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (country_code, hour)
+                )
+            """))
+            connection.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {HOURLY_TABLE} (
+                    country_code TEXT NOT NULL,
+                    hour INTEGER NOT NULL,
+                    average_cei DOUBLE PRECISION,
+                    PRIMARY KEY (country_code, hour)
+                )
+            """))
+        _prepared = True
+
+
+def _hourly_sums(connection, country_code, first_day, last_day) -> dict[int, tuple[float, int]]:
+    rows = connection.execute(text(f"""
+        SELECT hour, sum(total) AS total, sum(samples) AS samples
+        FROM {STATE_TABLE}
+        WHERE country_code = :country_code AND day BETWEEN :first_day AND :last_day
+        GROUP BY hour
+    """), {"country_code": country_code, "first_day": first_day, "last_day": last_day})
+    return {row.hour: (row.total, row.samples) for row in rows}
+
+
+def _deltas(old: dict[int, tuple[float, int]],
+            new: dict[int, tuple[float, int]]) -> dict[int, tuple[float, int]]:
+    """Returns the (total, samples) to add to the running totals per hour of day when the
+    state of some days goes from `old` to `new`; an hour missing on one side counts as 0
+    """
+    deltas = {}
+    for hour in set(old) | set(new):
+        old_total, old_samples = old.get(hour, (0.0, 0))
+        new_total, new_samples = new.get(hour, (0.0, 0))
+        deltas[hour] = (new_total - old_total, new_samples - old_samples)
+    return deltas
+
+
+def _existing_tables(connection, tables) -> list[str]:
+    return [table for table in tables
+            if connection.execute(text("SELECT to_regclass(:name)"),
+                                  {"name": f'"{table}"'}).scalar() is not None]
+
+
+def _rebuild_days(connection, source_tables, country_code, first_day, last_day):
+    tables = _existing_tables(connection, source_tables)
+    if not tables:
+        return
+    rows = " UNION ALL ".join(f"""
+        SELECT "index", "{TARGET}" AS cei, {priority} AS priority
+        FROM "{table}"
+        WHERE country_code = :country_code
+        AND "index" >= CAST(:first_day AS DATE) AT TIME ZONE 'UTC'
+        AND "index" < (CAST(:last_day AS DATE) + 1) AT TIME ZONE 'UTC'
+    """ for priority, table in enumerate(tables))
+    connection.execute(text(f"""
+        INSERT INTO {STATE_TABLE} (country_code, day, hour, total, samples)
+        SELECT :country_code,
+               ("index" AT TIME ZONE 'UTC')::date,
+               extract(hour FROM "index" AT TIME ZONE 'UTC')::int,
+               sum(cei),
+               count(cei)
+        FROM (
+            SELECT DISTINCT ON ("index") "index", cei
+            FROM ({rows}) AS source
+            ORDER BY "index", priority
+        ) AS hours
+        GROUP BY 1, 2, 3
+        HAVING count(cei) > 0
+        ON CONFLICT (country_code, day, hour)
+        DO UPDATE SET total = EXCLUDED.total, samples = EXCLUDED.samples
+    """), {"country_code": country_code, "first_day": first_day, "last_day": last_day})
+
+
+def _rebuild_country(connection, source_tables, country_code):
+    connection.execute(text(f"DELETE FROM {STATE_TABLE} WHERE country_code = :country_code"),
+                       {"country_code": country_code})
+    connection.execute(text(f"DELETE FROM {TOTALS_TABLE} WHERE country_code = :country_code"),
+                       {"country_code": country_code})
+    _rebuild_days(connection, source_tables, country_code, "0001-01-01", "9999-12-30")
+    connection.execute(text(f"""
+        INSERT INTO {TOTALS_TABLE} (country_code, hour, total, samples)
+        SELECT country_code, hour, sum(total), sum(samples)
+        FROM {STATE_TABLE}
+        WHERE country_code = :country_code
+        GROUP BY 1, 2
+    """), {"country_code": country_code})
+
+
+def _has_totals(connection, country_code) -> bool:
+    return connection.execute(text(f"""
+        SELECT EXISTS (SELECT 1 FROM {TOTALS_TABLE} WHERE country_code = :country_code)
+    """), {"country_code": country_code}).scalar()
+
+
+def refresh(connection, country_code, baseline=BASELINE, window_days=WINDOW_DAYS):
+    """Writes the configured baseline to average_cei and the per-hour one to average_cei_hourly"""
+    connection.execute(text(f"""
+        INSERT INTO {HOURLY_TABLE} (country_code, hour, average_cei)
+        SELECT country_code, hour, total / NULLIF(samples, 0)
+        FROM {TOTALS_TABLE}
+        WHERE country_code = :country_code
+        ON CONFLICT (country_code, hour) DO UPDATE SET average_cei = EXCLUDED.average_cei
+    """), {"country_code": country_code})
+    if baseline == "trailing":
+        query = text(f"""
+            SELECT sum(total) / NULLIF(sum(samples), 0)
+            FROM {STATE_TABLE}
+            WHERE country_code = :country_code AND day > CURRENT_DATE - :window_days
+        """)
+    else:
+        query = text(f"""
+            SELECT sum(total) / NULLIF(sum(samples), 0)
+            FROM {TOTALS_TABLE}
+            WHERE country_code = :country_code
+        """)
+    params = {"country_code": country_code, "window_days": window_days}
+    average = connection.execute(query, params).scalar()
+    if average is None:
+        return
+    params["average_cei"] = average
+    updated = connection.execute(text("""
+        UPDATE average_cei SET average_cei = :average_cei WHERE country_code = :country_code
+    """), params)
+    if updated.rowcount == 0:
+        connection.execute(text("""
+            INSERT INTO average_cei (country_code, average_cei) VALUES (:country_code, :average_cei)
+        """), params)
+
+
+def update_average_cei(engine, country_code, df: pd.DataFrame, source_tables=SOURCE_TABLES,
+                       baseline=BASELINE, window_days=WINDOW_DAYS):
+    """Updates the baselines after emissions rows of a country were upserted
+
+    The per-day state of the UTC days touched by `df` is rebuilt from the stored rows,
+    and only the difference to the previous state is added to the running totals.
+    The cost depends on the number of new rows, not on the history stored. A country
+    without totals yet (new tables or a new country) is rebuilt from its whole history
+    first, so the baseline never starts from the rows of a single write.
+    """
+    if df.empty:
+        return
+    ensure_tables(engine)
+    index = df.index.tz_convert("UTC") if df.index.tz is not None else df.index
+    first_day, last_day = index.min().date(), index.max().date()
+    with engine.begin() as connection:
+        if not _has_totals(connection, country_code):
+            _rebuild_country(connection, source_tables, country_code)
+            refresh(connection, country_code, baseline, window_days)
+            return
+        old = _hourly_sums(connection, country_code, first_day, last_day)
+        _rebuild_days(connection, source_tables, country_code, first_day, last_day)
+        new = _hourly_sums(connection, country_code, first_day, last_day)
+        for hour, (total, samples) in _deltas(old, new).items():
+            connection.execute(text(f"""
+                INSERT INTO {TOTALS_TABLE} (country_code, hour, total, samples)
+                VALUES (:country_code, :hour, :total, :samples)
+                ON CONFLICT (country_code, hour) DO UPDATE
+                SET total = {TOTALS_TABLE}.total + EXCLUDED.total,
+                    samples = {TOTALS_TABLE}.samples + EXCLUDED.samples
+            """), {"country_code": country_code, "hour": hour,
+                   "total": total, "samples": samples})
+        refresh(connection, country_code, baseline, window_days)
+
+
+def rebuild_average_cei(engine, country_code, source_tables=SOURCE_TABLES,
+                        baseline=BASELINE, window_days=WINDOW_DAYS):
+    """Full rebuild of the state of a country, e.g. after its emissions were recomputed"""
+    ensure_tables(engine)
+    with engine.begin() as connection:
+        _rebuild_country(connection, source_tables, country_code)
+        refresh(connection, country_code, baseline, window_days)
@@ -0,0 +1,199 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from functools import partial
+
+import pandas as pd
+from entsoe.exceptions import NoMatchingDataError
+from sqlalchemy import text
+
+from src.db_cleanup import upsert_dataframe
+from src.entsoe_collector import Generation, Load, Prices, configure_entsoe_limiter
+from src.factor_store import EmissionFactors
+
+logger = logging.getLogger("Data_Loader")
+
+CHECKPOINT_TABLE = "backfill_checkpoints"
+CHUNK_FREQUENCIES = {"month": "MS", "quarter": "QS"}
+# use the streaming XML parser for generation and load chunks
+STREAMING = True
+# ENTSO-E request budget of a backfill; the API key allows 400 per minute in total and the
+# live loaders already use up to ENTSOE_REQUESTS_PER_MINUTE (300) of it
+REQUESTS_PER_MINUTE = int(os.environ.get("BACKFILL_REQUESTS_PER_MINUTE", 60))
+
+
+def fetch_generation(start_date, end_date, country_code, factors=None) -> dict[str, pd.DataFrame]:
+    generation, emissions = Generation(
+        start_date, end_date, country_code, STREAMING,
+        factors=factors).fetch_process_and_calculate_emissions()
+    generation.columns = generation.columns.str.lower()
+    return {"generation_historical": generation, "emissions_historical": emissions}
+
+
+def fetch_load(start_date, end_date, country_code) -> dict[str, pd.DataFrame]:
+    return {"load_historical": Load(start_date, end_date, country_code, STREAMING).fetch()}
+
+
+def fetch_prices(start_date, end_date, country_code) -> dict[str, pd.DataFrame]:
+    return {"prices_historical": Prices(start_date, end_date, country_code).fetch()}
+
+
+# dataset name -> function returning the frames of a chunk keyed by target table
+DATASETS = {
+    "generation": fetch_generation,
+    "load": fetch_load,
+    "prices": fetch_prices,
+}
+
+
+def split_range(start_date, end_date, chunk="month") -> list[tuple[pd.Timestamp, pd.Timestamp]]:
+    """Splits [start_date, end_date) into calendar month or quarter chunks"""
+    bounds = pd.date_range(start_date, end_date, freq=CHUNK_FREQUENCIES[chunk])
+    bounds = [start_date] + [b for b in bounds if start_date < b < end_date] + [end_date]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+@dataclass(frozen=True)
+class BackfillChunk(object):
+    """One unit of backfill work: a dataset of a country over one chunk"""
+
+    dataset: str
+    country_code: str
+    start_date: pd.Timestamp
+    end_date: pd.Timestamp
+
+
+class Backfill(object):
+    """Resumable historical backfill
+
+    The range is split into chunks that are fetched in parallel, written to the
+    *_historical tables as soon as they arrive and recorded in the checkpoint table.
+    A new run skips every chunk already marked as done.
+
+    Attributes
+    ----------
+    engine : sqlalchemy.engine.Engine
+        engine of the database to fill
+    chunk : str
+        'month' or 'quarter'
+    max_workers : int
+        number of chunks fetched concurrently
+    requests_per_minute : float
+        ENTSO-E request budget, applied to the process-wide limiter
+    factors : EmissionFactors
+        emission factor version of the emissions, the latest one stored
+    """
+
+    def __init__(self, engine, chunk="month", max_workers=4,
+                 requests_per_minute=REQUESTS_PER_MINUTE):
+        self.engine = engine
+        self.chunk = chunk
+        self.max_workers = max_workers
+        configure_entsoe_limiter(requests_per_minute, max_concurrency=max_workers)
+        self.ensure_checkpoint_table()
+        self.factors = EmissionFactors.load(engine)
+
+    def ensure_checkpoint_table(self):
+        with self.engine.begin() as connection:
+            connection.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                    dataset TEXT NOT NULL,
+                    country_code TEXT NOT NULL,
+                    chunk_start TIMESTAMPTZ NOT NULL,
+                    chunk_end TIMESTAMPTZ NOT NULL,
+                    status TEXT NOT NULL,
+                    rows INTEGER,
+                    error TEXT,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                    PRIMARY KEY (dataset, country_code, chunk_start, chunk_end)
+                )
+            """))
+
+    def completed(self, country_code) -> set[tuple[str, pd.Timestamp, pd.Timestamp]]:
+        """Returns (dataset, chunk_start, chunk_end) of the chunks already done for a country"""
+        query = text(f"""
+            SELECT dataset, chunk_start, chunk_end
+            FROM {CHECKPOINT_TABLE}
+            WHERE country_code = :country_code AND status IN ('done', 'empty')
+        """)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query, {"country_code": country_code})
+            return {(row.dataset, pd.Timestamp(row.chunk_start), pd.Timestamp(row.chunk_end))
+                    for row in rows}
+
+    def checkpoint(self, chunk: BackfillChunk, status, rows=None, error=None):
+        query = text(f"""
+            INSERT INTO {CHECKPOINT_TABLE}
+                (dataset, country_code, chunk_start, chunk_end, status, rows, error, updated_at)
+            VALUES (:dataset, :country_code, :chunk_start, :chunk_end, :status, :rows, :error, now())
+            ON CONFLICT (dataset, country_code, chunk_start, chunk_end)
+            DO UPDATE SET status = EXCLUDED.status, rows = EXCLUDED.rows,
+                          error = EXCLUDED.error, updated_at = now()
+        """)
+        with self.engine.begin() as connection:
+            connection.execute(query, {
+                "dataset": chunk.dataset, "country_code": chunk.country_code,
+                "chunk_start": chunk.start_date, "chunk_end": chunk.end_date,
+                "status": status, "rows": rows, "error": error,
+            })
+
+    def plan(self, country_code, timezone, start_date, end_date, datasets) -> list[BackfillChunk]:
+        """Returns the chunks of a country that still have to be fetched"""
+        start_date = pd.Timestamp(start_date, tz=timezone)
+        end_date = pd.Timestamp(end_date, tz=timezone)
+        done = self.completed(country_code)
+        chunks = []
+        for dataset in datasets:
+            for chunk_start, chunk_end in split_range(start_date, end_date, self.chunk):
+                if (dataset, chunk_start, chunk_end) not in done:
+                    chunks.append(BackfillChunk(dataset, country_code, chunk_start, chunk_end))
+        return chunks
+
+    def run_chunk(self, chunk: BackfillChunk) -> int:
+        try:
+            fetch = DATASETS[chunk.dataset]
+            if fetch is fetch_generation:
+                fetch = partial(fetch_generation, factors=self.factors)
+            frames = fetch(chunk.start_date, chunk.end_date, chunk.country_code)
+        except NoMatchingDataError:
+            self.checkpoint(chunk, "empty", rows=0)
+            return 0
+        rows = 0
+        for table_name, df in frames.items():
+            df["country_code"] = chunk.country_code
+            upsert_dataframe(df, self.engine, table_name)
+            rows = max(rows, len(df))
+        self.checkpoint(chunk, "done", rows=rows)
+        return rows
+
+    def run(self, countries, start_date, end_date, datasets=tuple(DATASETS)) -> dict[str, int]:
+        """Backfills all countries
+
+        Parameters:
+            countries (list): (country, country code, capital city, timezone) tuples
+            start_date, end_date: range to backfill
+            datasets (tuple): names from DATASETS
+
+        Returns:
+            summary (dict): number of chunks per status
+        """
+        chunks = []
+        for country in countries:
+            chunks += self.plan(country[1], country[3], start_date, end_date, datasets)
+        logger.info(f"backfilling {len(chunks)} chunks")
+        summary = {"done": 0, "failed": 0}
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="backfill") as pool:
+            futures = {pool.submit(self.run_chunk, chunk): chunk for chunk in chunks}
+            for future in as_completed(futures):
+                chunk = futures[future]
+                try:
+                    rows = future.result()
+                    summary["done"] += 1
+                    logger.info(f"{chunk.dataset} {chunk.country_code} "
+                                f"{chunk.start_date:%Y-%m-%d}..{chunk.end_date:%Y-%m-%d}: {rows} rows")
+                except Exception as e:
+                    summary["failed"] += 1
+                    logger.exception(f"chunk {chunk} failed: {e}")
+                    self.checkpoint(chunk, "failed", error=repr(e))
+        return summary
@@ -0,0 +1,184 @@
+import logging
+import os
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.forecast_calculator import DAYS_FORECAST, DAYS_HISTORY, FEATURES, TARGET
+from src.forecasters import build_forecaster
+from src.weather_store import WeatherHistoryStore
+
+logger = logging.getLogger("Data_Loader")
+
+HORIZON_HOURS = DAYS_FORECAST * 24
+# model configurations compared by default: the name of the forecaster in
+# src.forecasters.FORECASTERS (xgboost when missing) and its parameters
+MODEL_CONFIGS: dict[str, dict] = {
+    "xgboost": {},
+    "xgboost_shallow": {"max_depth": 3, "learning_rate": 0.05},
+    "seasonal_naive": {"forecaster": "seasonal_naive"},
+    "ridge": {"forecaster": "ridge"},
+}
+
+
+def load_country_history(engine, country_code, city, tz, start_date, end_date,
+                         table_name="emissions_historical") -> pd.DataFrame:
+    """Hourly carbon intensity joined with the stored weather of the capital, local time
+
+    Only weather already in weather_historical is used, nothing is requested.
+    """
+    query = text(f"""
+        SELECT date_trunc('hour', "index") AS time, avg("{TARGET}") AS target
+        FROM "{table_name}"
+        WHERE country_code = :country_code AND "index" >= :start AND "index" < :end
+        GROUP BY 1
+        ORDER BY 1
+    """)
+    with engine.connect() as connection:
+        rows = connection.execute(query, {"country_code": country_code,
+                                          "start": start_date, "end": end_date}).fetchall()
+    index = pd.DatetimeIndex([row.time for row in rows]).tz_convert(tz)
+    target = pd.Series([row.target for row in rows], index=index, dtype=np.float64, name=TARGET)
+    weather = WeatherHistoryStore(engine).load(city, tz, start_date, end_date)
+    history = target.to_frame().join(weather, how="inner")
+    history['hour'] = history.index.hour
+    history['dayofweek'] = history.index.dayofweek
+    return history
+
+
+def rolling_origins(index: pd.DatetimeIndex, days_history=DAYS_HISTORY,
+                    horizon_hours=HORIZON_HOURS, step_hours=24) -> list[pd.Timestamp]:
+    """Forecast origins every `step_hours` with a full history before and a full horizon after"""
+    first = index.min().ceil("h") + pd.Timedelta(days=days_history)
+    last = index.max() - pd.Timedelta(hours=horizon_hours - 1)
+    if first > last:
+        return []
+    return list(pd.date_range(first, last, freq=f"{step_hours}h"))
+
+
+def backtest_origin(config_name, params, country_code, train: pd.DataFrame,
+                    test: pd.DataFrame, origin: pd.Timestamp) -> dict:
+    """Fits one model configuration on the history before an origin and scores its
+    forecast of the hours after it; runs in a worker process
+    """
+    params = dict(params)
+    model = build_forecaster(params.pop("forecaster", "xgboost"), n_jobs=1, **params)
+    report = model.fit(train[FEATURES], train[TARGET])
+    predict_start = time.perf_counter()
+    prediction = model.predict(test[FEATURES])
+    predict_seconds = time.perf_counter() - predict_start
+    lead = ((test.index - origin) / pd.Timedelta(hours=1)).astype(int) + 1
+    return {
+        "config": config_name,
+        "country_code": country_code,
+        "origin": origin,
+        "lead": np.asarray(lead),
+        "error": prediction - test[TARGET].to_numpy(),
+        "fit_seconds": report["fit_seconds"],
+        "best_iteration": report.get("best_iteration", np.nan),
+        "predict_seconds": predict_seconds,
+        # peak resident memory of the worker in MB (ru_maxrss is in KB on Linux)
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+@dataclass
+class BacktestResult(object):
+    """Errors per forecast lead time and cost per model configuration"""
+
+    runs: list[dict] = field(default_factory=list)
+
+    def by_horizon(self) -> pd.DataFrame:
+        """MAE and RMSE per configuration and lead time in hours"""
+        frames = [pd.DataFrame({"config": run["config"], "lead": run["lead"],
+                                "error": run["error"]}) for run in self.runs]
+        if not frames:
+            return pd.DataFrame(columns=["config", "lead", "mae", "rmse", "samples"])
+        errors = pd.concat(frames, ignore_index=True)
+        errors["abs"] = errors["error"].abs()
+        errors["squared"] = errors["error"] ** 2
+        grouped = errors.groupby(["config", "lead"])
+        return pd.DataFrame({
+            "mae": grouped["abs"].mean(),
+            "rmse": np.sqrt(grouped["squared"].mean()),
+            "samples": grouped.size(),
+        }).reset_index()
+
+    def summary(self) -> pd.DataFrame:
+        """Accuracy over all lead times next to fit and predict latency and peak memory"""
+        if not self.runs:
+            return pd.DataFrame()
+        runs = pd.DataFrame([{key: value for key, value in run.items()
+                              if key not in ("lead", "error")} for run in self.runs])
+        errors = pd.DataFrame({
+            "config": np.concatenate([[run["config"]] * len(run["error"]) for run in self.runs]),
+            "error": np.concatenate([run["error"] for run in self.runs]),
+        })
+        accuracy = errors.groupby("config")["error"].agg(
+            mae=lambda e: e.abs().mean(), rmse=lambda e: np.sqrt((e ** 2).mean()))
+        cost = runs.groupby("config").agg(
+            origins=("origin", "size"),
+            fit_seconds_mean=("fit_seconds", "mean"),
+            fit_seconds_p95=("fit_seconds", lambda s: s.quantile(0.95)),
+            predict_ms_mean=("predict_seconds", lambda s: s.mean() * 1e3),
+            best_iteration_mean=("best_iteration", "mean"),
+            peak_memory_mb=("peak_memory_mb", "max"),
+        )
+        return accuracy.join(cost)
+
+
+def run_backtest(engine, countries, start_date, end_date, configs=None,
+                 days_history=DAYS_HISTORY, step_hours=24, max_workers=None,
+                 table_name="emissions_historical") -> BacktestResult:
+    """Replays rolling forecast origins over stored history for every configuration
+
+    At each origin a model is trained on the `days_history` days before it and predicts
+    the next `HORIZON_HOURS` hours. The observed weather stands in for the weather
+    forecast, so the errors are those of the model alone, without weather forecast error.
+    Every configuration runs on its own process pool so the peak memory of the workers
+    belongs to that configuration. Only per-country models on FEATURES are replayed; the
+    feature-store and global models of the loaders are not covered.
+
+    Parameters:
+        countries (list): (country, country code, capital city, timezone) tuples
+        start_date, end_date: range of stored history to replay
+        configs (dict): name -> forecaster name and parameters, MODEL_CONFIGS by default
+        step_hours (int): hours between two origins
+        max_workers (int): processes per pool, the number of CPUs by default
+    """
+    configs = configs or MODEL_CONFIGS
+    histories = {}
+    for country, country_code, city, tz in countries:
+        history = load_country_history(engine, country_code, city, tz, pd.Timestamp(start_date, tz=tz),
+                                       pd.Timestamp(end_date, tz=tz), table_name)
+        if history.empty:
+            logger.warning(f"backtest: no history stored for {country_code}")
+            continue
+        histories[country_code] = history
+
+    result = BacktestResult()
+    for config_name, params in configs.items():
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count()) as pool:
+            futures = []
+            for country_code, history in histories.items():
+                for origin in rolling_origins(history.index, days_history, HORIZON_HOURS, step_hours):
+                    train = history[(history.index >= origin - pd.Timedelta(days=days_history))
+                                    & (history.index < origin)]
+                    test = history[(history.index >= origin)
+                                   & (history.index < origin + pd.Timedelta(hours=HORIZON_HOURS))]
+                    futures.append(pool.submit(backtest_origin, config_name, params,
+                                               country_code, train, test, origin))
+            for future in as_completed(futures):
+                try:
+                    result.runs.append(future.result())
+                except Exception as e:
+                    logger.exception(f"backtest of {config_name} failed: {e}")
+        logger.info(f"backtest of {config_name}: {len(futures)} origins in "
+                    f"{time.perf_counter() - start:.1f}s")
+    return result
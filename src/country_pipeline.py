@@ -0,0 +1,313 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import pandas as pd
+from entsoe.exceptions import NoMatchingDataError
+from sqlalchemy import create_engine
+
+from src.average_cei import update_average_cei
+from src.db_cleanup import upsert_dataframe
+from src.entsoe_collector import Generation, Load, Prices
+from src.factor_store import EmissionFactors
+from src.feature_store import FeatureStore
+from src.fetch_cache import FetchCache
+from src.rollups import ROLLUP_TABLES, update_rollups
+from src.forecast_calculator import Next3DaysForecast
+from src.forecasters import N_JOBS
+from src.model_store import ModelStore, RetrainPolicy
+from src.watermark import LOOKBACK, fetch_window
+from src.weather_store import WeatherHistoryStore
+from src.weatherapi_collector import WeatherForecast
+
+logger = logging.getLogger("Data_Loader")
+
+DAYS_FORECAST = 1
+# stages that do not depend on each other and can run side by side
+INDEPENDENT_STAGES = ("generation", "load", "prices", "weather")
+
+
+@dataclass
+class CountryJob(object):
+    """Everything a single country run needs
+
+    Attributes
+    ----------
+    country : str
+        country for which data will be fetched
+    country_code : str
+        ISO 3166 ALPHA-2 country code
+    city : str
+        city for which weather data will be fetched
+    timezone : str
+        timezone identifier (example: Europe/Brussels)
+    start_date : pd.Timestamp
+        start date of data
+    end_date : pd.Timestamp
+        end date of data
+    engine : sqlalchemy.engine.Engine
+        engine used to write the results
+    new_db : bool
+        append with plain `to_sql` instead of upserting into the table
+    time_periods : bool
+        compute low-carbon time periods after the forecast
+    incremental : bool
+        start the ENTSO-E requests at the latest stored timestamp minus `lookback`
+        instead of `start_date`, and overwrite the re-fetched rows
+    lookback : pd.Timedelta
+        look-back before the stored watermark for late revisions
+    cache : FetchCache
+        frames fetched by the stages of this run, reused by the forecast stage
+    weather_forecast : pd.DataFrame
+        weather forecast fetched beforehand (e.g. in one batch for all capitals),
+        the weather stage requests it itself when not set
+    native_resolution : bool
+        store generation and emissions at the resolution ENTSO-E publishes
+        (15 minutes for some countries) instead of hourly
+    rollups : bool
+        maintain the hourly, daily and monthly rollups of the buckets touched by each write
+    average_cei : bool
+        update the average_cei baselines whenever emissions are written
+    model_store : ModelStore
+        reuse the stored forecast model of the country instead of training on every run
+    retrain_policy : RetrainPolicy
+        when the stored forecast model is trained again
+    feature_store : FeatureStore
+        train the forecast model on the materialized features of the country
+    forecast_data : pd.DataFrame
+        carbon intensity forecast computed beforehand (e.g. by the global model for all
+        countries), the forecast stage trains the model of the country when not set
+    n_jobs : int
+        XGBoost threads of the forecast training; with several countries in flight this
+        should be the cores divided by the number of countries
+    factors : EmissionFactors
+        emission factor version the emissions are computed with, loaded once per run so
+        a version stored by recompute_emissions.py is picked up by the next run
+    """
+
+    country: str
+    country_code: str
+    city: str
+    timezone: str
+    start_date: pd.Timestamp
+    end_date: pd.Timestamp
+    engine: object
+    new_db: bool = False
+    time_periods: bool = True
+    incremental: bool = False
+    lookback: pd.Timedelta = LOOKBACK
+    cache: FetchCache = field(default_factory=FetchCache)
+    weather_forecast: pd.DataFrame = None
+    native_resolution: bool = False
+    rollups: bool = True
+    average_cei: bool = True
+    model_store: ModelStore = None
+    retrain_policy: RetrainPolicy = None
+    feature_store: FeatureStore = None
+    forecast_data: pd.DataFrame = None
+    n_jobs: int = N_JOBS
+    factors: EmissionFactors = None
+
+    def window(self, table_name: str) -> tuple[pd.Timestamp, pd.Timestamp]:
+        if not self.incremental or self.new_db:
+            return self.start_date, self.end_date
+        return fetch_window(self.engine, table_name, self.country_code,
+                            self.start_date, self.end_date, lookback=self.lookback)
+
+    def write(self, df: pd.DataFrame, table_name: str, index_label: str = "index") -> int:
+        df["country_code"] = self.country_code
+        if self.new_db:
+            df.to_sql(name=table_name, con=self.engine, if_exists="append")
+        else:
+            on_conflict = "update" if self.incremental else "nothing"
+            upsert_dataframe(df, self.engine, table_name, index_label,
+                             on_conflict=on_conflict)
+            if self.rollups and table_name in ROLLUP_TABLES:
+                update_rollups(self.engine, table_name, df, self.country_code,
+                               tz=self.timezone, index_label=index_label)
+            if self.average_cei and table_name == "emissions":
+                update_average_cei(self.engine, self.country_code, df)
+        return len(df)
+
+
+@dataclass
+class CountryResult(object):
+    """Summary of a single country run: rows written and errors per stage"""
+
+    country: str
+    country_code: str
+    rows: dict[str, int] = field(default_factory=dict)
+    errors: dict[str, str] = field(default_factory=dict)
+    elapsed: float = 0.0
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def __str__(self) -> str:
+        status = "ok" if self.ok else f"failed stages: {', '.join(self.errors)}"
+        return (f"{self.country_code} ({self.country}) {status} in {self.elapsed:.1f}s, "
+                f"rows: {self.rows}")
+
+
+def stage_generation(job: CountryJob) -> int:
+    # both tables are written from one request, which starts at the older watermark so a
+    # failed emissions write is refilled even when the generation rows were stored
+    generation_start, end_date = job.window("generation")
+    emissions_start, _ = job.window("emissions")
+    start_date = min(generation_start, emissions_start)
+    if start_date >= end_date:
+        return 0
+    generation, emissions = Generation(
+        start_date, end_date, job.country_code,
+        native_resolution=job.native_resolution,
+        factors=job.factors,
+    ).fetch_process_and_calculate_emissions()
+    job.cache.put("emissions", job.country_code, start_date, end_date, emissions.copy())
+    generation.columns = generation.columns.str.lower()
+    rows = job.write(generation, "generation")
+    job.write(emissions, "emissions")
+    return rows
+
+
+def stage_load(job: CountryJob) -> int:
+    start_date, end_date = job.window("load")
+    if start_date >= end_date:
+        return 0
+    load: pd.DataFrame = Load(start_date, end_date, job.country_code).fetch()
+    return job.write(load, "load")
+
+
+def stage_prices(job: CountryJob) -> int:
+    start_date, end_date = job.window("prices")
+    if start_date >= end_date:
+        return 0
+    prices: pd.DataFrame = Prices(start_date, end_date, job.country_code).fetch()
+    return job.write(prices, "prices")
+
+
+def stage_weather(job: CountryJob) -> int:
+    if job.weather_forecast is not None and not job.weather_forecast.empty:
+        forecast = job.weather_forecast.copy()
+    else:
+        forecast = WeatherForecast(job.city, job.timezone, DAYS_FORECAST).fetch()
+    return job.write(forecast, "forecast", "time")
+
+
+def stage_forecast(job: CountryJob) -> int:
+    if job.forecast_data is not None:
+        forecast_data = job.forecast_data.copy()
+    else:
+        forecast_data, historical_data = Next3DaysForecast(
+            job.country_code, job.country, job.city, job.timezone,
+            cache=job.cache,
+            engine=None if job.new_db else job.engine,
+            weather_store=None if job.new_db else WeatherHistoryStore(job.engine),
+            model_store=job.model_store,
+            retrain_policy=job.retrain_policy,
+            feature_store=job.feature_store,
+            n_jobs=job.n_jobs,
+            factors=job.factors,
+        ).train_and_predict()
+    rows = job.write(forecast_data, "forecast_data", "time")
+    if job.time_periods and job.country_code != "DE":
+        from time_periods import create_time_periods
+        create_time_periods(job.country_code, job.engine)
+    return rows
+
+
+STAGES = {
+    "generation": stage_generation,
+    "load": stage_load,
+    "prices": stage_prices,
+    "weather": stage_weather,
+    "forecast": stage_forecast,
+}
+
+
+def _run_stage(job: CountryJob, stage: str, result: CountryResult):
+    logger.info(f"running {stage} stage from {job.start_date} to {job.end_date} "
+                f"for a country {job.country}")
+    try:
+        result.rows[stage] = STAGES[stage](job)
+    except NoMatchingDataError:
+        # the window since the watermark is too short to hold a published value yet
+        logger.info(f"no new {stage} data for {job.country_code}")
+        result.rows[stage] = 0
+    except Exception as e:
+        logger.exception(f"error in {stage} stage for {job.country_code}: {e}")
+        result.errors[stage] = repr(e)
+
+
+def run_country(job: CountryJob, stage_workers: int = len(INDEPENDENT_STAGES),
+                stages=tuple(STAGES)) -> CountryResult:
+    """Runs the stages of one country; the independent ones in parallel, the forecast last.
+    A failing stage is recorded in the result and never stops the other stages.
+    """
+    start = time.time()
+    result = CountryResult(job.country, job.country_code)
+    independent = [s for s in stages if s in INDEPENDENT_STAGES]
+    if stage_workers > 1 and len(independent) > 1:
+        with ThreadPoolExecutor(max_workers=stage_workers,
+                                thread_name_prefix=f"{job.country_code}-stage") as pool:
+            list(pool.map(lambda s: _run_stage(job, s, result), independent))
+    else:
+        for stage in independent:
+            _run_stage(job, stage, result)
+    for stage in stages:
+        if stage not in INDEPENDENT_STAGES:
+            _run_stage(job, stage, result)
+    result.elapsed = time.time() - start
+    return result
+
+
+def database_connections(max_workers: int = 8,
+                         stage_workers: int = len(INDEPENDENT_STAGES)) -> int:
+    """Connections needed by `run_countries`: every stage thread of every country in
+    flight writes at the same time
+    """
+    return max_workers * max(1, stage_workers)
+
+
+def pipeline_engine(url: str, max_workers: int = 8,
+                    stage_workers: int = len(INDEPENDENT_STAGES), **kwargs):
+    """Engine whose pool holds a connection for every stage `run_countries` runs at
+    once with these worker counts, the overflow covers writes holding two
+    """
+    connections = database_connections(max_workers, stage_workers)
+    return create_engine(url, pool_recycle=3600, pool_size=connections,
+                         max_overflow=connections, **kwargs)
+
+
+def forecast_threads(max_workers: int = 8) -> int:
+    """XGBoost threads per country so the trainings of the countries in flight do not
+    oversubscribe the cores; FORECAST_N_JOBS takes precedence when it is set
+    """
+    return N_JOBS or max(1, (os.cpu_count() or 1) // max_workers)
+
+
+def run_countries(jobs: list[CountryJob], max_workers: int = 8,
+                  stage_workers: int = len(INDEPENDENT_STAGES),
+                  stages=tuple(STAGES)) -> list[CountryResult]:
+    """Runs several countries with at most `max_workers` of them in flight at once.
+    Up to `max_workers * stage_workers` stages write to the database at the same time,
+    the engine pool has to be sized for it (see `database_connections`).
+
+    Returns:
+        results (list[CountryResult]): one summary per country, in the order of `jobs`
+    """
+    results: dict[str, CountryResult] = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="country") as pool:
+        futures = {pool.submit(run_country, job, stage_workers, stages): job for job in jobs}
+        for future in as_completed(futures):
+            job = futures[future]
+            try:
+                results[job.country_code] = future.result()
+            except Exception as e:
+                logger.exception(f"country run failed for {job.country_code}: {e}")
+                results[job.country_code] = CountryResult(
+                    job.country, job.country_code, errors={"run": repr(e)})
+            logger.info(str(results[job.country_code]))
+    return [results[job.country_code] for job in jobs]
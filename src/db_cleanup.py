@@ -1,7 +1,39 @@
+import io
+import logging
+import threading
+
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import sessionmaker
 
+logger = logging.getLogger("Data_Loader")
+
+# conflict target of every table written by the loaders
+UPSERT_KEYS: dict[str, tuple[str, ...]] = {
+    "generation": ("index", "country_code"),
+    "emissions": ("index", "country_code"),
+    "load": ("index", "country_code"),
+    "prices": ("index", "country_code"),
+    "forecast": ("time", "country_code"),
+    "forecast_data": ("time", "country_code"),
+    "time_periods": ("date", "start", "country_code"),
+    "generation_historical": ("index", "country_code"),
+    "emissions_historical": ("index", "country_code"),
+    "load_historical": ("index", "country_code"),
+    "prices_historical": ("index", "country_code"),
+    "weather_historical": ("time", "city"),
+    "forecast_features": ("time", "country_code"),
+}
+# tables whose rows are replaced as a set: all stored rows sharing these columns with a
+# written row are deleted first (e.g. all periods of a country and day)
+REPLACE_KEYS: dict[str, tuple[str, ...]] = {
+    "time_periods": ("date", "country_code"),
+}
+
+_prepared_tables: set[str] = set()
+_prepared_lock = threading.Lock()
+
 def insert_dataframe(df, engine):
     with engine.connect() as connection:
         for index, row in df.iterrows():
@@ -56,4 +88,117 @@ def update_dataframe(df, engine, country_code, table_name, index_label='index'):
         new_df.index.name = "time"
     # Take only the rows that exist in df and don't exist in db_df
     # Write these rows to the database
-    new_df.to_sql(name=table_name, con=engine, if_exists='append')
\ No newline at end of file
+    new_df.to_sql(name=table_name, con=engine, if_exists='append')
+
+
+def deduplicate_table(engine, table_name, key_columns) -> int:
+    """Deletes the rows sharing their key with a row stored after them, keeping the
+    last one written. One-off migration of tables filled by plain `to_sql` appends
+    before they had a unique index.
+
+    Returns:
+        rows (int): number of rows deleted
+    """
+    match = " AND ".join(f'a."{col}" = b."{col}"' for col in key_columns)
+    with engine.begin() as connection:
+        result = connection.execute(text(
+            f'DELETE FROM "{table_name}" a USING "{table_name}" b WHERE a.ctid < b.ctid AND {match}'))
+    return result.rowcount
+
+
+def prepare_table(engine, df, table_name, key_columns):
+    """Creates the table from the frame if it does not exist yet and makes sure the
+    unique index used as conflict target by `upsert_dataframe` is there.
+    Duplicate keys in an existing table are removed first (see `deduplicate_table`).
+    Checked once per table and process.
+    """
+    with _prepared_lock:
+        if table_name in _prepared_tables:
+            return
+        if not inspect(engine).has_table(table_name):
+            df.head(0).to_sql(name=table_name, con=engine, index=False)
+        index_name = f"{table_name}_{'_'.join(key_columns)}_key"
+        columns = ", ".join(f'"{col}"' for col in key_columns)
+        create_index = text(
+            f'CREATE UNIQUE INDEX IF NOT EXISTS "{index_name}" ON "{table_name}" ({columns})')
+        try:
+            with engine.begin() as connection:
+                connection.execute(create_index)
+        except IntegrityError:
+            logger.warning(f"duplicate ({', '.join(key_columns)}) keys in {table_name}, "
+                           f"removing them before creating the unique index")
+            rows = deduplicate_table(engine, table_name, key_columns)
+            logger.warning(f"removed {rows} duplicate rows from {table_name}")
+            with engine.begin() as connection:
+                connection.execute(create_index)
+        _prepared_tables.add(table_name)
+
+
+def upsert_dataframe(df, engine, table_name, index_label='index', key_columns=None,
+                     on_conflict='nothing', replace_columns=None):
+    """Bulk writes a dataframe: the rows are streamed with COPY into a temporary staging
+    table and merged server-side with INSERT ... ON CONFLICT, so the cost depends on the
+    size of the frame and not on the rows already stored in the window.
+    For tables in REPLACE_KEYS the stored rows of every partition written are deleted
+    in the same transaction, so rows that are not produced anymore do not pile up.
+
+    Parameters:
+        df (pd.DataFrame): rows to write, indexed by timestamp (or date for time_periods)
+        engine (sqlalchemy.engine.Engine): psycopg2 engine
+        table_name (str): target table
+        index_label (str): name of the column the index is written to
+        key_columns (tuple): conflict target, defaults to UPSERT_KEYS[table_name]
+        on_conflict (str): 'nothing' keeps the stored rows (same as update_dataframe),
+            'update' overwrites them with the new values
+        replace_columns (tuple): partition columns replaced as a whole, defaults to
+            REPLACE_KEYS[table_name]
+
+    Returns:
+        rows (int): number of rows inserted or updated
+    """
+    if df.empty:
+        return 0
+    key_columns = tuple(key_columns or UPSERT_KEYS.get(table_name, (index_label, "country_code")))
+    replace_columns = tuple(replace_columns or REPLACE_KEYS.get(table_name, ()))
+    frame = df.rename_axis(index_label).reset_index()
+    frame = frame.drop_duplicates(subset=list(key_columns), keep="last")
+    prepare_table(engine, frame, table_name, key_columns)
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+
+    stage = f"{table_name}_stage"
+    columns = ", ".join(f'"{col}"' for col in frame.columns)
+    conflict = ", ".join(f'"{col}"' for col in key_columns)
+    if on_conflict == 'update':
+        updates = ", ".join(f'"{col}" = EXCLUDED."{col}"'
+                            for col in frame.columns if col not in key_columns)
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+    else:
+        action = "DO NOTHING"
+
+    connection = engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(
+            f'CREATE TEMP TABLE "{stage}" (LIKE "{table_name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+        cursor.copy_expert(f'COPY "{stage}" ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+        if replace_columns:
+            partitions = ", ".join(f'"{col}"' for col in replace_columns)
+            match = " AND ".join(f'"{table_name}"."{col}" = p."{col}"' for col in replace_columns)
+            cursor.execute(
+                f'DELETE FROM "{table_name}" USING (SELECT DISTINCT {partitions} FROM "{stage}") p '
+                f'WHERE {match}')
+        cursor.execute(
+            f'INSERT INTO "{table_name}" ({columns}) SELECT {columns} FROM "{stage}" '
+            f'ON CONFLICT ({conflict}) {action}')
+        rows = cursor.rowcount
+        cursor.close()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+    return rows
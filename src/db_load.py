@@ -1,15 +1,35 @@
 import datetime
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import ASCENDING, DeleteMany, MongoClient, UpdateOne
+from pymongo.errors import OperationFailure
+import logging
 import os
 from bson import ObjectId
+import threading
 import time
 
 load_dotenv()
+
+BULK_CHUNK_SIZE = 1000
+POSTED_BY_ID = ObjectId('637912d934603726adcbc31c')
+
+logger = logging.getLogger("Data_Loader")
+
+_db_client = None
+_indexed_collections: set[str] = set()
+_indexed_lock = threading.Lock()
+
 def get_db_client() -> MongoClient:
     db_client: MongoClient = MongoClient(os.environ["CONNECTION_STRING"])
     return db_client
 
+def get_shared_db_client() -> MongoClient:
+    """Returns one client per process; MongoClient is thread-safe and pools its connections"""
+    global _db_client
+    if _db_client is None:
+        _db_client = get_db_client()
+    return _db_client
+
 def load_to_db(df, country):
     start = time.time()
     meta_acc = 'Metadata_Acceptance'
@@ -77,4 +97,100 @@ def load_forecast_to_db(df, country):
         print('Nothing to add!')
     end = time.time()
     elapsed_time = end-start
-    return elapsed_time
\ No newline at end of file
+    return elapsed_time
+
+def deduplicate_collection(collection, key_fields) -> int:
+    """Deletes the datapoints sharing their key with another one, keeping the one with
+    the highest _id (the last inserted). One-off migration of collections filled by
+    load_to_db before they had a unique index.
+
+    Returns:
+        documents (int): number of documents deleted
+    """
+    duplicates = collection.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": {field: f"${field}" for field in key_fields},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True)
+    operations = [DeleteMany({"_id": {"$in": group["ids"][:-1]}}) for group in duplicates]
+    deleted = 0
+    for i in range(0, len(operations), BULK_CHUNK_SIZE):
+        deleted += collection.bulk_write(operations[i:i + BULK_CHUNK_SIZE], ordered=False).deleted_count
+    return deleted
+
+def ensure_unique_index(collection, key_fields):
+    """Creates the unique index the bulk upserts match on. Duplicate keys left by
+    load_to_db are removed first (see deduplicate_collection).
+    Checked once per collection and process.
+    """
+    with _indexed_lock:
+        if collection.name in _indexed_collections:
+            return
+        keys = [(field, ASCENDING) for field in key_fields]
+        try:
+            collection.create_index(keys, unique=True)
+        except OperationFailure as e:
+            logger.warning(f"could not create the unique ({', '.join(key_fields)}) index on "
+                           f"{collection.name} ({e}), removing duplicate datapoints")
+            deleted = deduplicate_collection(collection, key_fields)
+            logger.warning(f"removed {deleted} duplicate datapoints from {collection.name}")
+            collection.create_index(keys, unique=True)
+        _indexed_collections.add(collection.name)
+
+def _bulk_upsert(collection, operations, chunk_size=BULK_CHUNK_SIZE):
+    counts = {"matched": 0, "inserted": 0, "modified": 0}
+    for i in range(0, len(operations), chunk_size):
+        result = collection.bulk_write(operations[i:i + chunk_size], ordered=False)
+        counts["matched"] += result.matched_count
+        counts["inserted"] += result.upserted_count
+        counts["modified"] += result.modified_count
+    return counts
+
+def bulk_load_to_db(df, country, chunk_size=BULK_CHUNK_SIZE):
+    """Batched version of load_to_db: metadata ids are read once per run and the
+    datapoints are sent as unordered bulk upserts of `chunk_size` operations.
+
+    Returns:
+        elapsed_time, counts (tuple): seconds spent and matched/inserted/modified counts
+    """
+    start = time.time()
+    db = get_shared_db_client().Stromzeiten_dev
+    dp_collection = db['Datapoint_Acceptance']
+    meta_collection = db['Metadata_Acceptance']
+    counts = {"matched": 0, "inserted": 0, "modified": 0}
+    if not df.empty:
+        ensure_unique_index(dp_collection, ("timestamp", "metadataid", "country"))
+        metadata_ids = {meta['type']: meta['_id'] for meta in
+                        meta_collection.find({"type": {"$in": list(df.columns)}}, {"type": 1})}
+        operations = []
+        for tag in df.columns:
+            metadataid = ObjectId(metadata_ids[tag])
+            for indx, value in df[tag].items():
+                timestamp = indx.to_pydatetime()
+                query = {"timestamp": timestamp, "metadataid": metadataid, "country": country}
+                data = {**query, "postedById": POSTED_BY_ID, "value": float(value)}
+                operations.append(UpdateOne(query, {"$set": data}, upsert=True))
+        counts = _bulk_upsert(dp_collection, operations, chunk_size)
+    else:
+        print('Nothing to add!')
+    elapsed_time = time.time() - start
+    return elapsed_time, counts
+
+def bulk_load_forecast_to_db(df, country, chunk_size=BULK_CHUNK_SIZE):
+    """Batched version of load_forecast_to_db, see bulk_load_to_db"""
+    start = time.time()
+    db = get_shared_db_client().Stromzeiten_dev
+    dp_collection = db['Datapoint_Forecast']
+    counts = {"matched": 0, "inserted": 0, "modified": 0}
+    if not df.empty:
+        ensure_unique_index(dp_collection, ("timestamp", "country"))
+        operations = []
+        for date, val in df['Cei_prediction'].items():
+            query = {"timestamp": date.to_pydatetime(), "country": country}
+            operations.append(UpdateOne(query, {"$set": {**query, "value": float(val)}}, upsert=True))
+        counts = _bulk_upsert(dp_collection, operations, chunk_size)
+    else:
+        print('Nothing to add!')
+    elapsed_time = time.time() - start
+    return elapsed_time, counts
@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+
+from utils.emission_factors import CO2_FACTORS
+from utils.entso_generation_tags import ALL_TAGS, TAGS_RENEW
+
+# column order of processed generation
+TAG_ORDER: list[str] = list(ALL_TAGS)
+# ENTSO-E production type names in TAG_ORDER
+RAW_COLUMNS: list[str] = [ALL_TAGS[tag] for tag in TAG_ORDER]
+RENEWABLE: np.ndarray = np.array([tag in TAGS_RENEW for tag in TAG_ORDER], dtype=np.float64)
+NON_RENEWABLE: np.ndarray = 1.0 - RENEWABLE
+# column order of emissions, and position of each factor in TAG_ORDER
+FACTOR_TAGS: list[str] = list(CO2_FACTORS)
+FACTOR_POSITIONS: np.ndarray = np.array([TAG_ORDER.index(tag) for tag in FACTOR_TAGS])
+FACTORS: np.ndarray = np.array([CO2_FACTORS[tag] for tag in FACTOR_TAGS], dtype=np.float64)
+
+GENERATION_COLUMNS: list[str] = TAG_ORDER + ["Renewables", "NonRenewables", "Total"]
+EMISSION_COLUMNS: list[str] = [f"{col}_CEI" for col in
+                               FACTOR_TAGS + ["Total", "Carbon_Intensity"]]
+
+
+def factor_vector(factors: dict[str, float], dtype=np.float64) -> np.ndarray:
+    """Returns emission factors in gCO₂eq/kWh as a vector in FACTOR_TAGS order"""
+    return np.array([factors[tag] for tag in FACTOR_TAGS], dtype=dtype)
+
+
+def generation_matrix(generation_raw: pd.DataFrame, dtype=np.float64) -> np.ndarray:
+    """Reindexes raw ENTSO-E generation to TAG_ORDER in one step; missing production
+    types and missing values are 0
+
+    Returns:
+        generation (np.ndarray): (time, tag) matrix in MW
+    """
+    matrix = generation_raw.reindex(columns=RAW_COLUMNS).to_numpy(dtype=dtype)
+    return np.nan_to_num(matrix, nan=0.0, copy=False)
+
+
+def stack_generation(frames: list[pd.DataFrame], dtype=np.float64) -> tuple[pd.DatetimeIndex, np.ndarray]:
+    """Aligns raw generation of several countries on their common time index
+
+    Returns:
+        index, generation (tuple): union index and a (country, time, tag) array
+    """
+    index = frames[0].index
+    for frame in frames[1:]:
+        index = index.union(frame.index)
+    return index, np.stack([generation_matrix(frame.reindex(index), dtype) for frame in frames])
+
+
+def generation_totals(generation: np.ndarray) -> np.ndarray:
+    """Returns renewable, non-renewable and total generation stacked on the last axis"""
+    renewables = generation @ RENEWABLE.astype(generation.dtype)
+    non_renewables = generation @ NON_RENEWABLE.astype(generation.dtype)
+    return np.stack([renewables, non_renewables, renewables + non_renewables], axis=-1)
+
+
+def emissions(generation: np.ndarray, factors: np.ndarray = FACTORS) -> np.ndarray:
+    """Carbon emissions per production type in tCO₂eq, total and carbon intensity in gCO₂eq/kWh
+
+    Parameters:
+        generation (np.ndarray): (..., time, tag) generation in MW, tags in TAG_ORDER
+        factors (np.ndarray): (factor,) vector shared by all rows, or (country, factor)
+            matrix with one vector per country of a stacked generation array
+
+    Returns:
+        emissions (np.ndarray): (..., time, factor + 2) array, columns as EMISSION_COLUMNS
+    """
+    generation = generation[..., FACTOR_POSITIONS]
+    # MW * 1e3 * gCO₂eq/kWh / 1e6
+    scale = (factors / 1e3).astype(generation.dtype)
+    per_fuel = generation * scale[..., None, :]
+    total = np.matmul(generation, scale[..., :, None])[..., 0]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        intensity = total * 1e3 / generation.sum(axis=-1)
+    intensity = np.where(np.isnan(intensity), 0.0, intensity)
+    return np.concatenate([per_fuel, total[..., None], intensity[..., None]], axis=-1)
+
+
+def emissions_for_countries(frames: dict[str, pd.DataFrame], factors: np.ndarray = FACTORS,
+                            dtype=np.float64) -> dict[str, tuple[pd.DataFrame, pd.DataFrame]]:
+    """Processes raw generation of many countries with one kernel call
+
+    Parameters:
+        frames (dict): raw generation per country code
+        factors (np.ndarray): shared vector or one row per country in `frames` order
+
+    Returns:
+        results (dict): (processed generation, emissions) per country code
+    """
+    index, generation = stack_generation(list(frames.values()), dtype)
+    processed = np.concatenate([generation, generation_totals(generation)], axis=-1)
+    carbon = emissions(generation, factors)
+    results = {}
+    for i, (country_code, frame) in enumerate(frames.items()):
+        rows = index.isin(frame.index)
+        results[country_code] = (
+            pd.DataFrame(processed[i, rows], index=index[rows], columns=GENERATION_COLUMNS),
+            pd.DataFrame(carbon[i, rows], index=index[rows], columns=EMISSION_COLUMNS),
+        )
+    return results
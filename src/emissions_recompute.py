@@ -0,0 +1,162 @@
+import logging
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import ProgrammingError
+
+from src.average_cei import SOURCE_TABLES, rebuild_average_cei
+from src.backfill import split_range
+from src.db_cleanup import upsert_dataframe
+from src.emissions_kernel import EMISSION_COLUMNS, TAG_ORDER
+from src.factor_store import EmissionFactors
+from src.rollups import ROLLUP_TABLES, rebuild_rollups
+from utils.cron import european_countries
+
+logger = logging.getLogger("Data_Loader")
+
+# generation table -> emissions table computed from it
+EMISSION_TABLES = {
+    "generation": "emissions",
+    "generation_historical": "emissions_historical",
+}
+# generation columns are stored lower case
+GENERATION_DB_COLUMNS = [tag.lower() for tag in TAG_ORDER]
+# timezone the day and month rollups of a country are aligned to, as in the loaders
+TIMEZONES = {country[1]: country[3] for country in european_countries}
+
+_engine = None
+_factors = None
+
+
+def _init_worker(database_url, version):
+    global _engine, _factors
+    _engine = create_engine(database_url, pool_size=1)
+    _factors = EmissionFactors.load(_engine, version)
+
+
+def _read_window(table_name, country_code, start_date, end_date) -> pd.DataFrame:
+    query = text(f"""
+        SELECT *
+        FROM "{table_name}"
+        WHERE country_code = :country_code AND "index" >= :start AND "index" < :end
+        ORDER BY "index"
+    """)
+    try:
+        with _engine.connect() as connection:
+            result = connection.execute(
+                query, {"country_code": country_code, "start": start_date, "end": end_date})
+            df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    except ProgrammingError:
+        return pd.DataFrame()
+    if df.empty:
+        return df
+    df = df.set_index("index")
+    df.index = pd.DatetimeIndex(df.index)
+    df.index.name = None
+    return df
+
+
+def recompute_chunk(generation_table, country_code, start_date,
+                    end_date) -> tuple[int, int, pd.Timestamp, pd.Timestamp]:
+    """Recomputes the emissions of one country and chunk from stored generation and
+    writes back only the rows whose values changed
+
+    Returns:
+        rows, changed, first, last (tuple): rows read, rows written and the first and last
+            timestamp written (None when nothing changed)
+    """
+    emissions_table = EMISSION_TABLES[generation_table]
+    generation = _read_window(generation_table, country_code, start_date, end_date)
+    if generation.empty:
+        return 0, 0, None, None
+    matrix = generation.reindex(columns=GENERATION_DB_COLUMNS).to_numpy(dtype=np.float64)
+    matrix = np.nan_to_num(matrix, nan=0.0)
+    result = _factors.emissions(country_code, matrix, generation.index)
+    recomputed = pd.DataFrame(result, index=generation.index, columns=EMISSION_COLUMNS)
+
+    stored = _read_window(emissions_table, country_code, start_date, end_date)
+    stored = stored.reindex(index=recomputed.index, columns=EMISSION_COLUMNS)
+    stored_values = stored.to_numpy(dtype=np.float64)
+    unchanged = np.isclose(stored_values, result, rtol=1e-9, atol=1e-9, equal_nan=True).all(axis=1)
+    changed = recomputed[~unchanged].copy()
+    if changed.empty:
+        return len(generation), 0, None, None
+    changed["country_code"] = country_code
+    upsert_dataframe(changed, _engine, emissions_table, on_conflict="update")
+    return len(generation), len(changed), changed.index.min(), changed.index.max()
+
+
+def refresh_derived(engine, changed: dict[tuple[str, str], tuple[pd.Timestamp, pd.Timestamp]]):
+    """Brings the rollups and the average_cei state in line with recomputed emissions
+
+    Parameters:
+        changed (dict): (emissions table, country code) -> first and last rewritten timestamp
+    """
+    for (table_name, country_code), (first, last) in changed.items():
+        if table_name in ROLLUP_TABLES:
+            rebuild_rollups(engine, table_name, country_code, EMISSION_COLUMNS, first, last,
+                            tz=TIMEZONES.get(country_code, "UTC"))
+    countries = {country_code for table_name, country_code in changed
+                 if table_name in SOURCE_TABLES}
+    for country_code in sorted(countries):
+        rebuild_average_cei(engine, country_code)
+
+
+def recompute_emissions(database_url, countries, start_date, end_date,
+                        generation_tables=tuple(EMISSION_TABLES), version=None,
+                        chunk="month", max_workers=None) -> dict[str, int]:
+    """Recomputes the *_CEI columns of stored emissions with a version of the emission
+    factors, without any ENTSO-E request
+
+    Once all chunks are written, the rollups of the rewritten range and the average_cei
+    state of the countries with changed rows are rebuilt.
+
+    Parameters:
+        database_url (str): database of the generation and emissions tables
+        countries (list): ISO 3166 ALPHA-2 codes
+        start_date, end_date: range to recompute (UTC)
+        version (str): emission factor version, the latest one by default
+        chunk (str): 'month' or 'quarter', unit of work of a worker process
+        max_workers (int): number of processes, the number of CPUs by default
+
+    Returns:
+        summary (dict): rows read, rows changed and failed chunks
+    """
+    start = time.time()
+    start_date = pd.Timestamp(start_date, tz="UTC")
+    end_date = pd.Timestamp(end_date, tz="UTC")
+    tasks = [(table, country_code, chunk_start, chunk_end)
+             for table in generation_tables
+             for country_code in countries
+             for chunk_start, chunk_end in split_range(start_date, end_date, chunk)]
+    summary = {"rows": 0, "changed": 0, "failed": 0}
+    changed_ranges = {}
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                             initargs=(database_url, version)) as pool:
+        futures = {pool.submit(recompute_chunk, *task): task for task in tasks}
+        for future in as_completed(futures):
+            try:
+                rows, changed, first, last = future.result()
+                summary["rows"] += rows
+                summary["changed"] += changed
+                if changed:
+                    table, country_code = EMISSION_TABLES[futures[future][0]], futures[future][1]
+                    known = changed_ranges.get((table, country_code), (first, last))
+                    changed_ranges[(table, country_code)] = (min(known[0], first),
+                                                             max(known[1], last))
+            except Exception as e:
+                summary["failed"] += 1
+                logger.exception(f"recompute of {futures[future]} failed: {e}")
+    if changed_ranges:
+        # after the pool, so no bucket is rebuilt while a neighbouring chunk is being written
+        engine = create_engine(database_url)
+        try:
+            refresh_derived(engine, changed_ranges)
+        finally:
+            engine.dispose()
+    logger.info(f"recomputed {summary['rows']} rows, {summary['changed']} changed, "
+                f"{summary['failed']} chunks failed in {time.time() - start:.1f}s")
+    return summary
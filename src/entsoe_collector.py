@@ -1,12 +1,80 @@
 import os
+import threading
 from dataclasses import dataclass
 
+import numpy as np
 import pandas as pd
+import requests
 from entsoe import EntsoePandasClient
+from requests.adapters import HTTPAdapter
 
-from utils.entso_generation_tags import ALL_TAGS, TAGS_RENEW, TAGS_NON_RENEW
+from src import emissions_kernel
+from src.entsoe_xml import open_document, query_generation_streaming, query_load_streaming
+from src.factor_store import EmissionFactors
+from src.rate_limiter import RateLimiter
 from utils.emission_factors import CO2_FACTORS
 
+# connection pool of the shared HTTP session, should be >= number of concurrent workers
+ENTSOE_POOL_SIZE = int(os.environ.get("ENTSOE_POOL_SIZE", 16))
+# seconds to wait for the ENTSO-E API before giving up on a request
+ENTSOE_TIMEOUT = int(os.environ.get("ENTSOE_TIMEOUT", 60))
+ENTSOE_RETRY_COUNT = int(os.environ.get("ENTSOE_RETRY_COUNT", 3))
+ENTSOE_RETRY_DELAY = int(os.environ.get("ENTSOE_RETRY_DELAY", 5))
+# ENTSO-E bans users above 400 requests per minute
+ENTSOE_REQUESTS_PER_MINUTE = int(os.environ.get("ENTSOE_REQUESTS_PER_MINUTE", 300))
+ENTSOE_MAX_CONCURRENCY = int(os.environ.get("ENTSOE_MAX_CONCURRENCY", 16))
+
+_clients: dict[str, EntsoePandasClient] = {}
+_clients_lock = threading.Lock()
+_limiter = RateLimiter(ENTSOE_REQUESTS_PER_MINUTE, max_concurrency=ENTSOE_MAX_CONCURRENCY)
+
+
+def get_entsoe_limiter() -> RateLimiter:
+    """Returns the process-wide limiter every ENTSO-E request goes through"""
+    return _limiter
+
+
+def configure_entsoe_limiter(requests_per_minute: float, **kwargs) -> RateLimiter:
+    """Replaces the process-wide limiter, e.g. with the budget of a backfill run"""
+    global _limiter
+    _limiter = RateLimiter(requests_per_minute, **kwargs)
+    return _limiter
+
+
+class RateLimitedEntsoeClient(EntsoePandasClient):
+    """EntsoePandasClient sending every HTTP request through the shared rate limiter,
+    including the yearly splits entsoe-py makes for long ranges
+    """
+
+    def _base_request(self, params, start, end):
+        return get_entsoe_limiter().call(super()._base_request, params, start, end)
+
+    def stream_request(self, params, start, end):
+        """Rate limited request whose body is left unread, see entsoe_xml.open_document"""
+        return get_entsoe_limiter().call(open_document, self, params, start, end)
+
+
+def get_entsoe_client(api_key: str = None) -> EntsoePandasClient:
+    """Returns the process-wide client for an API key, creating it on first use.
+    All clients share keep-alive connections through one pooled session per key;
+    requests.Session and the pool behind it can be used from several threads.
+    """
+    api_key = api_key or os.environ["ENTSOE_API_KEY"]
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=ENTSOE_POOL_SIZE,
+                                  pool_maxsize=ENTSOE_POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            client = RateLimitedEntsoeClient(api_key=api_key, session=session,
+                                             retry_count=ENTSOE_RETRY_COUNT,
+                                             retry_delay=ENTSOE_RETRY_DELAY,
+                                             timeout=ENTSOE_TIMEOUT)
+            _clients[api_key] = client
+    return client
+
 
 @dataclass
 class EntsoeData(object):
@@ -22,24 +90,41 @@ class EntsoeData(object):
         end date of data
     country_code : str
         ISO 3166 ALPHA-2 country code
+    streaming : bool
+        parse generation and load documents incrementally into NumPy arrays
+        instead of the entsoe-py parser, for multi-year ranges
+    native_resolution : bool
+        keep 15-minute generation data instead of resampling it to hourly
 
     Methods
     -------
     collector():
-        set up the API client using API KEY
+        return the shared API client for the API KEY
     """
 
     api_start_date: pd.Timestamp
     api_end_date: pd.Timestamp
     country_code: str
+    streaming: bool = False
+    native_resolution: bool = False
 
     def collector(self) -> EntsoePandasClient:
-        client = EntsoePandasClient(api_key=os.environ["ENTSOE_API_KEY"])
+        client = get_entsoe_client()
         return client
 
 
+@dataclass
 class Generation(EntsoeData):
-    """Data about energy production per production type in Megawatts"""
+    """Data about energy production per production type in Megawatts
+
+    Attributes
+    ----------
+    factors : EmissionFactors
+        version of the emission factors (see src.factor_store), the static
+        utils.emission_factors.CO2_FACTORS when not set
+    """
+
+    factors: EmissionFactors = None
 
     def fetch(self) -> pd.DataFrame:
         """Fetch generation data
@@ -49,15 +134,19 @@ class Generation(EntsoeData):
         """
         client: EntsoePandasClient = self.collector()
         # check if the index contains "Actual Aggregated" and remove it
-        generation_raw: pd.DataFrame = client.query_generation(
-            country_code=self.country_code, start=self.api_start_date, end=self.api_end_date)
+        if self.streaming:
+            generation_raw: pd.DataFrame = query_generation_streaming(
+                client, self.country_code, self.api_start_date, self.api_end_date)
+        else:
+            generation_raw: pd.DataFrame = client.query_generation(
+                country_code=self.country_code, start=self.api_start_date, end=self.api_end_date)
         if isinstance(generation_raw.columns, pd.MultiIndex):
             generation_raw.columns = generation_raw.columns.droplevel(level=1)
         # remove duplicated columns
         generation_raw = generation_raw.loc[:, ~
                                             generation_raw.columns.duplicated()].copy()
         time_diff = generation_raw.index.to_series().diff().min()
-        if time_diff == pd.Timedelta(minutes=15):
+        if time_diff == pd.Timedelta(minutes=15) and not self.native_resolution:
             # If the data is in 15-minute intervals, resample it to 1-hour intervals
             generation_raw = generation_raw.resample('H').mean()
         return generation_raw
@@ -72,23 +161,12 @@ class Generation(EntsoeData):
         Returns:
             generation_processed (pd.DataFrame): dataframe with processed generation data
         """
+        generation = emissions_kernel.generation_matrix(generation_raw)
         generation_processed: pd.DataFrame = pd.DataFrame(
+            np.concatenate([generation, emissions_kernel.generation_totals(generation)], axis=1),
             index=generation_raw.index,
-            columns=ALL_TAGS.keys(),
-        )  # create a new data frame based on raw data
-        for k, v in ALL_TAGS.items():  # iterate over all production types
-            # if the production type is not available, assume the production is 0
-            if v in generation_raw.columns:
-                generation_processed[k] = generation_raw[v]
-            else:
-                generation_processed[k] = 0.0
-        generation_processed = generation_processed.fillna(0.0)
-        generation_processed["Renewables"] = generation_processed[list(
-            TAGS_RENEW)].sum(axis=1)
-        generation_processed["NonRenewables"] = generation_processed[list(
-            TAGS_NON_RENEW)].sum(axis=1)
-        generation_processed["Total"] = generation_processed["NonRenewables"] + \
-            generation_processed["Renewables"]
+            columns=emissions_kernel.GENERATION_COLUMNS,
+        )
         return generation_processed
 
     def calculate_carbon_emissions(self, processed_generation: pd.DataFrame) -> pd.DataFrame:
@@ -101,14 +179,17 @@ class Generation(EntsoeData):
         Return:
             carbon_emissions (pd.DataFrame): carbon_emissions with calculated carbon emissions
         """
-        carbon_emissions = pd.DataFrame()
-        for k, v in CO2_FACTORS.items():
-            carbon_emissions[k] = (processed_generation[k] * 1e3 * v) / 1e6
-        carbon_emissions["Total"] = carbon_emissions.sum(axis="columns")
-        carbon_emissions["Carbon_Intensity"] = (
-            carbon_emissions["Total"] * 1e6 / (processed_generation["Total"] * 1e3))
-        carbon_emissions = carbon_emissions.add_suffix('_CEI')
-        carbon_emissions = carbon_emissions.fillna(0.0)
+        generation = processed_generation[emissions_kernel.TAG_ORDER].to_numpy(dtype=np.float64)
+        if self.factors is not None:
+            carbon = self.factors.emissions(self.country_code, generation,
+                                            processed_generation.index)
+        else:
+            carbon = emissions_kernel.emissions(generation)
+        carbon_emissions = pd.DataFrame(
+            carbon,
+            index=processed_generation.index,
+            columns=emissions_kernel.EMISSION_COLUMNS,
+        )
         return carbon_emissions
 
     def fetch_process_and_calculate_emissions(self) -> tuple[pd.DataFrame, pd.DataFrame]:
@@ -130,8 +211,12 @@ class Load(EntsoeData):
             load_raw (pd.DataFrame): dataframe with raw load data
         """
         client: EntsoePandasClient = self.collector()
-        load_raw: pd.DataFrame = client.query_load(
-            country_code=self.country_code, start=self.api_start_date, end=self.api_end_date)
+        if self.streaming:
+            load_raw: pd.DataFrame = query_load_streaming(
+                client, self.country_code, self.api_start_date, self.api_end_date)
+        else:
+            load_raw: pd.DataFrame = client.query_load(
+                country_code=self.country_code, start=self.api_start_date, end=self.api_end_date)
         return load_raw
 
 
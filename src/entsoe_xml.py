@@ -0,0 +1,235 @@
+import time
+import xml.etree.ElementTree as ET
+from functools import partial
+
+import numpy as np
+import pandas as pd
+import requests
+from entsoe import EntsoeRawClient
+from entsoe.entsoe import URL
+from entsoe.exceptions import NoMatchingDataError
+from entsoe.mappings import PSRTYPE_MAPPINGS, lookup_area
+
+# finest resolution published for generation and load, all series are laid on this grid
+BASE_RESOLUTION = pd.Timedelta(minutes=15)
+RESOLUTIONS = {
+    "PT15M": pd.Timedelta(minutes=15),
+    "PT30M": pd.Timedelta(minutes=30),
+    "PT60M": pd.Timedelta(minutes=60),
+}
+# ENTSO-E serves at most one year per request
+MAX_REQUEST_SPAN = pd.DateOffset(years=1)
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+class TimeSeriesGrid(object):
+    """Preallocated NumPy arrays on a fixed 15-minute grid, one per series key
+
+    Attributes
+    ----------
+    start : pd.Timestamp
+        first slot of the grid (UTC)
+    size : int
+        number of 15-minute slots
+    """
+
+    def __init__(self, start: pd.Timestamp, end: pd.Timestamp):
+        self.start = start.tz_convert("UTC").floor(BASE_RESOLUTION)
+        self.size = int(np.ceil((end.tz_convert("UTC") - self.start) / BASE_RESOLUTION))
+        self.arrays: dict[str, np.ndarray] = {}
+        self.resolution = None
+
+    def add_period(self, key, period_start, period_end, resolution, positions, quantities,
+                   curve_type="A01"):
+        """Writes the points of one Period into the array of `key`"""
+        step = RESOLUTIONS[resolution]
+        ratio = int(step / BASE_RESOLUTION)
+        n_points = int((period_end - period_start) / step)
+        values = np.full(n_points, np.nan)
+        positions = np.asarray(positions, dtype=np.int64) - 1
+        valid = (positions >= 0) & (positions < n_points)
+        values[positions[valid]] = np.asarray(quantities, dtype=np.float64)[valid]
+        if curve_type == "A03":
+            # variable sized blocks: a point holds until the next one
+            filled = np.where(~np.isnan(values), np.arange(n_points), 0)
+            values = values[np.maximum.accumulate(filled)]
+        values = np.repeat(values, ratio)
+
+        offset = int((period_start - self.start) / BASE_RESOLUTION)
+        lo, hi = max(offset, 0), min(offset + len(values), self.size)
+        if lo >= hi:
+            return
+        array = self.arrays.get(key)
+        if array is None:
+            array = self.arrays[key] = np.full(self.size, np.nan)
+        array[lo:hi] = values[lo - offset:hi - offset]
+        self.resolution = step if self.resolution is None else min(self.resolution, step)
+
+    def to_frame(self, tz: str) -> pd.DataFrame:
+        """Returns the series as columns; rows without any value are dropped and the
+        grid is thinned to the finest resolution found in the documents
+        """
+        if not self.arrays:
+            raise NoMatchingDataError
+        index = pd.date_range(self.start, periods=self.size, freq=BASE_RESOLUTION)
+        matrix = np.column_stack(list(self.arrays.values()))
+        ratio = int(self.resolution / BASE_RESOLUTION)
+        if ratio > 1:
+            index, matrix = index[::ratio], matrix[::ratio]
+        has_data = ~np.all(np.isnan(matrix), axis=1)
+        return pd.DataFrame(matrix[has_data], index=index[has_data].tz_convert(tz),
+                            columns=list(self.arrays))
+
+
+def parse_timeseries(source, grid: TimeSeriesGrid, key_of) -> None:
+    """Streams TimeSeries of an A75/A65 document into the grid with iterparse.
+    Each TimeSeries is cleared after use so memory stays bounded by the grid.
+
+    Parameters:
+        source: file-like object with the XML document, e.g. the raw HTTP response
+        key_of (callable): maps (psr_type, is_consumption) to a series key, None to skip
+
+    Raises:
+        NoMatchingDataError: the document is an acknowledgement without data
+    """
+    psr_type, consumption, curve_type = None, False, "A01"
+    period_start = period_end = resolution = None
+    positions, quantities = [], []
+    position = quantity = None
+    key = None
+    root, reason = None, None
+    for event, element in ET.iterparse(source, events=("start", "end")):
+        tag = _local(element.tag)
+        if root is None:
+            root = tag
+        if event == "start":
+            if tag == "TimeSeries":
+                psr_type, consumption, curve_type = None, False, "A01"
+            elif tag == "Period":
+                positions, quantities = [], []
+                key = key_of(psr_type, consumption)
+            continue
+        if tag == "psrType":
+            psr_type = element.text
+        elif tag == "outBiddingZone_Domain.mRID":
+            consumption = True
+        elif tag == "curveType":
+            curve_type = element.text
+        elif tag == "start":
+            period_start = pd.Timestamp(element.text)
+        elif tag == "end":
+            period_end = pd.Timestamp(element.text)
+        elif tag == "resolution":
+            resolution = element.text
+        elif tag == "position":
+            position = int(element.text)
+        elif tag == "quantity":
+            quantity = float(element.text)
+        elif tag == "Point":
+            positions.append(position)
+            quantities.append(quantity)
+            element.clear()
+        elif tag == "Period":
+            if key is not None and resolution in RESOLUTIONS:
+                grid.add_period(key, period_start, period_end, resolution,
+                                positions, quantities, curve_type)
+            element.clear()
+        elif tag == "TimeSeries":
+            element.clear()
+        elif tag == "text":
+            reason = element.text
+    if root == "Acknowledgement_MarketDocument":
+        # ENTSO-E answers some requests without data with status 200 and this document
+        if reason and "No matching data found" not in reason:
+            raise ValueError(f"ENTSO-E request rejected: {reason}")
+        raise NoMatchingDataError
+
+
+def _windows(start_date, end_date):
+    window_start = start_date
+    while window_start < end_date:
+        window_end = min(window_start + MAX_REQUEST_SPAN, end_date)
+        yield window_start, window_end
+        window_start = window_end
+
+
+def open_document(client: EntsoeRawClient, params: dict, start, end) -> requests.Response:
+    """Sends an ENTSO-E request with the same parameters as EntsoeRawClient._base_request
+    but leaves the body unread, so it can be parsed straight from `response.raw`.
+    Connection errors are retried `client.retry_count` times like entsoe-py does.
+    """
+    params = {**params, "securityToken": client.api_key,
+              "periodStart": client._datetime_to_str(start),
+              "periodEnd": client._datetime_to_str(end)}
+    for attempt in range(max(1, client.retry_count)):
+        try:
+            response = client.session.get(URL, params=params, proxies=client.proxies,
+                                          timeout=client.timeout, stream=True)
+            break
+        except requests.ConnectionError:
+            if attempt + 1 >= client.retry_count:
+                raise
+            time.sleep(client.retry_delay)
+    if not response.ok:
+        # error documents are small, read them to tell missing data from other errors
+        if "No matching data found" in response.text:
+            raise NoMatchingDataError
+        response.raise_for_status()
+    # let urllib3 undo a gzip transfer encoding while the parser reads
+    response.raw.decode_content = True
+    return response
+
+
+def _generation_params(area) -> dict:
+    return {"documentType": "A75", "processType": "A16", "in_Domain": area.code}
+
+
+def _load_params(area) -> dict:
+    return {"documentType": "A65", "processType": "A16",
+            "outBiddingZone_Domain": area.code, "out_Domain": area.code}
+
+
+def _query_streaming(params_of, client, country_code, start_date, end_date, key_of) -> pd.DataFrame:
+    area = lookup_area(country_code)
+    grid = TimeSeriesGrid(start_date, end_date)
+    # clients with a rate limiter send the request through it (see entsoe_collector)
+    request = getattr(client, "stream_request", None) or partial(open_document, client)
+    for window_start, window_end in _windows(start_date, end_date):
+        try:
+            response = request(params_of(area), window_start, window_end)
+            with response:
+                parse_timeseries(response.raw, grid, key_of)
+        except NoMatchingDataError:
+            continue
+    df = grid.to_frame(area.tz)
+    return df.truncate(before=start_date, after=end_date)
+
+
+def _generation_key(psr_type, consumption):
+    # Generation.process only uses the aggregated production
+    if consumption or psr_type is None:
+        return None
+    return PSRTYPE_MAPPINGS.get(psr_type, psr_type)
+
+
+def _load_key(psr_type, consumption):
+    return "Actual Load"
+
+
+def query_generation_streaming(client: EntsoeRawClient, country_code, start_date,
+                               end_date) -> pd.DataFrame:
+    """Actual generation per production type, same columns as EntsoePandasClient.query_generation
+    after dropping the 'Actual Aggregated' level
+    """
+    return _query_streaming(_generation_params, client, country_code,
+                            start_date, end_date, _generation_key)
+
+
+def query_load_streaming(client: EntsoeRawClient, country_code, start_date,
+                         end_date) -> pd.DataFrame:
+    """Actual total load, same frame as EntsoePandasClient.query_load"""
+    return _query_streaming(_load_params, client, country_code,
+                            start_date, end_date, _load_key)
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.emissions_kernel import EMISSION_COLUMNS, FACTOR_TAGS, emissions, factor_vector
+from utils.emission_factors import CO2_FACTORS
+from utils.entso_generation_tags import ALL_TAGS
+
+FACTOR_TABLE = "emission_factors"
+# wildcards of the country and year columns
+ALL_COUNTRIES = "*"
+ALL_YEARS = 0
+
+
+def ensure_factor_table(engine):
+    with engine.begin() as connection:
+        connection.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS {FACTOR_TABLE} (
+                version TEXT NOT NULL,
+                country_code TEXT NOT NULL DEFAULT '{ALL_COUNTRIES}',
+                year INTEGER NOT NULL DEFAULT {ALL_YEARS},
+                tag TEXT NOT NULL,
+                factor DOUBLE PRECISION NOT NULL,
+                created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                PRIMARY KEY (version, country_code, year, tag)
+            )
+        """))
+
+
+def save_factors(engine, version, factors: dict[str, float], country_code=ALL_COUNTRIES,
+                 year=ALL_YEARS):
+    """Stores emission factors in gCO₂eq/kWh for a version, optionally only for one
+    country and/or year; more specific rows override the general ones of the version
+
+    Raises:
+        ValueError: a tag is not a production type of utils.entso_generation_tags.ALL_TAGS
+            or a factor is not a non-negative number
+    """
+    unknown = sorted(set(factors) - set(ALL_TAGS))
+    if unknown:
+        raise ValueError(f"unknown production types {unknown}, expected some of {list(ALL_TAGS)}")
+    for tag, factor in factors.items():
+        if isinstance(factor, bool) or not isinstance(factor, (int, float)) or factor < 0:
+            raise ValueError(f"factor of {tag} must be a non-negative number, got {factor!r}")
+    ensure_factor_table(engine)
+    with engine.begin() as connection:
+        for tag, factor in factors.items():
+            connection.execute(text(f"""
+                INSERT INTO {FACTOR_TABLE} (version, country_code, year, tag, factor)
+                VALUES (:version, :country_code, :year, :tag, :factor)
+                ON CONFLICT (version, country_code, year, tag) DO UPDATE SET factor = EXCLUDED.factor
+            """), {"version": version, "country_code": country_code, "year": year,
+                   "tag": tag, "factor": factor})
+
+
+class EmissionFactors(object):
+    """One version of the emission factors, resolved per country and year
+
+    Lookup order per production type: (country, year), (country, any year),
+    (any country, year), (any country, any year), then utils.emission_factors.CO2_FACTORS.
+
+    Attributes
+    ----------
+    version : str
+        name of the version
+    rows : pd.DataFrame
+        country_code, year, tag and factor of the version
+    """
+
+    def __init__(self, version, rows: pd.DataFrame):
+        self.version = version
+        self.factors = {(row.country_code, row.year, row.tag): row.factor
+                        for row in rows.itertuples()}
+        self._vectors: dict[tuple[str, int], np.ndarray] = {}
+
+    @classmethod
+    def load(cls, engine, version=None) -> "EmissionFactors":
+        """Loads a version, by default the most recently created one"""
+        ensure_factor_table(engine)
+        with engine.connect() as connection:
+            if version is None:
+                version = connection.execute(text(f"""
+                    SELECT version FROM {FACTOR_TABLE} ORDER BY created_at DESC LIMIT 1
+                """)).scalar()
+            result = connection.execute(text(f"""
+                SELECT country_code, year, tag, factor FROM {FACTOR_TABLE} WHERE version = :version
+            """), {"version": version})
+            rows = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        return cls(version, rows)
+
+    def factor(self, country_code, year, tag) -> float:
+        for key in ((country_code, year, tag), (country_code, ALL_YEARS, tag),
+                    (ALL_COUNTRIES, year, tag), (ALL_COUNTRIES, ALL_YEARS, tag)):
+            if key in self.factors:
+                return self.factors[key]
+        return CO2_FACTORS[tag]
+
+    def vector(self, country_code, year) -> np.ndarray:
+        """Returns the factors of a country and year in emissions_kernel.FACTOR_TAGS order"""
+        key = (country_code, year)
+        if key not in self._vectors:
+            self._vectors[key] = factor_vector(
+                {tag: self.factor(country_code, year, tag) for tag in FACTOR_TAGS})
+        return self._vectors[key]
+
+    def emissions(self, country_code, generation: np.ndarray, index) -> np.ndarray:
+        """emissions_kernel.emissions of a country, each row with the factors of its UTC year
+
+        Parameters:
+            generation (np.ndarray): (time, tag) generation in MW, tags in TAG_ORDER
+            index: timestamps of the rows
+        """
+        years = pd.DatetimeIndex(pd.to_datetime(index, utc=True)).year.to_numpy()
+        result = np.empty((len(generation), len(EMISSION_COLUMNS)), dtype=generation.dtype)
+        for year in np.unique(years):
+            rows = years == year
+            result[rows] = emissions(generation[rows], self.vector(country_code, int(year)))
+        return result
@@ -0,0 +1,191 @@
+import logging
+
+import numpy as np
+import pandas as pd
+from entsoe.exceptions import NoMatchingDataError
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from src.db_cleanup import upsert_dataframe
+from src.entsoe_collector import Forecast
+from src.watermark import LOOKBACK
+from src.weather_store import WeatherHistoryStore
+from src.weatherapi_collector import WeatherForecast
+
+logger = logging.getLogger("Data_Loader")
+
+FEATURE_TABLE = "forecast_features"
+TARGET = "Carbon_Intensity_CEI"
+DAYS_FORECAST = 3
+DAYS_HISTORY = 7
+CALENDAR_FEATURES = ["hour", "dayofweek", "month"]
+WEATHER_FEATURES = ["temp_c", "wind_kph", "wind_degree", "pressure_mb", "precip_mm",
+                    "humidity", "cloud", "feelslike_c", "windchill_c", "vis_km"]
+# lags are at least the forecast horizon long, so every predicted hour has them
+LAGS = [72, 96, 168]
+LAG_FEATURES = [f"lag_{lag}" for lag in LAGS]
+# rolling windows over the target shifted by the horizon
+ROLLING_WINDOWS = [24, 168]
+ROLLING_FEATURES = ([f"rolling_mean_{window}" for window in ROLLING_WINDOWS]
+                    + [f"rolling_std_{window}" for window in ROLLING_WINDOWS])
+# ENTSO-E day-ahead wind and solar generation forecast in MW
+RENEWABLES_COLUMNS = {"Solar": "renewables_solar",
+                      "Wind Onshore": "renewables_wind_onshore",
+                      "Wind Offshore": "renewables_wind_offshore"}
+RENEWABLES_FEATURES = list(RENEWABLES_COLUMNS.values())
+FEATURE_COLUMNS = (CALENDAR_FEATURES + WEATHER_FEATURES + LAG_FEATURES + ROLLING_FEATURES
+                   + RENEWABLES_FEATURES)
+# hours of target history the lag and rolling features of the first written hour need
+CONTEXT_HOURS = max(max(LAGS), LAGS[0] + max(ROLLING_WINDOWS))
+
+
+def lag_features(target: pd.Series) -> pd.DataFrame:
+    """Lag and rolling features of a target on a contiguous hourly index"""
+    values = target.to_numpy(dtype=np.float64)
+    features = {}
+    for lag in LAGS:
+        shifted = np.full_like(values, np.nan)
+        shifted[lag:] = values[:-lag]
+        features[f"lag_{lag}"] = shifted
+    base = target.shift(LAGS[0])
+    for window in ROLLING_WINDOWS:
+        rolling = base.rolling(window, min_periods=1)
+        features[f"rolling_mean_{window}"] = rolling.mean().to_numpy()
+        features[f"rolling_std_{window}"] = rolling.std().to_numpy()
+    return pd.DataFrame(features, index=target.index)[LAG_FEATURES + ROLLING_FEATURES]
+
+
+class FeatureStore(object):
+    """Hourly forecast features per country kept in a table keyed by (time, country_code)
+
+    Every row holds the calendar, weather, lag, rolling and ENTSO-E renewables forecast
+    features of an hour and the carbon intensity once it is known. Hours of the forecast
+    horizon are stored with forecast weather and an empty target, and are overwritten
+    with the observed values on later updates. An update only writes the hours after the
+    latest stored target (minus the look-back for late revisions).
+
+    Attributes
+    ----------
+    engine : sqlalchemy.engine.Engine
+        database holding the emissions, weather_historical and feature tables
+    table_name : str
+        name of the feature table
+    """
+
+    def __init__(self, engine, table_name=FEATURE_TABLE):
+        self.engine = engine
+        self.table_name = table_name
+        self.weather_store = WeatherHistoryStore(engine)
+
+    def watermark(self, country_code) -> pd.Timestamp:
+        """Latest hour of a country with a known target, None if nothing is stored"""
+        query = text(f"""
+            SELECT max("time") FROM "{self.table_name}"
+            WHERE country_code = :country_code AND "{TARGET}" IS NOT NULL
+        """)
+        try:
+            with self.engine.connect() as connection:
+                latest = connection.execute(query, {"country_code": country_code}).scalar()
+        except ProgrammingError:
+            return None
+        return pd.Timestamp(latest).tz_convert("UTC") if latest is not None else None
+
+    def _target(self, country_code, start_date, end_date) -> pd.Series:
+        query = text(f"""
+            SELECT date_trunc('hour', "index") AS time, avg("{TARGET}") AS target
+            FROM emissions
+            WHERE country_code = :country_code AND "index" >= :start AND "index" < :end
+            GROUP BY 1
+        """)
+        with self.engine.connect() as connection:
+            rows = connection.execute(query, {"country_code": country_code,
+                                              "start": start_date, "end": end_date}).fetchall()
+        if not rows:
+            return pd.Series(dtype=np.float64)
+        index = pd.DatetimeIndex([row.time for row in rows]).tz_convert("UTC")
+        return pd.Series([row.target for row in rows], index=index, dtype=np.float64)
+
+    def _weather(self, city, tz, start_date, now) -> pd.DataFrame:
+        history = self.weather_store.history(city, tz, start_date.tz_convert(tz), now.tz_convert(tz))
+        forecast = WeatherForecast(city, tz, DAYS_FORECAST).fetch()
+        weather = pd.concat([history[WEATHER_FEATURES], forecast[WEATHER_FEATURES]])
+        weather.index = pd.DatetimeIndex(weather.index).tz_convert("UTC")
+        # observed weather wins over the forecast of the same hour
+        return weather[~weather.index.duplicated(keep="first")].astype(np.float64)
+
+    def _renewables(self, country_code, start_date, end_date) -> pd.DataFrame:
+        try:
+            renewables = Forecast(start_date, end_date, country_code).fetch_renewables(end_date)
+        except NoMatchingDataError:
+            return pd.DataFrame(columns=RENEWABLES_FEATURES, dtype=np.float64)
+        renewables = renewables.rename(columns=RENEWABLES_COLUMNS)
+        renewables = renewables.reindex(columns=RENEWABLES_FEATURES).astype(np.float64)
+        renewables.index = renewables.index.tz_convert("UTC")
+        return renewables.resample("h").mean()
+
+    def build(self, country_code, city, tz, start_date, end_date) -> pd.DataFrame:
+        """Features and target of the hours [start_date, end_date), indexed by UTC hour"""
+        index = pd.date_range(start_date, end_date, freq="h", inclusive="left", name="time")
+        context_start = start_date - pd.Timedelta(hours=CONTEXT_HOURS)
+        now = pd.Timestamp.now(tz="UTC").floor("h")
+        target = self._target(country_code, context_start, end_date)
+        target = target.reindex(pd.date_range(context_start, end_date, freq="h",
+                                              inclusive="left"))
+        local = index.tz_convert(tz)
+        frame = pd.DataFrame({"hour": local.hour, "dayofweek": local.dayofweek,
+                              "month": local.month}, index=index)
+        frame[WEATHER_FEATURES] = self._weather(city, tz, start_date, now).reindex(index)
+        frame[LAG_FEATURES + ROLLING_FEATURES] = lag_features(target).reindex(index)
+        frame[RENEWABLES_FEATURES] = self._renewables(
+            country_code, start_date, end_date).reindex(index)
+        frame[TARGET] = target.reindex(index)
+        return frame.reindex(columns=FEATURE_COLUMNS + [TARGET])
+
+    def update(self, country_code, city, tz, days_history=DAYS_HISTORY) -> int:
+        """Appends the hours after the latest stored target and refreshes the horizon
+
+        Returns:
+            rows (int): rows written
+        """
+        now = pd.Timestamp.now(tz="UTC").floor("h")
+        watermark = self.watermark(country_code)
+        if watermark is None:
+            start_date = now - pd.Timedelta(days=days_history)
+        else:
+            start_date = (watermark - LOOKBACK).floor("h")
+        end_date = now + pd.Timedelta(days=DAYS_FORECAST)
+        frame = self.build(country_code, city, tz, start_date, end_date)
+        frame["country_code"] = country_code
+        rows = upsert_dataframe(frame, self.engine, self.table_name, "time",
+                                on_conflict="update")
+        logger.info(f"feature store: {rows} hours written for {country_code} from {start_date}")
+        return rows
+
+    def read(self, country_code, start_date=None, end_date=None, tz="UTC") -> pd.DataFrame:
+        """Stored rows of a country as one float matrix, indexed by time in `tz`"""
+        query = text(f"""
+            SELECT *
+            FROM "{self.table_name}"
+            WHERE country_code = :country_code
+            AND "time" >= COALESCE(CAST(:start AS TIMESTAMPTZ), '-infinity')
+            AND "time" < COALESCE(CAST(:end AS TIMESTAMPTZ), 'infinity')
+            ORDER BY "time"
+        """)
+        with self.engine.connect() as connection:
+            result = connection.execute(query, {"country_code": country_code,
+                                                "start": start_date, "end": end_date})
+            df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        df = df.drop(columns="country_code").set_index("time")
+        df.index = pd.DatetimeIndex(df.index).tz_convert(tz)
+        return df.reindex(columns=FEATURE_COLUMNS + [TARGET]).astype(np.float64)
+
+    def training_data(self, country_code, tz, days_history=DAYS_HISTORY) -> pd.DataFrame:
+        """Hours of the last `days_history` days with a known target"""
+        now = pd.Timestamp.now(tz="UTC").floor("h")
+        df = self.read(country_code, now - pd.Timedelta(days=days_history), now, tz)
+        return df.dropna(subset=[TARGET])
+
+    def horizon(self, country_code, tz) -> pd.DataFrame:
+        """Hours from now to the end of the stored weather forecast"""
+        now = pd.Timestamp.now(tz="UTC").floor("h")
+        return self.read(country_code, now, None, tz)
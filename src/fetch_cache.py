@@ -0,0 +1,169 @@
+import os
+import pickle
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+Interval = tuple[pd.Timestamp, pd.Timestamp]
+
+
+def merge_intervals(intervals: list[Interval]) -> list[Interval]:
+    """Sorts [start, end) intervals and merges the ones that overlap or touch"""
+    merged: list[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def missing_intervals(intervals: list[Interval], start, end) -> list[Interval]:
+    """Parts of [start, end) not covered by the sorted, disjoint `intervals`"""
+    missing = []
+    for covered_start, covered_end in intervals:
+        if covered_end <= start or covered_start >= end:
+            continue
+        if covered_start > start:
+            missing.append((start, covered_start))
+        start = max(start, covered_end)
+    if start < end:
+        missing.append((start, end))
+    return missing
+
+
+def contiguous_intervals(index: pd.DatetimeIndex, step=pd.Timedelta(hours=1)) -> list[Interval]:
+    """[first, last + step) of every run of a sorted index without a gap longer than `step`"""
+    if len(index) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(index.asi8) > step.value) + 1
+    starts = np.concatenate([[0], breaks])
+    ends = np.concatenate([breaks - 1, [len(index) - 1]])
+    return [(index[s], index[e] + step) for s, e in zip(starts, ends)]
+
+
+def _utc(df: pd.DataFrame) -> pd.DataFrame:
+    if df.empty and not isinstance(df.index, pd.DatetimeIndex):
+        return df
+    df = df.copy()
+    # naive timestamps are taken as UTC, rows read from the database may carry mixed offsets
+    df.index = pd.to_datetime(df.index, utc=True)
+    return df
+
+
+class FetchCache(object):
+    """Cache of fetched frames keyed by (dataset, key, interval)
+
+    Per (dataset, key), e.g. ("emissions", "BE"), the cache holds the fetched rows and the
+    sorted, disjoint [start, end) intervals they cover. Overlapping or adjacent intervals
+    are merged, so a request only fetches the parts that are not covered yet, including
+    gaps between cached intervals. Rows are kept in UTC whatever timezone they were
+    fetched in. By default the cache lives as long as the object (one loader run); with
+    `directory` it is also persisted as pickles between runs.
+
+    Attributes
+    ----------
+    directory : str
+        optional directory for the on-disk cache
+    """
+
+    def __init__(self, directory: str = None):
+        self.directory = directory
+        self._entries: dict[tuple[str, str], tuple[list[Interval], pd.DataFrame]] = {}
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, dataset, key):
+        return os.path.join(self.directory, f"{dataset}_{key}.pkl")
+
+    def _entry(self, dataset, key):
+        entry = self._entries.get((dataset, key))
+        if entry is None and self.directory and os.path.exists(self._path(dataset, key)):
+            with open(self._path(dataset, key), "rb") as f:
+                entry = pickle.load(f)
+            self._entries[(dataset, key)] = entry
+        return entry
+
+    def coverage(self, dataset, key) -> list[Interval]:
+        """Returns the cached [start, end) intervals, None if nothing is cached"""
+        with self._lock:
+            entry = self._entry(dataset, key)
+        return None if entry is None else list(entry[0])
+
+    def _store(self, dataset, key, intervals: list[Interval], df: pd.DataFrame):
+        df = _utc(df)
+        with self._lock:
+            entry = self._entry(dataset, key)
+            if entry is not None:
+                cached_intervals, cached = entry
+                df = pd.concat([cached, df])
+                df = df[~df.index.duplicated(keep="last")].sort_index()
+                intervals = cached_intervals + intervals
+            entry = (merge_intervals(intervals), df)
+            self._entries[(dataset, key)] = entry
+            if self.directory:
+                with open(self._path(dataset, key), "wb") as f:
+                    pickle.dump(entry, f)
+
+    def put(self, dataset, key, start, end, df: pd.DataFrame):
+        """Stores the frame fetched for [start, end) next to the cached intervals"""
+        self._store(dataset, key, [(start, end)], df)
+
+    def get(self, dataset, key, start, end, fetcher, step=pd.Timedelta(hours=1)) -> pd.DataFrame:
+        """Returns the data of [start, end) in UTC, calling `fetcher(start, end)` only
+        for the parts that are not cached
+
+        Parameters:
+            fetcher (callable): fetches the data of an interval, returns a time-indexed frame
+            step (pd.Timedelta): resolution of the data; a trailing edge is only marked as
+                cached up to the last returned timestamp plus `step`, so hours that were
+                not published yet are fetched again next time
+        """
+        with self._lock:
+            entry = self._entry(dataset, key)
+        for missing_start, missing_end in missing_intervals(entry[0] if entry else [], start, end):
+            fetched = fetcher(missing_start, missing_end)
+            if fetched.empty:
+                continue
+            if missing_end == end:
+                missing_end = min(missing_end, fetched.index.max() + step)
+            self.put(dataset, key, missing_start, missing_end, fetched)
+        with self._lock:
+            entry = self._entry(dataset, key)
+        if entry is None:
+            return pd.DataFrame()
+        df = entry[1]
+        return df[(df.index >= start) & (df.index < end)]
+
+    def seed_from_db(self, engine, table_name, dataset, key, start, end,
+                     index_label="index", step=pd.Timedelta(hours=1)):
+        """Loads rows of a country already stored by the loader into the cache.
+        Every contiguous run of stored rows (no gap longer than `step`) is marked as
+        covered from its first timestamp to its last one plus `step`; hours missing in
+        the table stay uncovered and are fetched by `get`.
+        """
+        query = text(f"""
+            SELECT *
+            FROM "{table_name}"
+            WHERE "{index_label}" >= :start AND "{index_label}" < :end
+            AND country_code = :country_code
+            ORDER BY "{index_label}"
+        """)
+        try:
+            with engine.connect() as connection:
+                result = connection.execute(
+                    query, {"start": start, "end": end, "country_code": key})
+                df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        except ProgrammingError:
+            return
+        if df.empty:
+            return
+        df = df.drop(columns="country_code").set_index(index_label)
+        df = _utc(df)
+        df.index.name = None
+        self._store(dataset, key, contiguous_intervals(df.index, step), df)
+
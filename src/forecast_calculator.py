@@ -1,16 +1,28 @@
 from dataclasses import dataclass
 import datetime
+import logging
 
-import xgboost as xgb
 import pandas as pd
+from entsoe.exceptions import NoMatchingDataError
 
 from src.entsoe_collector import Generation
+from src.factor_store import EmissionFactors
+from src.feature_store import FEATURE_COLUMNS, FeatureStore
+from src.fetch_cache import FetchCache
+from src.forecasters import (FALLBACK, FORECASTER, N_JOBS, TIME_BUDGET, Forecaster,
+                             build_forecaster, fit_with_fallback)
+from src.model_store import ModelStore, RetrainPolicy
+from src.weather_store import WeatherHistoryStore
 from src.weatherapi_collector import HistoricalWeather, WeatherForecast
 
-WEEK_AGO: datetime = datetime.date.today() - datetime.timedelta(days=7)
-TODAY: datetime = datetime.date.today()
-TOMORROW: datetime = datetime.date.today()+datetime.timedelta(days=1)
 DAYS_FORECAST = 3
+DAYS_HISTORY = 7
+FEATURES = ['temp_c', 'wind_kph', 'wind_degree', 'pressure_mb', 'precip_mm',
+            'humidity', 'cloud', 'feelslike_c', 'windchill_c', 'vis_km', 'hour',
+            'dayofweek']
+TARGET = 'Carbon_Intensity_CEI'
+
+logger = logging.getLogger("Data_Loader")
 
 
 @dataclass
@@ -18,11 +30,34 @@ class Next3DaysForecast(object):
     """Object for fetching and calculating carbon emission forecast. 
     Forecast is estimated basing on the last 7 days of CEI data, and 3 next days of a weahter forecast
     Model is using XGBoost: an efficient implementation of gradient boosting for classification and regression problems.
+    Other models can be plugged in through `forecaster` (see src.forecasters); a cheap
+    `fallback` model is served when the training fails or runs out of its time budget.
 
     Args:
         country_code (str): ISO 3166 ALPHA-2 country code
         country (str): country for which data will be fetched
         city (str)
+        tz (str): timezone identifier
+        cache (FetchCache): cache shared with the loader stages, history that is already
+            cached is not fetched again
+        engine (sqlalchemy.engine.Engine): if set, emissions already stored in the
+            `emissions` table are used and only the missing edges are fetched
+        weather_store (WeatherHistoryStore): if set, historical weather is read from the
+            store, which only requests the days it does not hold yet
+        model_store (ModelStore): if set, the trained model is saved per country and
+            reused by later runs until `retrain_policy` asks for a new one
+        retrain_policy (RetrainPolicy): when a stored model is trained again
+        n_jobs (int): XGBoost threads of the training
+        time_budget (float): seconds the training of the country may take
+        forecaster (str): name of the model in src.forecasters.FORECASTERS
+        fallback (str): model served when `forecaster` fails or exceeds `time_budget`
+        feature_store (FeatureStore): if set, the model is trained and predicts on the
+            materialized features of the country (with lags, rolling windows and the
+            ENTSO-E renewables forecast), which are updated with the new hours first
+        factors (EmissionFactors): emission factor version of the emissions fetched for
+            the missing edges, the static factors when not set
+        fit_report (dict): forecaster used and fit time of the last training (plus best
+            iteration and validation RMSE for XGBoost), None when the stored model was used
 
     Methods:
         fetch_forecast_data: fetch data from entso and weather api
@@ -36,38 +71,100 @@ class Next3DaysForecast(object):
     country: str
     city: str
     tz: str
+    cache: FetchCache = None
+    engine: object = None
+    weather_store: WeatherHistoryStore = None
+    model_store: ModelStore = None
+    retrain_policy: RetrainPolicy = None
+    n_jobs: int = N_JOBS
+    time_budget: float = TIME_BUDGET
+    forecaster: str = FORECASTER
+    fallback: str = FALLBACK
+    feature_store: FeatureStore = None
+    factors: EmissionFactors = None
+    fit_report: dict = None
+
+    @property
+    def features(self) -> list[str]:
+        if self.feature_store is not None:
+            return FEATURE_COLUMNS
+        return FEATURES
+
+    def _fetch_emissions(self, start_date, end_date) -> pd.DataFrame:
+        try:
+            generation, emissions = Generation(
+                start_date, end_date, self.country_code,
+                factors=self.factors).fetch_process_and_calculate_emissions()
+        except NoMatchingDataError:
+            # edge of the window not published yet
+            return pd.DataFrame()
+        return emissions
+
+    def _fetch_historical_weather(self, start_date, end_date) -> pd.DataFrame:
+        if self.weather_store is not None:
+            return self.weather_store.history(self.city, self.tz, start_date, end_date)
+        days = pd.date_range(start_date.normalize(), end_date - pd.Timedelta(seconds=1),
+                             freq='d')
+        historical_weather_list = []
+        for day in days:
+            historical = HistoricalWeather(
+                self.city, self.tz, DAYS_FORECAST).fetch(day.date())
+            historical_weather_list.append(historical)
+        return pd.concat(historical_weather_list)
+
+    def _upcoming(self, weather_forecast: pd.DataFrame) -> pd.DataFrame:
+        """Hours of the weather forecast from the current hour on; the stored model and
+        the newly trained one predict the same hours, as FeatureStore.horizon does
+        """
+        now = pd.Timestamp.now(tz=self.tz).floor('h')
+        return weather_forecast[weather_forecast.index >= now]
+
+    def fetch_weather_forecast(self) -> pd.DataFrame:
+        """Fetches the weather forecast for 3 days, without the hours already passed;
+        with a feature store it only reads the horizon, see train_and_predict
+        """
+        if self.feature_store is not None:
+            return self.feature_store.horizon(self.country_code, self.tz)
+        return self._upcoming(WeatherForecast(self.city, self.tz, DAYS_FORECAST).fetch())
 
     def fetch_forecast_data(self):
         """Fetches last 7 days of data of the weather and carbon emissions,
         and weather forecast for 3 days
 
+        With a feature store it only reads the stored features, see train_and_predict
+
         Returns:
             historical_data, weather_forecas (tuple): dataframes containig hitorical and 
             weather forecast data respectively
         """
-        start_date = pd.Timestamp(WEEK_AGO, tz=self.tz)
-        end_date = pd.Timestamp(TOMORROW, tz=self.tz)
-        generation, emissions = Generation(
-            start_date, end_date, self.country_code).fetch_process_and_calculate_emissions()
+        if self.feature_store is not None:
+            return (self.feature_store.training_data(self.country_code, self.tz, DAYS_HISTORY),
+                    self.feature_store.horizon(self.country_code, self.tz))
+        # resolved on every call so a long-running process never works on a stale window
+        today = datetime.date.today()
+        week_ago = today - datetime.timedelta(days=DAYS_HISTORY)
+        tomorrow = today + datetime.timedelta(days=1)
+        start_date = pd.Timestamp(week_ago, tz=self.tz)
+        end_date = pd.Timestamp(tomorrow, tz=self.tz)
+        cache = self.cache if self.cache is not None else FetchCache()
+        if self.engine is not None:
+            cache.seed_from_db(self.engine, "emissions", "emissions",
+                               self.country_code, start_date, end_date)
+        emissions = cache.get("emissions", self.country_code, start_date, end_date,
+                              self._fetch_emissions)
         weather_forecast = WeatherForecast(
             self.city, self.tz, DAYS_FORECAST).fetch()
-
-        week_of_data = pd.date_range(
-            WEEK_AGO, TOMORROW-datetime.timedelta(days=1), freq='d')
-        historical_weather_list = []
-        for day in week_of_data:
-            historical = HistoricalWeather(
-                self.city, self.tz, DAYS_FORECAST).fetch(day)
-            historical_weather_list.append(historical)
-        historical_weather = pd. concat(historical_weather_list)
+        historical_weather = cache.get("historical_weather", self.city, start_date, end_date,
+                                       self._fetch_historical_weather)
+        # the cache holds UTC rows, the features are built on local time
+        emissions.index = emissions.index.tz_convert(self.tz)
+        historical_weather.index = historical_weather.index.tz_convert(self.tz)
         #change data to hourly granurality if needed (case of german data)
         emissions = emissions.asfreq('H')
-        emissions = emissions.fillna(0.0)
-        emissions.index = emissions.index.tz_convert(self.tz)
         historical_data = emissions.join(historical_weather)
-        weather_forecast = weather_forecast[~weather_forecast.index.isin(
-            historical_data.index)]
-        return historical_data, weather_forecast
+        # hours without a stored or fetched value are not trained on, never as a zero CEI
+        historical_data = historical_data.dropna(subset=[TARGET])
+        return historical_data, self._upcoming(weather_forecast)
 
     def create_features(self, df):
         """
@@ -82,37 +179,110 @@ class Next3DaysForecast(object):
         """
         Add lagging values of target
         """
-        target_map = df['Carbon_Intensity_CEI'].to_dict()
-        df['lag1'] = (df.index - pd.Timedelta('72 hour')).map(target_map)
+        df['lag1'] = df['Carbon_Intensity_CEI'].reindex(
+            df.index - pd.Timedelta('72 hour')).to_numpy()
         return df
 
-    def train_and_predict(self):
+    def _output(self, forecast: pd.DataFrame) -> pd.DataFrame:
+        """Keeps the forecast_data columns; the lag, rolling and renewables features of
+        the feature store are not written there
+        """
+        if self.feature_store is None:
+            return forecast
+        return forecast[FEATURES + ['Cei_prediction']]
+
+    def fit_model(self, X, y) -> tuple[Forecaster, dict]:
+        """Trains the model of the country within its time budget, see fit_with_fallback"""
+        primary = build_forecaster(self.forecaster, n_jobs=self.n_jobs,
+                                   time_budget=self.time_budget)
+        return fit_with_fallback(primary, build_forecaster(self.fallback), X, y,
+                                 self.time_budget)
+
+    def _recent_error(self, model, historical_data) -> float:
+        """Mean absolute error of a stored model on the most recent actual data,
+        infinite when the model cannot predict any of those hours
+        """
+        policy = self.retrain_policy
+        recent = historical_data[historical_data.index >= historical_data.index.max()
+                                 - policy.drift_window]
+        recent = self.create_features(recent).dropna(subset=[TARGET])
+        if recent.empty:
+            return None
+        errors = (model.predict(recent[self.features]) - recent[TARGET]).abs()
+        if errors.isna().all():
+            return float("inf")
+        return float(errors.mean())
+
+    def _load_model(self, force_retrain):
+        """Returns (model, data) of a stored model that can be reused, model is None if it
+        has to be retrained; data is the (historical_data, weather_forecast) fetched for
+        the drift check, None when nothing was fetched, so a retrain does not fetch again
+        """
+        if self.model_store is None or force_retrain:
+            return None, None
+        policy = self.retrain_policy or RetrainPolicy()
+        model, metadata = self.model_store.load(self.country_code)
+        data, drift = None, None
+        if model is not None and policy.drift_mae is not None:
+            data = self.fetch_forecast_data()
+            drift = self._recent_error(model, data[0])
+        reason = policy.reason(metadata, self.features, drift=drift)
+        if reason is None and metadata.get("forecaster", "xgboost") != self.forecaster:
+            reason = f"forecaster changed to {self.forecaster}"
+        if reason is not None:
+            logger.info(f"{self.country_code}: training forecast model, {reason}")
+            return None, data
+        return model, data
+
+    def train_and_predict(self, force_retrain=False):
         """
         use XGBoost to provide a regularizing gradient boosting framework
+
+        With a `model_store` the stored model of the country is used as long as
+        `retrain_policy` accepts it; then only the weather forecast is fetched.
+        A fallback model is never stored, so the next run trains the primary one again;
+        neither is a model that is not `reusable` (see src.forecasters.Forecaster).
+        The feature store is updated once here, before any of the paths reads from it.
         """
-        historical_data, weather_forecast = self.fetch_forecast_data()
+        if self.feature_store is not None:
+            self.feature_store.update(self.country_code, self.city, self.tz, DAYS_HISTORY)
+        model, data = self._load_model(force_retrain)
+        if model is not None:
+            historical_data, weather_forecast = (
+                data if data is not None else (None, self.fetch_weather_forecast()))
+            weather_forecast_featrues = self.create_features(weather_forecast)
+            weather_forecast_featrues['Cei_prediction'] = model.predict(
+                weather_forecast_featrues[self.features])
+            historical_data_featrues = (self.create_features(historical_data)
+                                        if historical_data is not None else pd.DataFrame())
+            return self._output(weather_forecast_featrues), historical_data_featrues
+
+        historical_data, weather_forecast = (
+            data if data is not None else self.fetch_forecast_data())
 
         historical_data_featrues = self.create_features(historical_data)
         weather_forecast_featrues = self.create_features(weather_forecast)
 
-        FEATURES = ['temp_c', 'wind_kph', 'wind_degree', 'pressure_mb', 'precip_mm',
-                    'humidity', 'cloud', 'feelslike_c', 'windchill_c', 'vis_km', 'hour',
-                    'dayofweek']
-        TARGET = 'Carbon_Intensity_CEI'
-
-        X_train = historical_data_featrues[FEATURES]
+        X_train = historical_data_featrues[self.features]
         y_train = historical_data_featrues[TARGET]
 
-        X_test = weather_forecast_featrues[FEATURES]
-
-        reg = xgb.XGBRegressor(base_score=0.5, booster='gbtree',
-                               n_estimators=5000,
-                               early_stopping_rounds=50,
-                               objective='reg:squarederror',
-                               max_depth=5,
-                               learning_rate=0.02)
-        reg.fit(X_train, y_train,
-                eval_set=[(X_train, y_train)],
-                verbose=0)
+        X_test = weather_forecast_featrues[self.features]
+
+        reg, self.fit_report = self.fit_model(X_train, y_train)
+        logger.info(f"{self.country_code}: {self.fit_report['forecaster']} forecast model "
+                    f"trained in {self.fit_report['fit_seconds']:.2f}s, "
+                    f"best iteration {self.fit_report.get('best_iteration')}")
+        if (self.model_store is not None and reg.reusable
+                and "fallback_reason" not in self.fit_report):
+            self.model_store.save(self.country_code, reg, {
+                "country_code": self.country_code,
+                "features": self.features,
+                "target": TARGET,
+                "train_start": X_train.index.min().isoformat(),
+                "train_end": X_train.index.max().isoformat(),
+                "rows": len(X_train),
+                "trained_at": pd.Timestamp.now(tz="UTC").isoformat(),
+                **self.fit_report,
+            })
         weather_forecast_featrues['Cei_prediction'] = reg.predict(X_test)
-        return weather_forecast_featrues, historical_data_featrues
+        return self._output(weather_forecast_featrues), historical_data_featrues
@@ -0,0 +1,353 @@
+import logging
+import os
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Protocol
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+try:
+    from statsmodels.tsa.statespace.sarimax import SARIMAX
+except ImportError:  # optional, only needed by SarimaxForecaster
+    SARIMAX = None
+
+# most recent hours of the history held out for early stopping
+VALIDATION_HOURS = int(os.environ.get("FORECAST_VALIDATION_HOURS", 24))
+# XGBoost threads per training, None uses all cores
+N_JOBS = int(os.environ["FORECAST_N_JOBS"]) if "FORECAST_N_JOBS" in os.environ else None
+# wall-clock limit of one training in seconds
+TIME_BUDGET = float(os.environ.get("FORECAST_TIME_BUDGET", 60))
+
+# forecaster trained by default and the cheap one served when it fails or is too slow
+FORECASTER = os.environ.get("FORECAST_MODEL", "xgboost")
+FALLBACK = os.environ.get("FORECAST_FALLBACK", "seasonal_naive")
+# seconds a primary training may overrun its budget before the fallback is served
+GRACE_SECONDS = 5.0
+
+logger = logging.getLogger("Data_Loader")
+
+
+class TimeBudget(xgb.callback.TrainingCallback):
+    """Stops boosting once a training ran longer than `seconds`; the model keeps
+    the best iteration found by early stopping so far
+    """
+
+    def __init__(self, seconds: float):
+        super().__init__()
+        self.seconds = seconds
+        self.exceeded = False
+
+    def before_training(self, model):
+        self.start = time.perf_counter()
+        self.rounds = 0
+        return model
+
+    def before_iteration(self, model, epoch, evals_log) -> bool:
+        # checked before the next round: xgboost calls the callbacks in no fixed order and
+        # stops at the first one returning True, so stopping after a round could skip the
+        # early stopping bookkeeping of that round (no best score after the first one)
+        self.exceeded = self.rounds > 0 and time.perf_counter() - self.start > self.seconds
+        return self.exceeded
+
+    def after_iteration(self, model, epoch, evals_log) -> bool:
+        self.rounds += 1
+        return False
+
+
+def fit_regressor(X, y, n_jobs=N_JOBS, time_budget=TIME_BUDGET,
+                  validation_hours=VALIDATION_HOURS, **params) -> tuple[xgb.XGBRegressor, dict]:
+    """Trains the forecast regressor with early stopping on the last `validation_hours`
+    of the data, which are not used for fitting. Falls back to the training set as
+    evaluation set when the history is too short to hold out a day.
+
+    Parameters:
+        X, y: features and target indexed by time, rows of several series may share a time
+        params: XGBRegressor parameters overriding the defaults
+
+    Returns:
+        reg, report (tuple): the model, predicting with its best iteration, and
+        best_iteration, validation_rmse, fit_seconds and budget_exceeded
+    """
+    split = X.index.max() - pd.Timedelta(hours=validation_hours)
+    train = X.index <= split
+    if train.sum() < validation_hours or train.all():
+        train[:] = True
+        eval_set = [(X, y)]
+    else:
+        eval_set = [(X[~train], y[~train])]
+    budget = TimeBudget(time_budget)
+    reg = xgb.XGBRegressor(**{
+        "base_score": 0.5,
+        "booster": 'gbtree',
+        "tree_method": 'hist',
+        "n_estimators": 5000,
+        "early_stopping_rounds": 50,
+        "objective": 'reg:squarederror',
+        "eval_metric": 'rmse',
+        "max_depth": 5,
+        "learning_rate": 0.02,
+        "n_jobs": n_jobs,
+        "callbacks": [budget],
+        **params,
+    })
+    fit_start = time.perf_counter()
+    reg.fit(X[train], y[train],
+            eval_set=eval_set,
+            verbose=0)
+    fit_seconds = time.perf_counter() - fit_start
+    report = {
+        "best_iteration": int(reg.best_iteration),
+        "validation_rmse": float(reg.best_score),
+        "fit_seconds": fit_seconds,
+        "budget_exceeded": budget.exceeded,
+    }
+    return reg, report
+
+
+class Forecaster(Protocol):
+    """Model that forecasts the carbon intensity from features indexed by hour
+
+    `reusable` tells whether a fitted model can be stored and forecast later hours from
+    their features alone; models that forecast from the history seen at fit time
+    (seasonal naive, SARIMAX) would serve stale values and are trained on every run.
+    """
+
+    name: str
+    reusable: bool
+
+    def fit(self, X: pd.DataFrame, y: pd.Series) -> dict:
+        """Trains on the history and returns a report with at least `fit_seconds`"""
+
+    def predict(self, X: pd.DataFrame) -> np.ndarray:
+        """Forecasts the hours of X, which follow the history the model was fitted on"""
+
+    def save(self, path: str):
+        """Writes the fitted model to a file"""
+
+    @classmethod
+    def load(cls, path: str) -> "Forecaster":
+        """Reads a model written by `save`"""
+
+
+class PickleMixin(object):
+    """save/load for forecasters whose state pickles"""
+
+    extension = "pkl"
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            pickle.dump(self, f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, "rb") as f:
+            return pickle.load(f)
+
+
+class XGBoostForecaster(object):
+    """The gradient boosting model of Next3DaysForecast, see fit_regressor
+
+    Attributes
+    ----------
+    params : dict
+        XGBRegressor parameters overriding the defaults of fit_regressor
+    n_jobs : int
+        XGBoost threads of the training
+    time_budget : float
+        seconds after which boosting stops
+    """
+
+    name = "xgboost"
+    extension = "json"
+    reusable = True
+
+    def __init__(self, params: dict = None, n_jobs=N_JOBS, time_budget=TIME_BUDGET,
+                 regressor: xgb.XGBRegressor = None):
+        self.params = params or {}
+        self.n_jobs = n_jobs
+        self.time_budget = time_budget
+        self.regressor = regressor
+
+    def fit(self, X, y) -> dict:
+        self.regressor, report = fit_regressor(X, y, n_jobs=self.n_jobs,
+                                               time_budget=self.time_budget, **self.params)
+        return report
+
+    def predict(self, X) -> np.ndarray:
+        return self.regressor.predict(X)
+
+    def save(self, path):
+        self.regressor.save_model(path)
+
+    @classmethod
+    def load(cls, path):
+        regressor = xgb.XGBRegressor()
+        regressor.load_model(path)
+        return cls(regressor=regressor)
+
+
+class SeasonalNaiveForecaster(PickleMixin):
+    """Repeats the last observed value of the same hour of the season (a day by default)
+
+    Attributes
+    ----------
+    season : int
+        length of the season in hours
+    """
+
+    name = "seasonal_naive"
+    reusable = False
+
+    def __init__(self, season: int = 24):
+        self.season = season
+        self.history: pd.Series = None
+
+    def fit(self, X, y) -> dict:
+        start = time.perf_counter()
+        self.history = y.dropna().astype(np.float64)
+        return {"fit_seconds": time.perf_counter() - start}
+
+    def predict(self, X) -> np.ndarray:
+        season = pd.Timedelta(hours=self.season)
+        last = self.history.index.max()
+        # number of whole seasons to step back to reach observed history
+        steps = np.maximum(1, np.ceil((X.index - last) / season).astype(int))
+        values = self.history.reindex(X.index - steps * season).to_numpy()
+        return np.where(np.isnan(values), self.history.mean(), values)
+
+
+class RidgeForecaster(PickleMixin):
+    """Ridge regression on the weather features and one-hot hour and day of week
+
+    Attributes
+    ----------
+    alpha : float
+        regularization strength
+    """
+
+    name = "ridge"
+    reusable = True
+    CALENDAR = {"hour": range(24), "dayofweek": range(7)}
+
+    def __init__(self, alpha: float = 1.0):
+        self.alpha = alpha
+        self.model = None
+        self.columns: list[str] = None
+
+    def _design(self, X) -> pd.DataFrame:
+        design = X.drop(columns=[col for col in self.CALENDAR if col in X.columns])
+        for col, categories in self.CALENDAR.items():
+            if col in X.columns:
+                onehot = pd.get_dummies(pd.Categorical(X[col].astype(int), categories=categories),
+                                        prefix=col, dtype=np.float64)
+                onehot.index = X.index
+                design = design.join(onehot)
+        return design.astype(np.float64)
+
+    def fit(self, X, y) -> dict:
+        from sklearn.impute import SimpleImputer
+        from sklearn.linear_model import Ridge
+        from sklearn.pipeline import make_pipeline
+        from sklearn.preprocessing import StandardScaler
+
+        start = time.perf_counter()
+        design = self._design(X)
+        self.columns = list(design.columns)
+        self.model = make_pipeline(SimpleImputer(), StandardScaler(), Ridge(alpha=self.alpha))
+        self.model.fit(design.to_numpy(), y.to_numpy(dtype=np.float64))
+        return {"fit_seconds": time.perf_counter() - start}
+
+    def predict(self, X) -> np.ndarray:
+        return self.model.predict(self._design(X).reindex(columns=self.columns).to_numpy())
+
+
+class SarimaxForecaster(PickleMixin):
+    """Seasonal ARIMA with the weather as exogenous regressors; needs statsmodels
+
+    Attributes
+    ----------
+    order, seasonal_order : tuple
+        SARIMAX orders, the seasonal period is a day
+    exog : list
+        columns of X used as exogenous regressors
+    """
+
+    name = "sarimax"
+    reusable = False
+
+    def __init__(self, order=(1, 0, 1), seasonal_order=(1, 0, 1, 24),
+                 exog=("temp_c", "wind_kph", "cloud")):
+        self.order = order
+        self.seasonal_order = seasonal_order
+        self.exog = list(exog)
+        self.results = None
+
+    def _exog(self, X) -> np.ndarray:
+        return X.reindex(columns=self.exog).astype(np.float64).fillna(self.means).to_numpy()
+
+    def fit(self, X, y) -> dict:
+        if SARIMAX is None:
+            raise ImportError("SarimaxForecaster needs statsmodels")
+        start = time.perf_counter()
+        y = y.astype(np.float64).asfreq("h")
+        X = X.reindex(y.index)
+        self.means = X.reindex(columns=self.exog).astype(np.float64).mean()
+        model = SARIMAX(y.interpolate().to_numpy(), exog=self._exog(X), order=self.order,
+                        seasonal_order=self.seasonal_order)
+        self.results = model.fit(disp=False)
+        self.end = y.index.max()
+        return {"fit_seconds": time.perf_counter() - start}
+
+    def predict(self, X) -> np.ndarray:
+        # forecast every hour from the end of the history to the last hour of X
+        index = pd.date_range(self.end + pd.Timedelta(hours=1), X.index.max(), freq="h")
+        exog = X.reindex(index)
+        forecast = self.results.forecast(steps=len(index), exog=self._exog(exog))
+        return pd.Series(forecast, index=index).reindex(X.index).to_numpy()
+
+
+FORECASTERS: dict[str, type] = {
+    forecaster.name: forecaster
+    for forecaster in (XGBoostForecaster, SeasonalNaiveForecaster, RidgeForecaster, SarimaxForecaster)
+}
+
+
+def build_forecaster(name, n_jobs=N_JOBS, time_budget=TIME_BUDGET, **params) -> Forecaster:
+    """Creates a forecaster by name; `params` go to its constructor (to XGBRegressor for xgboost)"""
+    if name == XGBoostForecaster.name:
+        return XGBoostForecaster(params, n_jobs=n_jobs, time_budget=time_budget)
+    return FORECASTERS[name](**params)
+
+
+def fit_with_fallback(primary: Forecaster, fallback: Forecaster, X, y,
+                      time_budget=TIME_BUDGET) -> tuple[Forecaster, dict]:
+    """Fits the primary forecaster within the time budget, or the fallback instead
+
+    The primary one is abandoned when it raises or does not finish within the budget
+    plus GRACE_SECONDS. Its thread cannot be interrupted and runs to completion in the
+    background, but its result is dropped. XGBoost stops itself at the budget (see
+    TimeBudget), so for it the timeout only catches a stalled training. Until an
+    abandoned fit ends, its cores are used next to the fallback and the trainings that
+    follow, so the CPU budget of the callers counts it as one more training in flight.
+
+    Returns:
+        forecaster, report (tuple): the fitted forecaster and its report, with the name
+        of the forecaster and, on fallback, the reason
+    """
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="forecaster")
+    future = pool.submit(primary.fit, X, y)
+    try:
+        report = future.result(timeout=time_budget + GRACE_SECONDS)
+        return primary, {**report, "forecaster": primary.name}
+    except TimeoutError:
+        reason = f"fit did not finish within {time_budget:.0f}s"
+    except Exception as e:
+        reason = repr(e)
+    finally:
+        pool.shutdown(wait=False)
+    logger.warning(f"{primary.name} forecaster not used, {reason}; serving {fallback.name}")
+    report = fallback.fit(X, y)
+    return fallback, {**report, "forecaster": fallback.name, "fallback_reason": reason}
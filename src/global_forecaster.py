@@ -0,0 +1,213 @@
+import logging
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from src.emissions_kernel import TAG_ORDER
+from src.forecast_calculator import DAYS_FORECAST, FEATURES, TARGET
+from src.forecasters import N_JOBS, TIME_BUDGET, XGBoostForecaster
+from src.model_store import ModelStore, RetrainPolicy
+from src.weather_store import WeatherHistoryStore
+from src.weatherapi_async import fetch_forecasts
+from utils.capitals import CAPITAL_COORDINATES
+from utils.cron import european_countries
+
+logger = logging.getLogger("Data_Loader")
+
+MODEL_NAME = "global"
+# days of history of all countries the global model is trained on
+HISTORY_DAYS = int(os.environ.get("GLOBAL_HISTORY_DAYS", 28))
+# generation columns are stored lower case
+MIX_TAGS = [tag.lower() for tag in TAG_ORDER]
+MIX_FEATURES = [f"mix_{tag}" for tag in MIX_TAGS]
+# the mix is averaged over a week and taken from before the forecast horizon, so the
+# same value is known for every predicted hour
+MIX_WINDOW = 7 * 24
+MIX_LAG = DAYS_FORECAST * 24
+GLOBAL_FEATURES = FEATURES + ["country_code", "latitude", "longitude"] + MIX_FEATURES
+
+
+@dataclass
+class GlobalForecaster(object):
+    """One XGBoost model for the carbon intensity of all countries
+
+    The model is trained on the history of every country at once, with the country code,
+    the coordinates of the capital and the recent generation mix as features next to the
+    weather and calendar ones; the next days of all countries are predicted with a
+    single `predict` call.
+
+    Attributes
+    ----------
+    engine : sqlalchemy.engine.Engine
+        database holding the emissions, generation and weather_historical tables
+    countries : list
+        (country, country code, capital city, timezone) tuples
+    history_days : int
+        days of history the model is trained on
+    model_store : ModelStore
+        if set, the model is stored and reused until `retrain_policy` asks for a new one
+    retrain_policy : RetrainPolicy
+        when the stored model is trained again
+    n_jobs : int
+        XGBoost threads of the training
+    time_budget : float
+        seconds after which boosting stops
+    fit_report : dict
+        best iteration, validation RMSE and fit time of the last training
+    """
+
+    engine: object
+    countries: list = field(default_factory=lambda: list(european_countries))
+    history_days: int = HISTORY_DAYS
+    model_store: ModelStore = None
+    retrain_policy: RetrainPolicy = None
+    n_jobs: int = N_JOBS
+    time_budget: float = TIME_BUDGET
+    fit_report: dict = None
+
+    @property
+    def country_codes(self) -> list[str]:
+        return [country[1] for country in self.countries]
+
+    def _read_hourly(self, table_name, columns, start_date, end_date) -> pd.DataFrame:
+        """Hourly averages of `columns` of all countries, indexed by UTC hour"""
+        values = ", ".join(f'avg("{col}") AS "{col}"' for col in columns)
+        query = text(f"""
+            SELECT date_trunc('hour', "index") AS hour, country_code, {values}
+            FROM "{table_name}"
+            WHERE country_code IN :country_codes AND "index" >= :start AND "index" < :end
+            GROUP BY 1, 2
+            ORDER BY 1
+        """).bindparams(bindparam("country_codes", expanding=True))
+        with self.engine.connect() as connection:
+            result = connection.execute(query, {"country_codes": self.country_codes,
+                                                "start": start_date, "end": end_date})
+            df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        df = df.set_index("hour")
+        df.index = pd.DatetimeIndex(df.index).tz_convert("UTC")
+        return df
+
+    def load_mix(self, start_date, end_date) -> dict[str, pd.DataFrame]:
+        """Share of each production type in the generation, per country and hour"""
+        generation = self._read_hourly("generation", MIX_TAGS, start_date, end_date)
+        mix = {}
+        for country_code, df in generation.groupby("country_code"):
+            df = df[MIX_TAGS].astype(float).fillna(0.0).asfreq("h")
+            total = df.sum(axis=1).replace(0.0, np.nan)
+            mix[country_code] = df.div(total, axis=0)
+        return mix
+
+    @staticmethod
+    def mix_features(mix: pd.DataFrame, times: pd.DatetimeIndex) -> pd.DataFrame:
+        """Weekly mean of the mix ending `MIX_LAG` hours before each of `times`"""
+        columns = dict(zip(MIX_TAGS, MIX_FEATURES))
+        if mix is None or mix.empty:
+            return pd.DataFrame(np.nan, index=times, columns=MIX_FEATURES)
+        trailing = mix.rolling(MIX_WINDOW, min_periods=1).mean()
+        lagged = trailing.reindex(times - pd.Timedelta(hours=MIX_LAG), method="ffill")
+        lagged.index = times
+        return lagged.rename(columns=columns)
+
+    def _features(self, country_code, tz, weather, mix) -> pd.DataFrame:
+        """Global model features of one country, indexed by UTC time"""
+        df = weather.copy()
+        df.index = df.index.tz_convert("UTC")
+        local = df.index.tz_convert(tz)
+        df["hour"] = local.hour
+        df["dayofweek"] = local.dayofweek
+        df["country_code"] = pd.Categorical([country_code] * len(df),
+                                            categories=self.country_codes)
+        df["latitude"], df["longitude"] = CAPITAL_COORDINATES[country_code]
+        return df.join(self.mix_features(mix, df.index))
+
+    def load_history(self) -> pd.DataFrame:
+        """Training rows of all countries: features and target, indexed by UTC time"""
+        end_date = pd.Timestamp.now(tz="UTC").floor("h")
+        start_date = end_date - pd.Timedelta(days=self.history_days)
+        emissions = self._read_hourly("emissions", [TARGET], start_date, end_date)
+        mix = self.load_mix(start_date - pd.Timedelta(hours=MIX_WINDOW + MIX_LAG), end_date)
+        weather_store = WeatherHistoryStore(self.engine)
+        frames = []
+        for country, country_code, city, tz in self.countries:
+            target = emissions.loc[emissions["country_code"] == country_code, [TARGET]]
+            if target.empty:
+                logger.warning(f"global model: no emissions stored for {country_code}")
+                continue
+            weather = weather_store.history(city, tz, start_date.tz_convert(tz),
+                                            end_date.tz_convert(tz))
+            features = self._features(country_code, tz, weather, mix.get(country_code))
+            frames.append(features.join(target.astype(float), how="inner"))
+        history = pd.concat(frames).sort_index()
+        return history.dropna(subset=[TARGET])
+
+    def fit(self, history: pd.DataFrame) -> XGBoostForecaster:
+        reg = XGBoostForecaster({"enable_categorical": True}, n_jobs=self.n_jobs,
+                                time_budget=self.time_budget)
+        self.fit_report = reg.fit(history[GLOBAL_FEATURES], history[TARGET])
+        logger.info(f"global model trained on {len(history)} rows, "
+                    f"best iteration {self.fit_report['best_iteration']}, "
+                    f"{self.fit_report['fit_seconds']:.2f}s")
+        if self.model_store is not None:
+            self.model_store.save(MODEL_NAME, reg, {
+                "countries": self.country_codes,
+                "features": GLOBAL_FEATURES,
+                "target": TARGET,
+                "train_start": history.index.min().isoformat(),
+                "train_end": history.index.max().isoformat(),
+                "rows": len(history),
+                "trained_at": pd.Timestamp.now(tz="UTC").isoformat(),
+                **self.fit_report,
+            })
+        return reg
+
+    def model(self, force_retrain=False) -> XGBoostForecaster:
+        """Returns the stored model if the retrain policy accepts it, else trains one"""
+        if self.model_store is not None and not force_retrain:
+            policy = self.retrain_policy or RetrainPolicy()
+            reg, metadata = self.model_store.load(MODEL_NAME)
+            reason = policy.reason(metadata, GLOBAL_FEATURES)
+            if reason is None and metadata.get("countries") == self.country_codes:
+                return reg
+            logger.info(f"training global forecast model, {reason or 'countries changed'}")
+        return self.fit(self.load_history())
+
+    def predict(self, force_retrain=False) -> dict[str, pd.DataFrame]:
+        """Forecasts the next days of every country
+
+        Returns:
+            forecasts (dict): country code -> weather forecast with hour, dayofweek and
+            Cei_prediction, indexed by local time like Next3DaysForecast.train_and_predict
+        """
+        reg = self.model(force_retrain)
+        weather = fetch_forecasts([(city, tz) for _, _, city, tz in self.countries],
+                                  DAYS_FORECAST)
+        if weather.empty:
+            return {}
+        now = pd.Timestamp.now(tz="UTC").floor("h")
+        mix = self.load_mix(now - pd.Timedelta(hours=MIX_WINDOW + MIX_LAG), now)
+        frames = {}
+        for country, country_code, city, tz in self.countries:
+            city_weather = weather[weather["city"] == city].drop(columns="city")
+            city_weather = city_weather[city_weather.index >= now]
+            if not city_weather.empty:
+                frames[country_code] = self._features(country_code, tz, city_weather,
+                                                      mix.get(country_code))
+        if not frames:
+            return {}
+        batch = pd.concat(frames.values())
+        predictions = reg.predict(batch[GLOBAL_FEATURES])
+        forecasts, position = {}, 0
+        for (country, country_code, city, tz) in self.countries:
+            if country_code not in frames:
+                continue
+            forecast = frames[country_code]
+            forecast = forecast.drop(columns=["country_code", "latitude", "longitude"]
+                                     + MIX_FEATURES)
+            forecast["Cei_prediction"] = predictions[position:position + len(forecast)]
+            position += len(forecast)
+            forecast.index = forecast.index.tz_convert(tz)
+            forecasts[country_code] = forecast
+        return forecasts
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+from dataclasses import dataclass
+
+import pandas as pd
+
+from src.forecasters import FORECASTERS, Forecaster, XGBoostForecaster
+
+MODEL_DIR = os.environ.get("MODEL_DIR", "models")
+
+
+class ModelStore(object):
+    """Trained forecast models on disk, one per name (country code), each with a JSON
+    metadata file holding the forecaster, the feature schema and the data window it was
+    trained on
+
+    Attributes
+    ----------
+    directory : str
+        directory of the model files
+    """
+
+    def __init__(self, directory: str = MODEL_DIR):
+        self.directory = directory
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, name, forecaster=XGBoostForecaster):
+        base = os.path.join(self.directory, name)
+        return f"{base}.{forecaster.extension}", f"{base}.meta.json"
+
+    def save(self, name, model: Forecaster, metadata: dict):
+        """Writes model and metadata; files are replaced atomically so readers never see
+        a half written model
+        """
+        model_path, meta_path = self._paths(name, type(model))
+        metadata = {**metadata, "forecaster": model.name,
+                    "saved_at": pd.Timestamp.now(tz="UTC").isoformat()}
+        # the temporary file keeps the extension, XGBoost picks the format from it
+        root, extension = os.path.splitext(model_path)
+        model_tmp = f"{root}.tmp{extension}"
+        with self._lock:
+            model.save(model_tmp)
+            with open(f"{meta_path}.tmp", "w") as f:
+                json.dump(metadata, f, indent=2, default=str)
+            os.replace(model_tmp, model_path)
+            os.replace(f"{meta_path}.tmp", meta_path)
+
+    def metadata(self, name) -> dict:
+        meta_path = self._paths(name)[1]
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            return json.load(f)
+
+    def load(self, name) -> tuple[Forecaster, dict]:
+        """Returns (model, metadata), (None, None) if no model is stored"""
+        with self._lock:
+            metadata = self.metadata(name)
+            if metadata is None:
+                return None, None
+            forecaster = FORECASTERS[metadata.get("forecaster", XGBoostForecaster.name)]
+            model_path = self._paths(name, forecaster)[0]
+            if not os.path.exists(model_path):
+                return None, None
+            model = forecaster.load(model_path)
+        return model, metadata
+
+
+@dataclass
+class RetrainPolicy(object):
+    """When a stored model has to be trained again
+
+    Attributes
+    ----------
+    max_age : pd.Timedelta
+        retrain when the model was trained longer ago than this
+    new_data : pd.Timedelta
+        retrain when this much data arrived after the end of the training window
+    drift_mae : float
+        retrain when the mean absolute error in gCO₂eq/kWh on the last `drift_window`
+        of actual data exceeds this value; None disables the check, which also saves
+        loading the history on normal runs
+    drift_window : pd.Timedelta
+        window of recent data the drift is measured on
+    """
+
+    max_age: pd.Timedelta = pd.Timedelta(hours=int(os.environ.get("RETRAIN_MAX_AGE_HOURS", 24)))
+    new_data: pd.Timedelta = pd.Timedelta(hours=int(os.environ.get("RETRAIN_NEW_DATA_HOURS", 24)))
+    drift_mae: float = None
+    drift_window: pd.Timedelta = pd.Timedelta(hours=24)
+
+    def reason(self, metadata: dict, features: list[str], now: pd.Timestamp = None,
+               drift: float = None) -> str:
+        """Returns why the model has to be retrained, None if it can be used as is"""
+        if metadata is None:
+            return "no stored model"
+        if metadata.get("features") != list(features):
+            return "feature schema changed"
+        now = now or pd.Timestamp.now(tz="UTC")
+        age = now - pd.Timestamp(metadata["trained_at"])
+        if age > self.max_age:
+            return f"model is {age} old"
+        new_data = now - pd.Timestamp(metadata["train_end"])
+        if new_data > self.new_data:
+            return f"{new_data} of data newer than the training window"
+        if drift is not None and self.drift_mae is not None and drift > self.drift_mae:
+            return f"recent MAE {drift:.1f} above {self.drift_mae}"
+        return None
@@ -0,0 +1,121 @@
+import logging
+import random
+import threading
+import time
+
+import requests
+
+logger = logging.getLogger("Data_Loader")
+
+# HTTP statuses telling us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+
+class TokenBucket(object):
+    """Token bucket allowing `requests_per_minute` on average with bursts of `burst` requests"""
+
+    def __init__(self, requests_per_minute: float, burst: int = None):
+        self.rate = requests_per_minute / 60.0
+        self.capacity = burst or max(1, int(self.rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency(object):
+    """AIMD limit on the number of requests in flight: the limit grows by one per
+    window of successful requests and is halved whenever the server throttles us.
+    """
+
+    def __init__(self, initial: int = 4, minimum: int = 1, maximum: int = 32):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self.condition:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(self.minimum, self.limit / 2)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self.condition.notify_all()
+
+
+class RateLimiter(object):
+    """Token bucket, adaptive concurrency and jittered exponential backoff in front of
+    a callable issuing HTTP requests
+
+    Attributes
+    ----------
+    bucket : TokenBucket
+        average request budget
+    concurrency : AdaptiveConcurrency
+        limit of requests in flight
+    max_retries : int
+        retries of a throttled request before the error is raised
+    base_delay : float
+        first backoff delay in seconds, doubled on every retry
+    max_delay : float
+        cap of the backoff delay in seconds
+    """
+
+    def __init__(self, requests_per_minute: float, burst: int = None, initial_concurrency: int = 4,
+                 max_concurrency: int = 32, max_retries: int = 5, base_delay: float = 2.0,
+                 max_delay: float = 120.0):
+        self.bucket = TokenBucket(requests_per_minute, burst)
+        self.concurrency = AdaptiveConcurrency(initial_concurrency, maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def backoff(self, attempt: int, response: requests.Response = None) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            # a server asking for hours would otherwise stall the country thread
+            return min(self.max_delay, float(retry_after))
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def call(self, func, *args, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            self.concurrency.acquire()
+            try:
+                result = func(*args, **kwargs)
+            except requests.HTTPError as e:
+                status = e.response.status_code if e.response is not None else None
+                throttled = status in THROTTLE_STATUSES
+                self.concurrency.release(throttled=throttled)
+                if not throttled or attempt == self.max_retries:
+                    raise
+                delay = self.backoff(attempt, e.response)
+                logger.warning(f"throttled with HTTP {status}, retrying in {delay:.1f}s "
+                               f"(concurrency limit {self.concurrency.limit:.1f})")
+                time.sleep(delay)
+            except BaseException:
+                self.concurrency.release()
+                raise
+            else:
+                self.concurrency.release()
+                return result
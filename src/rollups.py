@@ -0,0 +1,148 @@
+import threading
+
+import pandas as pd
+from sqlalchemy import text
+
+# rollup name -> (date_trunc unit, source: None for the raw table or another rollup)
+RESOLUTIONS: dict[str, tuple[str, str]] = {
+    "hourly": ("hour", None),
+    "daily": ("day", "hourly"),
+    "monthly": ("month", "daily"),
+}
+# tables the loaders keep rollups of
+ROLLUP_TABLES = ("generation", "emissions", "load", "prices")
+
+_prepared: set[str] = set()
+_prepared_lock = threading.Lock()
+
+
+def rollup_table_name(table_name: str, resolution: str) -> str:
+    return f"{table_name}_{resolution}"
+
+
+def ensure_rollup_table(engine, rollup_name, columns):
+    """Creates the rollup table, and any value column that is missing, once per process"""
+    with _prepared_lock:
+        key = f"{rollup_name}:{','.join(columns)}"
+        if key in _prepared:
+            return
+        with engine.begin() as connection:
+            connection.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS "{rollup_name}" (
+                    bucket TIMESTAMPTZ NOT NULL,
+                    country_code TEXT NOT NULL,
+                    samples INTEGER NOT NULL,
+                    PRIMARY KEY (bucket, country_code)
+                )
+            """))
+            for col in columns:
+                connection.execute(text(
+                    f'ALTER TABLE "{rollup_name}" ADD COLUMN IF NOT EXISTS "{col}" DOUBLE PRECISION'))
+        _prepared.add(key)
+
+
+def bucket_bounds(first, last, unit, tz="UTC") -> tuple[pd.Timestamp, pd.Timestamp]:
+    """Returns [start, end) of the `unit` buckets holding `first` to `last`, aligned to
+    local time of `tz`: the start of the bucket of `first` and the end of the bucket of
+    `last`, so a day is 23 or 25 hours long on the DST changes
+    """
+    first, last = (pd.Timestamp(ts) for ts in (first, last))
+    if first.tzinfo is None:
+        first, last = first.tz_localize("UTC"), last.tz_localize("UTC")
+    if unit == "hour":
+        # floored with the UTC offset of the moment, the repeated hour of a DST end
+        # stays two separate buckets
+        def floor_hour(ts):
+            offset = ts.tz_convert(tz).utcoffset()
+            return (ts.tz_convert("UTC") + offset).floor("h") - offset
+
+        return floor_hour(first), floor_hour(last) + pd.Timedelta(hours=1)
+    step = pd.DateOffset(days=1) if unit == "day" else pd.DateOffset(months=1)
+
+    def truncate(ts):
+        wall = ts.tz_convert(tz).tz_localize(None).normalize()
+        return wall.replace(day=1) if unit == "month" else wall
+
+    start, end = truncate(first), truncate(last) + step
+    return tuple(ts.tz_localize(tz, ambiguous=True, nonexistent="shift_forward") for ts in (start, end))
+
+
+def _rollup_query(table_name, rollup_name, source_name, unit, columns, index_label):
+    updates = ", ".join(f'"{col}" = EXCLUDED."{col}"' for col in columns)
+    names = ", ".join(f'"{col}"' for col in columns)
+    if source_name is None:
+        # hourly buckets straight from the raw table
+        time_col, source = f'"{index_label}"', f'"{table_name}"'
+        samples = "count(*)"
+        values = ", ".join(f'avg("{col}")' for col in columns)
+    else:
+        # coarser buckets from the finer rollup, weighted by the number of raw samples
+        time_col, source = "bucket", f'"{source_name}"'
+        samples = "sum(samples)"
+        # a NULL bucket of a column carries no weight in its own average
+        values = ", ".join(f'sum("{col}" * samples) / '
+                           f'nullif(sum(samples) FILTER (WHERE "{col}" IS NOT NULL), 0)'
+                           for col in columns)
+    return text(f"""
+        INSERT INTO "{rollup_name}" (bucket, country_code, samples, {names})
+        SELECT date_trunc(:unit, {time_col}, :tz), country_code, {samples}, {values}
+        FROM {source}
+        WHERE country_code = :country_code
+        AND {time_col} >= :start AND {time_col} < :end
+        GROUP BY 1, 2
+        ON CONFLICT (bucket, country_code) DO UPDATE SET samples = EXCLUDED.samples, {updates}
+    """)
+
+
+def update_rollups(engine, table_name, df, country_code, tz="UTC", index_label="index",
+                   resolutions=tuple(RESOLUTIONS)):
+    """Recomputes the hourly, daily and monthly buckets touched by a write
+
+    Only buckets between the first and last timestamp of `df` are rebuilt: hourly ones
+    from the raw rows, daily ones from the hourly rollup and monthly ones from the daily
+    rollup, so the cost does not grow with the history stored. Bucket bounds are computed
+    in local time of `tz`, so days and months keep their length across DST changes
+    whatever the timezone of the database session.
+
+    Parameters:
+        table_name (str): raw table that was written
+        df (pd.DataFrame): rows just written, indexed by timestamp
+        tz (str): timezone the day and month buckets are aligned to
+    """
+    columns = [col for col in df.select_dtypes("number").columns if col != "country_code"]
+    if df.empty or not columns:
+        return
+    rebuild_rollups(engine, table_name, country_code, columns, df.index.min(), df.index.max(),
+                    tz=tz, index_label=index_label, resolutions=resolutions)
+
+
+def rebuild_rollups(engine, table_name, country_code, columns, first, last, tz="UTC",
+                    index_label="index", resolutions=tuple(RESOLUTIONS)):
+    """Recomputes the buckets of `columns` from `first` to `last` from the raw table,
+    e.g. after stored rows were rewritten outside of the loaders
+    """
+    params = {"country_code": country_code, "tz": tz}
+    for resolution in resolutions:
+        unit, source = RESOLUTIONS[resolution]
+        start, end = bucket_bounds(first, last, unit, tz)
+        rollup_name = rollup_table_name(table_name, resolution)
+        source_name = rollup_table_name(table_name, source) if source else None
+        ensure_rollup_table(engine, rollup_name, columns)
+        query = _rollup_query(table_name, rollup_name, source_name, unit, columns, index_label)
+        with engine.begin() as connection:
+            connection.execute(query, {**params, "unit": unit, "start": start, "end": end})
+
+
+def read_rollup(engine, table_name, resolution, country_code, start_date, end_date) -> pd.DataFrame:
+    """Reads pre-aggregated buckets of a country, indexed by bucket start"""
+    query = text(f"""
+        SELECT *
+        FROM "{rollup_table_name(table_name, resolution)}"
+        WHERE country_code = :country_code AND bucket >= :start AND bucket < :end
+        ORDER BY bucket
+    """)
+    with engine.connect() as connection:
+        result = connection.execute(
+            query, {"country_code": country_code, "start": start_date, "end": end_date})
+        df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+    return df.set_index("bucket")
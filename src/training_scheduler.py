@@ -0,0 +1,177 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from src.factor_store import EmissionFactors
+from src.feature_store import FeatureStore
+from src.forecast_calculator import Next3DaysForecast
+from src.forecasters import N_JOBS
+from src.model_store import MODEL_DIR, ModelStore, RetrainPolicy
+from src.weather_store import WeatherHistoryStore
+
+logger = logging.getLogger("Data_Loader")
+
+# XGBoost threads of one training, FORECAST_N_JOBS as for the in-thread training; the week
+# of hourly data of a country is too small for more threads to pay off, so by default the
+# cores are split between processes instead
+THREADS_PER_TRAINING = N_JOBS or 1
+# the loaders call train_countries while their country and HTTP threads are alive, which
+# a forked worker could inherit mid-operation (held locks, open connections)
+MP_CONTEXT = multiprocessing.get_context("spawn")
+
+_engine = None
+_model_store = None
+_factors = None
+
+
+def _init_worker(database_url, model_dir):
+    global _engine, _model_store, _factors
+    _engine = create_engine(database_url, pool_size=1)
+    _model_store = ModelStore(model_dir) if model_dir else None
+    _factors = EmissionFactors.load(_engine)
+
+
+@dataclass
+class TrainingResult(object):
+    """Forecast and timings of the model of one country"""
+
+    country_code: str
+    forecast: pd.DataFrame = None
+    fit_report: dict = None
+    elapsed: float = 0.0
+    cpu_seconds: float = 0.0
+    error: str = None
+
+    def __str__(self):
+        if self.error:
+            return f"{self.country_code}: failed, {self.error}"
+        if self.fit_report is None:
+            return f"{self.country_code}: stored model used, {self.elapsed:.1f}s"
+        return (f"{self.country_code}: {self.fit_report['forecaster']} "
+                f"fit {self.fit_report['fit_seconds']:.1f}s, "
+                f"best iteration {self.fit_report.get('best_iteration')}, "
+                f"total {self.elapsed:.1f}s, cpu {self.cpu_seconds:.1f}s")
+
+
+def train_country(country, country_code, city, tz, n_jobs, retrain_policy=None,
+                  force_retrain=False, feature_store=False) -> TrainingResult:
+    """Trains (or loads) and predicts the model of one country in a worker process"""
+    start, cpu_start = time.perf_counter(), time.process_time()
+    forecaster = Next3DaysForecast(country_code, country, city, tz,
+                                   engine=_engine,
+                                   weather_store=WeatherHistoryStore(_engine),
+                                   model_store=_model_store,
+                                   retrain_policy=retrain_policy,
+                                   n_jobs=n_jobs,
+                                   factors=_factors,
+                                   feature_store=FeatureStore(_engine) if feature_store else None)
+    forecast, _ = forecaster.train_and_predict(force_retrain)
+    # process_time counts the CPU time of all threads of the worker
+    return TrainingResult(country_code, forecast, forecaster.fit_report,
+                          time.perf_counter() - start, time.process_time() - cpu_start)
+
+
+@dataclass
+class TrainingReport(object):
+    """Outcome of one parallel training run"""
+
+    results: list[TrainingResult] = field(default_factory=list)
+    wall_seconds: float = 0.0
+    cpus: int = 1
+
+    @property
+    def cpu_seconds(self) -> float:
+        return sum(result.cpu_seconds for result in self.results)
+
+    @property
+    def cpu_utilization(self) -> float:
+        """Share of the available core time the trainings used"""
+        if self.wall_seconds == 0:
+            return 0.0
+        return self.cpu_seconds / (self.wall_seconds * self.cpus)
+
+    def forecasts(self) -> dict[str, pd.DataFrame]:
+        return {result.country_code: result.forecast for result in self.results
+                if result.forecast is not None}
+
+    def __str__(self):
+        failed = sum(1 for result in self.results if result.error)
+        return (f"trained {len(self.results)} countries in {self.wall_seconds:.1f}s "
+                f"({failed} failed), {self.cpu_seconds:.1f} cpu seconds, "
+                f"{self.cpu_utilization:.0%} of {self.cpus} cores")
+
+
+def expected_cost(model_store: ModelStore, country_code) -> float:
+    """Fit time of the previous training of a country; countries never trained are
+    assumed to be the most expensive
+    """
+    metadata = model_store.metadata(country_code) if model_store else None
+    if not metadata or "fit_seconds" not in metadata:
+        return float("inf")
+    return metadata["fit_seconds"]
+
+
+def training_order(countries, model_store: ModelStore) -> list:
+    """Countries in decreasing order of their expected fit time, never trained ones first"""
+    return sorted(countries, key=lambda c: expected_cost(model_store, c[1]), reverse=True)
+
+
+def train_countries(countries, database_url, model_dir=MODEL_DIR,
+                    retrain_policy: RetrainPolicy = None, force_retrain=False,
+                    threads_per_training=THREADS_PER_TRAINING,
+                    max_workers=None, feature_store=False) -> TrainingReport:
+    """Trains and predicts the models of many countries in a process pool sized to the host
+
+    Every worker gets `threads_per_training` XGBoost threads and the pool gets
+    cpu_count / threads_per_training processes, so the cores are never oversubscribed.
+    Workers are spawned, so they import the calling script again and must not run
+    anything at import time beyond definitions (see data_loader_EU_full.py). A primary
+    fit abandoned at its time budget keeps running next to the fallback (see
+    fit_with_fallback), so a worker can briefly use twice `threads_per_training`.
+    Countries are submitted in decreasing order of their previous fit time (longest
+    processing time first), which keeps the slowest training from starting last.
+
+    Parameters:
+        countries (list): (country, country code, capital city, timezone) tuples
+        database_url (str): database of the emissions and weather_historical tables
+        model_dir (str): ModelStore directory, None to always train and never store
+        max_workers (int): number of processes, derived from the cores by default
+        feature_store (bool): train on the materialized features (see FeatureStore)
+
+    Returns:
+        report (TrainingReport): forecasts, per-country fit times and CPU utilization
+    """
+    cpus = os.cpu_count() or 1
+    if max_workers is None:
+        max_workers = max(1, cpus // threads_per_training)
+    max_workers = min(max_workers, len(countries)) or 1
+    model_store = ModelStore(model_dir) if model_dir else None
+    ordered = training_order(countries, model_store)
+
+    report = TrainingReport(cpus=cpus)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=MP_CONTEXT,
+                             initializer=_init_worker,
+                             initargs=(database_url, model_dir)) as pool:
+        futures = {pool.submit(train_country, *country, n_jobs=threads_per_training,
+                               retrain_policy=retrain_policy, force_retrain=force_retrain,
+                               feature_store=feature_store): country
+                   for country in ordered}
+        for future in as_completed(futures):
+            country_code = futures[future][1]
+            try:
+                result = future.result()
+            except Exception as e:
+                logger.exception(f"forecast training failed for {country_code}: {e}")
+                result = TrainingResult(country_code, error=repr(e))
+            report.results.append(result)
+            logger.info(str(result))
+    report.wall_seconds = time.perf_counter() - start
+    logger.info(str(report))
+    return report
@@ -0,0 +1,53 @@
+import os
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+# re-fetch this much before the last stored timestamp to pick up late revisions
+LOOKBACK = pd.Timedelta(hours=int(os.environ.get("WATERMARK_LOOKBACK_HOURS", 3)))
+
+
+def get_watermark(engine, table_name, country_code, index_label="index"):
+    """Returns the latest stored timestamp of a country in a table
+
+    Returns:
+        watermark (pd.Timestamp): latest timestamp (UTC), None if nothing is stored yet
+    """
+    query = text(f"""
+        SELECT max("{index_label}")
+        FROM "{table_name}"
+        WHERE country_code = :country_code
+    """)
+    try:
+        with engine.connect() as connection:
+            watermark = connection.execute(query, {"country_code": country_code}).scalar()
+    except ProgrammingError:
+        # table does not exist yet
+        return None
+    if watermark is None:
+        return None
+    watermark = pd.Timestamp(watermark)
+    if watermark.tzinfo is None:
+        watermark = watermark.tz_localize("UTC")
+    return watermark.tz_convert("UTC")
+
+
+def fetch_window(engine, table_name, country_code, start_date, end_date,
+                 index_label="index", lookback=LOOKBACK):
+    """Narrows the [start_date, end_date) window to what is not stored yet
+
+    Parameters:
+        start_date (pd.Timestamp): earliest start, used when nothing is stored
+        end_date (pd.Timestamp): end of the window
+        lookback (pd.Timedelta): how far before the watermark to start again
+
+    Returns:
+        start_date, end_date (tuple): window to request; start_date >= end_date
+            means there is nothing to fetch
+    """
+    watermark = get_watermark(engine, table_name, country_code, index_label)
+    if watermark is None:
+        return start_date, end_date
+    start = (watermark - lookback).tz_convert(start_date.tz).floor("h")
+    return max(start_date, start), end_date
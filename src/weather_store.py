@@ -0,0 +1,93 @@
+import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.exc import ProgrammingError
+
+from src.db_cleanup import upsert_dataframe
+from src.weatherapi_collector import HistoricalWeather
+
+logger = logging.getLogger("Data_Loader")
+
+
+class WeatherHistoryStore(object):
+    """Historical hourly weather kept in a table keyed by (time, city)
+
+    Only days that are not stored completely are requested from WeatherAPI, one request
+    per day, concurrently. Today is always requested again as its later hours change.
+
+    Attributes
+    ----------
+    engine : sqlalchemy.engine.Engine
+        engine of the database holding the table
+    table_name : str
+        name of the table
+    max_workers : int
+        maximal number of concurrent WeatherAPI requests
+    """
+
+    def __init__(self, engine, table_name="weather_historical", max_workers=7):
+        self.engine = engine
+        self.table_name = table_name
+        self.max_workers = max_workers
+
+    def stored_days(self, city, tz, start_date, end_date) -> set[datetime.date]:
+        """Returns the local days of [start_date, end_date) with a complete set of hours"""
+        query = text(f"""
+            SELECT ("time" AT TIME ZONE :tz)::date AS day, count(*) AS hours
+            FROM "{self.table_name}"
+            WHERE city = :city AND "time" >= :start AND "time" < :end
+            GROUP BY 1
+        """)
+        try:
+            with self.engine.connect() as connection:
+                rows = connection.execute(query, {"tz": tz, "city": city,
+                                                  "start": start_date, "end": end_date})
+                # 23 hours on the day the clocks go forward
+                return {row.day for row in rows if row.hours >= 23}
+        except ProgrammingError:
+            return set()
+
+    def _fetch_day(self, city, tz, day) -> int:
+        weather = HistoricalWeather(city, tz, 1).fetch(day)
+        weather["city"] = city
+        return upsert_dataframe(weather, self.engine, self.table_name, "time",
+                                on_conflict="update")
+
+    def fetch_missing(self, city, tz, start_date, end_date) -> list[datetime.date]:
+        """Fetches and stores the days of [start_date, end_date) that are not stored yet
+
+        Returns:
+            missing (list): days that were requested
+        """
+        days = pd.date_range(start_date.normalize(), end_date - pd.Timedelta(seconds=1), freq="d")
+        today = pd.Timestamp.now(tz=tz).date()
+        stored = self.stored_days(city, tz, start_date, end_date)
+        missing = [day.date() for day in days if day.date() >= today or day.date() not in stored]
+        if missing:
+            logger.info(f"fetching historical weather in {city} for {len(missing)} days")
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                list(pool.map(lambda day: self._fetch_day(city, tz, day), missing))
+        return missing
+
+    def load(self, city, tz, start_date, end_date) -> pd.DataFrame:
+        """Reads the stored hours of [start_date, end_date), indexed by local time"""
+        query = text(f"""
+            SELECT *
+            FROM "{self.table_name}"
+            WHERE city = :city AND "time" >= :start AND "time" < :end
+            ORDER BY "time"
+        """)
+        with self.engine.connect() as connection:
+            result = connection.execute(query, {"city": city, "start": start_date, "end": end_date})
+            df = pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+        df = df.drop(columns="city").set_index("time")
+        df.index = pd.DatetimeIndex(df.index).tz_convert(tz)
+        return df
+
+    def history(self, city, tz, start_date, end_date) -> pd.DataFrame:
+        """Returns the hourly weather of [start_date, end_date), fetching missing days first"""
+        self.fetch_missing(city, tz, start_date, end_date)
+        return self.load(city, tz, start_date, end_date)
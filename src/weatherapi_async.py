@@ -0,0 +1,148 @@
+import asyncio
+import datetime
+import logging
+import os
+
+import aiohttp
+import pandas as pd
+
+from src.weatherapi_collector import (FORECAST_DROP_COLUMNS, WEATHERAPI_RETRIES,
+                                      WEATHERAPI_TIMEOUT, WEATHERAPI_URL, decode_json,
+                                      parse_forecastdays)
+
+logger = logging.getLogger("Data_Loader")
+
+# maximal number of requests in flight at once
+WEATHERAPI_CONCURRENCY = int(os.environ.get("WEATHERAPI_CONCURRENCY", 10))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class AsyncWeatherClient(object):
+    """Asynchronous WeatherAPI.com client with a pooled session and a concurrency limit.
+    Batch methods fetch many cities (and dates) concurrently and return one long-format
+    dataframe with a `city` column.
+
+    Use as an async context manager:
+
+        async with AsyncWeatherClient() as client:
+            forecast = await client.forecast_many([("Vienna", "Europe/Vienna")], days=3)
+
+    Attributes
+    ----------
+    api_key : str
+        WeatherAPI key, defaults to API_KEY_WEATHERAPI
+    concurrency : int
+        maximal number of requests in flight
+    timeout : int
+        total timeout of a single request in seconds
+    retries : int
+        number of retries on connection errors and 429/5xx responses
+    """
+
+    def __init__(self, api_key=None, concurrency=WEATHERAPI_CONCURRENCY,
+                 timeout=WEATHERAPI_TIMEOUT, retries=WEATHERAPI_RETRIES):
+        self.api_key = api_key or os.environ["API_KEY_WEATHERAPI"]
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.session = None
+        self.semaphore = None
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.concurrency),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.session.close()
+
+    async def _get(self, endpoint, **params) -> dict:
+        params["key"] = self.api_key
+        for attempt in range(self.retries + 1):
+            try:
+                async with self.semaphore:
+                    async with self.session.get(f"{WEATHERAPI_URL}{endpoint}",
+                                                params=params) as response:
+                        if response.status not in RETRY_STATUSES:
+                            response.raise_for_status()
+                            return decode_json(await response.read())
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            if attempt == self.retries:
+                response.raise_for_status()
+            await asyncio.sleep(2 ** attempt)
+
+    async def forecast(self, city, tz, days) -> pd.DataFrame:
+        """Weather forecast of a city, same columns as WeatherForecast.fetch plus `city`"""
+        payload = await self._get("forecast.json", q=city, days=days, aqi="yes")
+        weather = parse_forecastdays(payload, tz).drop(FORECAST_DROP_COLUMNS, axis=1)
+        weather["city"] = city
+        return weather
+
+    async def history(self, city, tz, day) -> pd.DataFrame:
+        """Historical weather of a city for one day, same columns as HistoricalWeather.fetch plus `city`"""
+        payload = await self._get("history.json", q=city, dt=str(day))
+        weather = parse_forecastdays(payload, tz)
+        weather["city"] = city
+        return weather
+
+    @staticmethod
+    def _combine(requests, results) -> pd.DataFrame:
+        frames = []
+        for request, result in zip(requests, results):
+            if isinstance(result, Exception):
+                logger.error(f"weather request {request} failed: {result!r}")
+            else:
+                frames.append(result)
+        if not frames:
+            return pd.DataFrame()
+        return pd.concat(frames)
+
+    async def forecast_many(self, locations, days) -> pd.DataFrame:
+        """Forecast for many cities in one concurrent burst
+
+        Parameters:
+            locations (list): (city, timezone) tuples
+            days (int): number of days of forecast
+
+        Returns:
+            weather (pd.DataFrame): long-format forecast of all cities that succeeded
+        """
+        results = await asyncio.gather(
+            *(self.forecast(city, tz, days) for city, tz in locations), return_exceptions=True)
+        return self._combine(locations, results)
+
+    async def history_many(self, locations, days) -> pd.DataFrame:
+        """Historical weather for every combination of cities and days
+
+        Parameters:
+            locations (list): (city, timezone) tuples
+            days (list): datetime.date objects
+
+        Returns:
+            weather (pd.DataFrame): long-format history of all requests that succeeded
+        """
+        requests = [(city, tz, day) for city, tz in locations for day in days]
+        results = await asyncio.gather(
+            *(self.history(city, tz, day) for city, tz, day in requests), return_exceptions=True)
+        return self._combine(requests, results)
+
+
+def fetch_forecasts(locations, days, **kwargs) -> pd.DataFrame:
+    """Synchronous wrapper of AsyncWeatherClient.forecast_many"""
+    async def run():
+        async with AsyncWeatherClient(**kwargs) as client:
+            return await client.forecast_many(locations, days)
+    return asyncio.run(run())
+
+
+def fetch_histories(locations, days: list[datetime.date], **kwargs) -> pd.DataFrame:
+    """Synchronous wrapper of AsyncWeatherClient.history_many"""
+    async def run():
+        async with AsyncWeatherClient(**kwargs) as client:
+            return await client.history_many(locations, days)
+    return asyncio.run(run())
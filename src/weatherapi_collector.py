@@ -1,12 +1,81 @@
+import json
 import os
+import threading
 from dataclasses import dataclass
 
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from utils.weatherapi_tags import CURRENT_WEATHER_TAGS, WEATHER_TAGS
 
+try:
+    # optional, noticeably faster on large history responses
+    import orjson
+except ImportError:
+    orjson = None
+
 WEATHERAPI_URL: str = 'http://api.weatherapi.com/v1/'
+WEATHERAPI_TIMEOUT = int(os.environ.get("WEATHERAPI_TIMEOUT", 30))
+WEATHERAPI_RETRIES = int(os.environ.get("WEATHERAPI_RETRIES", 3))
+WEATHERAPI_POOL_SIZE = int(os.environ.get("WEATHERAPI_POOL_SIZE", 16))
+HOUR_COLUMNS: list[str] = [tag for tag in WEATHER_TAGS if tag != 'time']
+# columns the forecast endpoint results are stored without
+FORECAST_DROP_COLUMNS: list[str] = ['time_epoch', 'wind_dir']
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session() -> requests.Session:
+    """Returns the process-wide WeatherAPI session with connection pooling and retries"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=WEATHERAPI_RETRIES, backoff_factor=1,
+                          status_forcelist=(429, 500, 502, 503, 504))
+            adapter = HTTPAdapter(pool_connections=WEATHERAPI_POOL_SIZE,
+                                  pool_maxsize=WEATHERAPI_POOL_SIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("http://", adapter)
+            _session.mount("https://", adapter)
+    return _session
+
+
+def weatherapi_get(endpoint: str, **params) -> requests.Response:
+    """GET request to a WeatherAPI endpoint, the API key is passed as a query parameter"""
+    params["key"] = os.environ["API_KEY_WEATHERAPI"]
+    response = get_session().get(f'{WEATHERAPI_URL}{endpoint}', params=params,
+                                 timeout=WEATHERAPI_TIMEOUT)
+    response.raise_for_status()
+    return response
+
+
+def decode_json(content: bytes):
+    """Decodes an API response body, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+def parse_forecastdays(payload: dict, tz: str) -> pd.DataFrame:
+    """Flattens the hours of all days of a forecast/history response into one dataframe
+
+    Parameters:
+        payload (dict): decoded API response
+        tz (str): timezone of the returned index
+
+    Returns:
+        weather_data (pd.DataFrame): hourly weather indexed by time
+    """
+    hours = [hour for day in payload["forecast"]["forecastday"] for hour in day["hour"]]
+    epochs = np.fromiter((hour["time_epoch"] for hour in hours), dtype=np.int64, count=len(hours))
+    index = pd.to_datetime(epochs, unit="s", utc=True).tz_convert(tz)
+    index.name = "time"
+    columns = {tag: [hour[tag] for hour in hours] for tag in HOUR_COLUMNS}
+    return pd.DataFrame(columns, index=index)
 
 
 @dataclass
@@ -32,20 +101,7 @@ class WeatherAPIData(object):
     days_forecast: int
 
     def format_weatherapi_data(self, request):
-        weather_data_raw: pd.DataFrame = pd.DataFrame(
-            request.json()["forecast"]['forecastday'])
-        days = []
-        for day in weather_data_raw['hour']:
-            weather_data_raw: pd.DataFrame = pd.DataFrame(
-                day)
-            weather_data_raw = weather_data_raw[WEATHER_TAGS].copy()
-            weather_data_raw = weather_data_raw.set_index("time")
-            weather_data_raw.index = pd.to_datetime(weather_data_raw.index)
-            weather_data_raw.index = weather_data_raw.index.tz_localize(
-                self.tz)
-            days.append(weather_data_raw)
-        merged_weahter_data = pd.concat(days)
-        return merged_weahter_data
+        return parse_forecastdays(decode_json(request.content), self.tz)
 
 
 class CurrentWeather(WeatherAPIData):
@@ -57,8 +113,7 @@ class CurrentWeather(WeatherAPIData):
         Returns:
             current_weather_raw (pd.DataFrame): dataframe with raw current weater data (single timestamp)
         """
-        req: requests.Response = requests.get(
-            f'{WEATHERAPI_URL}current.json?key={os.environ["API_KEY_WEATHERAPI"]}&q={self.location}&aqi=yes')
+        req: requests.Response = weatherapi_get('current.json', q=self.location, aqi='yes')
         current_weather_raw: pd.DataFrame = pd.json_normalize(req.json())
         current_weather_raw = current_weather_raw[CURRENT_WEATHER_TAGS].copy()
         return current_weather_raw
@@ -73,11 +128,10 @@ class WeatherForecast(WeatherAPIData):
         Returns:
             weather_forecast_raw (pd.DataFrame): dataframe with a raw forecast weater data
         """
-        req = requests.Response = requests.get(
-            f'{WEATHERAPI_URL}forecast.json?key={os.environ["API_KEY_WEATHERAPI"]}&q={self.location}&days={self.days_forecast}&aqi=yes')
+        req: requests.Response = weatherapi_get(
+            'forecast.json', q=self.location, days=self.days_forecast, aqi='yes')
         weather_forecast_raw: pd.DataFrame = self.format_weatherapi_data(req)
-        weather_forecast_raw = weather_forecast_raw.drop('time_epoch', axis=1)
-        weather_forecast_raw = weather_forecast_raw.drop('wind_dir', axis=1)
+        weather_forecast_raw = weather_forecast_raw.drop(FORECAST_DROP_COLUMNS, axis=1)
         return weather_forecast_raw
 
 
@@ -89,7 +143,7 @@ class HistoricalWeather(WeatherAPIData):
         Returns:
             weather_historical_raw (pd.DataFrame): dataframe with a raw historical weater data
         """
-        req: requests.Response = requests.get(
-            f'{WEATHERAPI_URL}history.json?key={os.environ["API_KEY_WEATHERAPI"]}&q={self.location}&dt={api_date_from}')
+        req: requests.Response = weatherapi_get(
+            'history.json', q=self.location, dt=str(api_date_from))
         weather_historical_raw: pd.DataFrame = self.format_weatherapi_data(req)
         return weather_historical_raw
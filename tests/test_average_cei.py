@@ -0,0 +1,123 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+
+from src import average_cei
+from src.average_cei import (STATE_TABLE, TOTALS_TABLE, _deltas, refresh,
+                             update_average_cei)
+
+
+class FakeConnection(object):
+    """Records the statements; the baseline query returns `average`, the UPDATE of
+    average_cei reports `updated` rows"""
+
+    def __init__(self, average=None, updated=1):
+        self.average, self.updated = average, updated
+        self.statements = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        sql = " ".join(str(query).split())
+        self.statements.append((sql, dict(params or {})))
+        return SimpleNamespace(scalar=lambda: self.average,
+                               rowcount=self.updated if sql.startswith("UPDATE") else 0)
+
+    def sql(self, prefix):
+        return [(sql, params) for sql, params in self.statements if sql.startswith(prefix)]
+
+
+class FakeEngine(object):
+    def __init__(self, connection):
+        self.connection = connection
+
+    def begin(self):
+        return self.connection
+
+
+def test_deltas_add_new_hours_and_remove_dropped_ones():
+    old = {0: (10.0, 2), 1: (5.0, 1)}
+    new = {0: (16.0, 3), 2: (4.0, 1)}
+    assert _deltas(old, new) == {0: (6.0, 1), 1: (-5.0, -1), 2: (4.0, 1)}
+    assert _deltas(new, new) == {0: (0.0, 0), 2: (0.0, 0)}
+
+
+@pytest.fixture
+def state(monkeypatch):
+    """Stubs the per-day state: the hourly sums of the touched days before and after
+    they are rebuilt"""
+    state = {"before": {}, "after": {}, "has_totals": True, "rebuilt": []}
+
+    def hourly_sums(connection, country_code, first_day, last_day):
+        return state["after"] if state["rebuilt"] else state["before"]
+
+    def rebuild_days(connection, tables, country_code, first_day, last_day):
+        state["rebuilt"].append((first_day, last_day))
+
+    monkeypatch.setattr(average_cei, "ensure_tables", lambda engine: None)
+    monkeypatch.setattr(average_cei, "_has_totals", lambda connection, cc: state["has_totals"])
+    monkeypatch.setattr(average_cei, "_hourly_sums", hourly_sums)
+    monkeypatch.setattr(average_cei, "_rebuild_days", rebuild_days)
+    monkeypatch.setattr(average_cei, "_rebuild_country",
+                        lambda connection, tables, cc: state["rebuilt"].append("all"))
+    return state
+
+
+def _emissions(first, periods):
+    index = pd.date_range(first, periods=periods, freq="h", tz="Europe/Paris")
+    return pd.DataFrame({"Carbon_Intensity_CEI": 100.0, "country_code": "FR"}, index=index)
+
+
+def test_only_the_difference_of_the_touched_days_is_added(state):
+    state["before"] = {22: (300.0, 3), 23: (100.0, 1)}
+    state["after"] = {22: (330.0, 3), 23: (220.0, 2), 0: (50.0, 1)}
+    connection = FakeConnection(average=120.0)
+    # 23:00 to 01:00 local are 21:00 to 23:00 UTC, the state is kept per UTC day
+    update_average_cei(FakeEngine(connection), "FR", _emissions("2023-06-01 23:00", 3))
+    day = pd.Timestamp("2023-06-01").date()
+    assert state["rebuilt"] == [(day, day)]
+    deltas = {params["hour"]: (params["total"], params["samples"])
+              for _, params in connection.sql(f"INSERT INTO {TOTALS_TABLE}")}
+    assert deltas == {22: (30.0, 0), 23: (120.0, 1), 0: (50.0, 1)}
+
+
+def test_a_country_without_totals_is_rebuilt_from_its_history(state):
+    state["has_totals"] = False
+    connection = FakeConnection(average=120.0)
+    update_average_cei(FakeEngine(connection), "FR", _emissions("2023-06-01 12:00", 2))
+    assert state["rebuilt"] == ["all"]
+    assert connection.sql(f"INSERT INTO {TOTALS_TABLE}") == []
+
+
+def _baseline(connection):
+    return next(sql for sql, _ in connection.statements if sql.startswith("SELECT sum(total)"))
+
+
+def test_all_time_baseline_reads_the_running_totals():
+    connection = FakeConnection(average=250.0)
+    refresh(connection, "FR", baseline="all_time")
+    assert f"FROM {TOTALS_TABLE}" in _baseline(connection)
+    assert connection.sql("UPDATE average_cei")[0][1]["average_cei"] == 250.0
+    assert connection.sql("INSERT INTO average_cei ") == []
+
+
+def test_trailing_baseline_reads_the_last_days_of_state():
+    connection = FakeConnection(average=180.0, updated=0)
+    refresh(connection, "FR", baseline="trailing", window_days=7)
+    sql = _baseline(connection)
+    assert f"FROM {STATE_TABLE}" in sql and "day > CURRENT_DATE - :window_days" in sql
+    # a country without a row yet is inserted
+    inserted = connection.sql("INSERT INTO average_cei ")
+    assert inserted[0][1]["average_cei"] == 180.0 and inserted[0][1]["window_days"] == 7
+
+
+def test_no_data_leaves_average_cei_untouched():
+    connection = FakeConnection(average=None)
+    refresh(connection, "FR")
+    assert connection.sql("UPDATE average_cei") == []
+    assert connection.sql("INSERT INTO average_cei ") == []
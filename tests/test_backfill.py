@@ -0,0 +1,61 @@
+import pandas as pd
+
+from src.backfill import Backfill, BackfillChunk, split_range
+
+TZ = "Europe/Berlin"
+
+
+def local(day):
+    return pd.Timestamp(day, tz=TZ)
+
+
+def test_month_chunks_start_at_local_midnight_across_dst():
+    chunks = split_range(local("2023-02-15"), local("2023-04-10"), "month")
+    assert chunks == [
+        (local("2023-02-15"), local("2023-03-01")),
+        (local("2023-03-01"), local("2023-04-01")),
+        (local("2023-04-01"), local("2023-04-10")),
+    ]
+    # the March chunk is an hour short, the clocks go forward on the 26th
+    assert chunks[1][1] - chunks[1][0] == pd.Timedelta(days=31) - pd.Timedelta(hours=1)
+    assert chunks[2][0].utcoffset() == pd.Timedelta(hours=2)
+
+
+def test_quarter_chunks_across_dst():
+    chunks = split_range(local("2023-01-01"), local("2024-01-01"), "quarter")
+    assert [start for start, _ in chunks] == [
+        local("2023-01-01"), local("2023-04-01"), local("2023-07-01"), local("2023-10-01")]
+    assert chunks[-1] == (local("2023-10-01"), local("2024-01-01"))
+    assert [start.utcoffset().seconds // 3600 for start, _ in chunks] == [1, 2, 2, 2]
+
+
+def test_range_inside_one_month_is_a_single_chunk():
+    assert split_range(local("2023-03-05"), local("2023-03-20")) == [
+        (local("2023-03-05"), local("2023-03-20"))]
+
+
+def _backfill(completed, chunk="month"):
+    backfill = Backfill.__new__(Backfill)
+    backfill.chunk = chunk
+    backfill.completed = lambda country_code: completed
+    return backfill
+
+
+def test_plan_skips_chunks_marked_done_or_empty():
+    # checkpoints come back from the database in UTC
+    done = {
+        ("generation", local("2023-02-01").tz_convert("UTC"), local("2023-03-01").tz_convert("UTC")),
+        ("load", local("2023-03-01").tz_convert("UTC"), local("2023-04-01").tz_convert("UTC")),
+    }
+    chunks = _backfill(done).plan("DE", TZ, "2023-02-01", "2023-04-01", ("generation", "load"))
+    assert chunks == [
+        BackfillChunk("generation", "DE", local("2023-03-01"), local("2023-04-01")),
+        BackfillChunk("load", "DE", local("2023-02-01"), local("2023-03-01")),
+    ]
+
+
+def test_plan_refetches_chunks_with_other_bounds():
+    # a month checkpoint does not cover the quarter chunk starting with it
+    done = {("prices", local("2023-01-01"), local("2023-02-01"))}
+    chunks = _backfill(done, "quarter").plan("DE", TZ, "2023-01-01", "2023-04-01", ("prices",))
+    assert chunks == [BackfillChunk("prices", "DE", local("2023-01-01"), local("2023-04-01"))]
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.backtesting import BacktestResult, backtest_origin, rolling_origins
+from src.forecast_calculator import FEATURES, TARGET
+
+
+def _history(start, hours, tz="Europe/Paris"):
+    index = pd.date_range(pd.Timestamp(start, tz="UTC"), periods=hours, freq="H").tz_convert(tz)
+    rng = np.random.default_rng(0)
+    history = pd.DataFrame(rng.uniform(0, 10, (hours, len(FEATURES))), index=index,
+                           columns=FEATURES)
+    history["hour"] = index.hour
+    history["dayofweek"] = index.dayofweek
+    history[TARGET] = 100.0 + 2.0 * history["temp_c"]
+    return history
+
+
+def test_rolling_origins_keep_a_full_history_and_horizon():
+    index = _history("2023-01-01", 12 * 24).index
+    origins = rolling_origins(index, days_history=7, horizon_hours=72, step_hours=24)
+    assert origins[0] == index[0] + pd.Timedelta(days=7)
+    # the last origin still has 72 hours of actuals after it
+    assert origins[-1] + pd.Timedelta(hours=71) <= index[-1]
+    assert origins[-1] + pd.Timedelta(hours=24 + 71) > index[-1]
+    assert np.all(np.diff(origins) == pd.Timedelta(hours=24))
+
+
+def test_rolling_origins_empty_when_the_range_is_too_short():
+    index = _history("2023-01-01", 9 * 24).index
+    assert rolling_origins(index, days_history=7, horizon_hours=72) == []
+
+
+def test_rolling_origins_start_on_a_full_hour():
+    index = pd.date_range("2023-01-01 00:30", periods=12 * 24, freq="H", tz="UTC")
+    assert rolling_origins(index, 7, 72)[0] == pd.Timestamp("2023-01-08 01:00", tz="UTC")
+
+
+def test_backtest_origin_leads_across_dst():
+    # the horizon spans the switch to summer time on 2023-03-26
+    history = _history("2023-03-17 23:00", 10 * 24)
+    origin = pd.Timestamp("2023-03-24 23:00", tz="UTC").tz_convert("Europe/Paris")
+    train = history[history.index < origin]
+    test = history[(history.index >= origin) & (history.index < origin + pd.Timedelta(hours=72))]
+    run = backtest_origin("ridge", {"forecaster": "ridge", "alpha": 1e-6}, "FR", train, test,
+                          origin)
+    assert run["lead"].tolist() == list(range(1, 73))
+    assert len(run["error"]) == 72
+    # the target is linear in the features, ridge recovers it almost exactly
+    assert np.abs(run["error"]).max() < 1.0
+
+
+def _run(config, errors, origin="2023-01-01"):
+    return {"config": config, "country_code": "FR", "origin": pd.Timestamp(origin),
+            "lead": np.arange(1, len(errors) + 1), "error": np.asarray(errors, dtype=float),
+            "fit_seconds": 1.0, "best_iteration": np.nan, "predict_seconds": 0.002,
+            "peak_memory_mb": 100.0}
+
+
+def test_by_horizon_groups_errors_per_config_and_lead():
+    result = BacktestResult([_run("a", [1.0, -2.0]), _run("a", [3.0, 2.0], "2023-01-02"),
+                             _run("b", [0.0, 4.0])])
+    by_horizon = result.by_horizon().set_index(["config", "lead"])
+    assert by_horizon.loc[("a", 1), "mae"] == pytest.approx(2.0)
+    assert by_horizon.loc[("a", 1), "rmse"] == pytest.approx(np.sqrt(5.0))
+    assert by_horizon.loc[("a", 2), "mae"] == pytest.approx(2.0)
+    assert by_horizon.loc[("a", 2), "samples"] == 2
+    assert by_horizon.loc[("b", 2), "mae"] == pytest.approx(4.0)
+
+
+def test_summary_joins_accuracy_and_cost():
+    result = BacktestResult([_run("a", [1.0, -3.0]), _run("a", [2.0, 2.0], "2023-01-02")])
+    summary = result.summary()
+    assert summary.loc["a", "mae"] == pytest.approx(2.0)
+    assert summary.loc["a", "origins"] == 2
+    assert summary.loc["a", "predict_ms_mean"] == pytest.approx(2.0)
+
+
+def test_empty_result():
+    assert BacktestResult().by_horizon().empty
+    assert BacktestResult().summary().empty
@@ -0,0 +1,76 @@
+import threading
+
+import pandas as pd
+import pytest
+from entsoe.exceptions import NoMatchingDataError
+
+from src import country_pipeline
+from src.country_pipeline import (INDEPENDENT_STAGES, CountryJob, database_connections,
+                                  pipeline_engine, run_countries, run_country)
+
+
+def _job(country_code="FR"):
+    start = pd.Timestamp("2023-06-01", tz="Europe/Paris")
+    return CountryJob("France", country_code, "Paris", "Europe/Paris", start,
+                      start + pd.Timedelta(days=1), engine=None)
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    """Replaces the stages by fakes recording the order they ran in"""
+    ran = []
+    lock = threading.Lock()
+
+    def stage(name, result):
+        def run(job):
+            with lock:
+                ran.append(name)
+            if isinstance(result, Exception):
+                raise result
+            return result
+        return run
+
+    fakes = {"generation": stage("generation", 10),
+             "load": stage("load", RuntimeError("load failed")),
+             "prices": stage("prices", NoMatchingDataError()),
+             "weather": stage("weather", 24),
+             "forecast": stage("forecast", 72)}
+    for name, fake in fakes.items():
+        monkeypatch.setitem(country_pipeline.STAGES, name, fake)
+    return ran
+
+
+@pytest.mark.parametrize("stage_workers", [1, len(INDEPENDENT_STAGES)])
+def test_failing_stage_does_not_stop_the_others(stages, stage_workers):
+    result = run_country(_job(), stage_workers)
+    assert result.rows == {"generation": 10, "prices": 0, "weather": 24, "forecast": 72}
+    assert list(result.errors) == ["load"]
+    assert "load failed" in result.errors["load"]
+    assert not result.ok
+    # the forecast runs after all independent stages
+    assert stages[-1] == "forecast"
+
+
+def test_failing_country_does_not_stop_the_others(stages, monkeypatch):
+    def run(job, stage_workers, stages):
+        if job.country_code == "BE":
+            raise RuntimeError("country failed")
+        return run_country(job, stage_workers, stages)
+
+    monkeypatch.setattr(country_pipeline, "run_country", run)
+    results = run_countries([_job("FR"), _job("BE"), _job("NL")], max_workers=2,
+                            stages=("generation",))
+    assert [result.country_code for result in results] == ["FR", "BE", "NL"]
+    assert results[0].rows == {"generation": 10} and results[2].ok
+    assert "country failed" in results[1].errors["run"]
+
+
+def test_database_connections_cover_every_stage_in_flight():
+    assert database_connections(32, 4) == 128
+    assert database_connections(8, 0) == 8
+
+
+def test_pipeline_engine_pool_is_sized_for_the_workers():
+    engine = pipeline_engine("postgresql+psycopg2://user@localhost/db", 32, 4)
+    assert engine.pool.size() == 128
+    assert engine.pool._max_overflow == 128
@@ -0,0 +1,160 @@
+import pandas as pd
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from src import db_cleanup
+from src.db_cleanup import prepare_table, upsert_dataframe
+
+
+class FakeCursor(object):
+    def __init__(self, statements):
+        self.statements = statements
+        self.rowcount = 0
+        self.copied = None
+
+    def execute(self, sql):
+        self.statements.append(" ".join(sql.split()))
+        self.rowcount = 3
+
+    def copy_expert(self, sql, buffer):
+        self.statements.append(" ".join(sql.split()))
+        self.copied = buffer.read()
+
+    def close(self):
+        pass
+
+
+class FakeConnection(object):
+    def __init__(self):
+        self.statements = []
+        self.cursors = []
+        self.committed = self.closed = False
+
+    def cursor(self):
+        self.cursors.append(FakeCursor(self.statements))
+        return self.cursors[-1]
+
+    def commit(self):
+        self.committed = True
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class FakeEngine(object):
+    def __init__(self):
+        self.connection = FakeConnection()
+
+    def raw_connection(self):
+        return self.connection
+
+
+@pytest.fixture
+def prepared(monkeypatch):
+    keys = []
+    monkeypatch.setattr(db_cleanup, "prepare_table",
+                        lambda engine, frame, table_name, key_columns: keys.append(key_columns))
+    return keys
+
+
+def _frame(index_name=None):
+    index = pd.date_range("2023-06-01", periods=2, freq="H", tz="UTC", name=index_name)
+    return pd.DataFrame({"Solar": [1.0, 2.0], "country_code": "FR"}, index=index)
+
+
+def test_keys_come_from_the_table(prepared):
+    upsert_dataframe(_frame(), FakeEngine(), "emissions")
+    upsert_dataframe(_frame(), FakeEngine(), "forecast_data", "time")
+    upsert_dataframe(_frame(), FakeEngine(), "unknown_table", "moment")
+    upsert_dataframe(_frame(), FakeEngine(), "emissions", key_columns=("index",))
+    assert prepared == [("index", "country_code"), ("time", "country_code"),
+                        ("moment", "country_code"), ("index",)]
+
+
+def test_on_conflict_nothing_keeps_stored_rows(prepared):
+    engine = FakeEngine()
+    rows = upsert_dataframe(_frame(), engine, "emissions")
+    insert = engine.connection.statements[-1]
+    assert insert.startswith('INSERT INTO "emissions" ("index", "Solar", "country_code")')
+    assert insert.endswith('ON CONFLICT ("index", "country_code") DO NOTHING')
+    assert rows == 3
+    assert engine.connection.committed and engine.connection.closed
+
+
+def test_on_conflict_update_overwrites_the_value_columns(prepared):
+    engine = FakeEngine()
+    upsert_dataframe(_frame(), engine, "emissions", on_conflict="update")
+    assert engine.connection.statements[-1].endswith(
+        'ON CONFLICT ("index", "country_code") DO UPDATE SET "Solar" = EXCLUDED."Solar"')
+
+
+def test_duplicate_keys_in_the_frame_keep_the_last_row(prepared):
+    engine = FakeEngine()
+    frame = pd.concat([_frame(), _frame().assign(Solar=[5.0, 6.0])])
+    upsert_dataframe(frame, engine, "emissions")
+    copied = engine.connection.cursors[0].copied.splitlines()
+    assert len(copied) == 2 and copied[0].split(",")[1] == "5.0"
+
+
+def test_time_periods_partitions_are_deleted_before_the_insert(prepared):
+    engine = FakeEngine()
+    periods = pd.DataFrame({"start": ["a", "b"], "end": ["b", "c"], "averageIntensity": 1.0,
+                            "country_code": "FR"},
+                           index=pd.Index([pd.Timestamp("2023-06-01").date()] * 2))
+    upsert_dataframe(periods, engine, "time_periods", index_label="date")
+    delete, insert = engine.connection.statements[-2:]
+    assert delete == ('DELETE FROM "time_periods" USING (SELECT DISTINCT "date", "country_code" '
+                      'FROM "time_periods_stage") p WHERE "time_periods"."date" = p."date" '
+                      'AND "time_periods"."country_code" = p."country_code"')
+    assert insert.startswith('INSERT INTO "time_periods"')
+
+
+def test_other_tables_are_not_replaced(prepared):
+    engine = FakeEngine()
+    upsert_dataframe(_frame(), engine, "emissions")
+    assert not any(sql.startswith("DELETE") for sql in engine.connection.statements)
+
+
+def test_empty_frame_writes_nothing(prepared):
+    engine = FakeEngine()
+    assert upsert_dataframe(_frame().iloc[:0], engine, "emissions") == 0
+    assert engine.connection.statements == [] and prepared == []
+
+
+def test_prepare_table_deduplicates_when_the_index_build_fails(monkeypatch):
+    class Connection(object):
+        attempts = 0
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def execute(self, statement):
+            Connection.attempts += 1
+            if Connection.attempts == 1:
+                raise IntegrityError("CREATE UNIQUE INDEX", {}, Exception("duplicate key"))
+
+    class Engine(object):
+        def begin(self):
+            return Connection()
+
+    class Inspector(object):
+        def has_table(self, table_name):
+            return True
+
+    deduplicated = []
+    monkeypatch.setattr(db_cleanup, "inspect", lambda engine: Inspector())
+    monkeypatch.setattr(db_cleanup, "deduplicate_table",
+                        lambda engine, table, keys: deduplicated.append((table, keys)) or 4)
+    monkeypatch.setattr(db_cleanup, "_prepared_tables", set())
+    prepare_table(Engine(), _frame(), "load", ("index", "country_code"))
+    assert deduplicated == [("load", ("index", "country_code"))]
+    assert Connection.attempts == 2
+    # checked once per process
+    prepare_table(Engine(), _frame(), "load", ("index", "country_code"))
+    assert Connection.attempts == 2
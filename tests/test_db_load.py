@@ -0,0 +1,98 @@
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from src import db_load
+from src.db_load import _bulk_upsert, bulk_load_forecast_to_db, ensure_unique_index
+
+
+class FakeCollection(object):
+    """Records the bulk writes; a key already stored counts as matched, and as modified
+    when the value changes"""
+
+    def __init__(self, name="Datapoint_Forecast", stored=None):
+        self.name = name
+        self.stored = dict(stored or {})
+        self.batches = []
+        self.indexes = []
+        self.index_failures = 0
+
+    def bulk_write(self, operations, ordered=True):
+        self.batches.append(len(operations))
+        matched = inserted = modified = 0
+        for operation in operations:
+            key = tuple(sorted(operation._filter.items()))
+            value = operation._doc["$set"]["value"]
+            if key in self.stored:
+                matched += 1
+                modified += self.stored[key] != value
+            else:
+                inserted += 1
+            self.stored[key] = value
+        return SimpleNamespace(matched_count=matched, upserted_count=inserted,
+                               modified_count=modified)
+
+    def create_index(self, keys, unique=False):
+        if self.index_failures:
+            self.index_failures -= 1
+            raise DuplicateKeyError("E11000 duplicate key error")
+        self.indexes.append((tuple(keys), unique))
+
+
+@pytest.fixture(autouse=True)
+def fresh_indexes(monkeypatch):
+    monkeypatch.setattr(db_load, "_indexed_collections", set())
+
+
+def _operations(values):
+    return [UpdateOne({"country": "FR", "timestamp": i}, {"$set": {"value": value}}, upsert=True)
+            for i, value in enumerate(values)]
+
+
+def test_bulk_upsert_sends_chunks():
+    collection = FakeCollection()
+    counts = _bulk_upsert(collection, _operations(range(25)), chunk_size=10)
+    assert collection.batches == [10, 10, 5]
+    assert counts == {"matched": 0, "inserted": 25, "modified": 0}
+
+
+def test_bulk_upsert_sums_counts_across_chunks():
+    collection = FakeCollection()
+    _bulk_upsert(collection, _operations([1.0] * 4), chunk_size=3)
+    counts = _bulk_upsert(collection, _operations([1.0, 2.0, 1.0, 2.0, 5.0]), chunk_size=3)
+    assert counts == {"matched": 4, "inserted": 1, "modified": 2}
+
+
+def test_unique_index_is_created_once_per_process():
+    collection = FakeCollection()
+    ensure_unique_index(collection, ("timestamp", "country"))
+    ensure_unique_index(collection, ("timestamp", "country"))
+    assert collection.indexes == [((("timestamp", 1), ("country", 1)), True)]
+
+
+def test_duplicates_are_removed_when_the_index_build_fails(monkeypatch):
+    collection = FakeCollection()
+    collection.index_failures = 1
+    deduplicated = []
+    monkeypatch.setattr(db_load, "deduplicate_collection",
+                        lambda collection, keys: deduplicated.append(keys) or 3)
+    ensure_unique_index(collection, ("timestamp", "country"))
+    assert deduplicated == [("timestamp", "country")]
+    assert len(collection.indexes) == 1
+
+
+def test_bulk_load_forecast_to_db(monkeypatch):
+    collection = FakeCollection()
+    client = SimpleNamespace(Stromzeiten_dev={"Datapoint_Forecast": collection})
+    monkeypatch.setattr(db_load, "get_shared_db_client", lambda: client)
+    index = pd.date_range("2023-06-01", periods=5, freq="H", tz="UTC")
+    forecast = pd.DataFrame({"Cei_prediction": [100.0, 110.0, 120.0, 130.0, 140.0]}, index=index)
+    _, counts = bulk_load_forecast_to_db(forecast, "FR", chunk_size=2)
+    assert collection.batches == [2, 2, 1]
+    assert counts == {"matched": 0, "inserted": 5, "modified": 0}
+    _, counts = bulk_load_forecast_to_db(forecast.assign(Cei_prediction=100.0), "FR")
+    assert counts == {"matched": 5, "inserted": 0, "modified": 4}
+    assert len(collection.indexes) == 1
@@ -0,0 +1,76 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import emissions_kernel
+from src.emissions_kernel import (EMISSION_COLUMNS, FACTOR_TAGS, GENERATION_COLUMNS, TAG_ORDER,
+                                  emissions, emissions_for_countries, factor_vector,
+                                  generation_matrix, generation_totals)
+from utils.emission_factors import CO2_FACTORS
+
+INDEX = pd.date_range("2023-03-01", periods=3, freq="H", tz="UTC")
+
+
+def _raw(**columns):
+    return pd.DataFrame(columns, index=INDEX[:len(next(iter(columns.values())))])
+
+
+def test_generation_matrix_orders_tags_and_fills_missing():
+    raw = _raw(**{"Solar": [10.0, np.nan, 30.0], "Fossil Gas": [5.0, 6.0, 7.0],
+                  "Unknown type": [1.0, 1.0, 1.0]})
+    matrix = generation_matrix(raw)
+    assert matrix.shape == (3, len(TAG_ORDER))
+    assert matrix[:, TAG_ORDER.index("Solar")].tolist() == [10.0, 0.0, 30.0]
+    assert matrix[:, TAG_ORDER.index("Gas")].tolist() == [5.0, 6.0, 7.0]
+    assert matrix.sum() == pytest.approx(58.0)
+
+
+def test_generation_totals_split_renewables():
+    matrix = generation_matrix(_raw(**{"Solar": [10.0], "Fossil Gas": [5.0]}))
+    renewables, non_renewables, total = generation_totals(matrix)[0]
+    assert (renewables, non_renewables, total) == (10.0, 5.0, 15.0)
+
+
+def test_emissions_match_the_per_column_formula():
+    raw = _raw(**{"Solar": [100.0, 0.0], "Fossil Gas": [50.0, 0.0],
+                  "Nuclear": [200.0, 0.0]})
+    result = emissions(generation_matrix(raw))
+    frame = pd.DataFrame(result, index=raw.index, columns=EMISSION_COLUMNS)
+    # MW * gCO₂eq/kWh / 1e3 gives tCO₂eq
+    assert frame["Gas_CEI"].iloc[0] == pytest.approx(50.0 * CO2_FACTORS["Gas"] / 1e3)
+    total = (100 * CO2_FACTORS["Solar"] + 50 * CO2_FACTORS["Gas"]
+             + 200 * CO2_FACTORS["Nuclear"]) / 1e3
+    assert frame["Total_CEI"].iloc[0] == pytest.approx(total)
+    assert frame["Carbon_Intensity_CEI"].iloc[0] == pytest.approx(total * 1e3 / 350.0)
+    # no generation gives an intensity of 0, not NaN
+    assert frame["Carbon_Intensity_CEI"].iloc[1] == 0.0
+
+
+def test_emissions_float32_close_to_float64():
+    rng = np.random.default_rng(0)
+    generation = rng.uniform(0, 1000, size=(24, len(TAG_ORDER)))
+    reference = emissions(generation)
+    single = emissions(generation.astype(np.float32))
+    assert single.dtype == np.float32
+    np.testing.assert_allclose(single, reference, rtol=1e-5)
+
+
+def test_emissions_for_countries_with_factor_per_country():
+    frames = {
+        "BE": _raw(**{"Fossil Gas": [10.0, 10.0]}),
+        "FR": pd.DataFrame({"Fossil Gas": [10.0]}, index=INDEX[1:2]),
+    }
+    doubled = {tag: 2 * value for tag, value in CO2_FACTORS.items()}
+    factors = np.stack([factor_vector(CO2_FACTORS), factor_vector(doubled)])
+    results = emissions_for_countries(frames, factors)
+    generation_be, emissions_be = results["BE"]
+    generation_fr, emissions_fr = results["FR"]
+    assert list(generation_be.columns) == GENERATION_COLUMNS
+    assert len(emissions_be) == 2 and len(emissions_fr) == 1
+    assert emissions_fr.index.tolist() == [INDEX[1]]
+    assert emissions_fr["Gas_CEI"].iloc[0] == pytest.approx(2 * emissions_be["Gas_CEI"].iloc[1])
+
+
+def test_factor_vector_in_factor_tag_order():
+    assert factor_vector(CO2_FACTORS).tolist() == [CO2_FACTORS[tag] for tag in FACTOR_TAGS]
+    np.testing.assert_array_equal(emissions_kernel.FACTORS, factor_vector(CO2_FACTORS))
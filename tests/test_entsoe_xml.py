@@ -0,0 +1,127 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+from entsoe.exceptions import NoMatchingDataError
+
+from src.entsoe_xml import (TimeSeriesGrid, _generation_key, _load_key, _query_streaming,
+                            _generation_params, parse_timeseries)
+
+NS = "urn:iec62325.351:tc57wg16:451-6:generationloaddocument:3:0"
+
+
+def _series(psr_type, resolution, quantities, start="2023-03-01T00:00Z",
+            end="2023-03-01T01:00Z", curve_type="A01", consumption=False, positions=None):
+    positions = positions or range(1, len(quantities) + 1)
+    points = "".join(f"<Point><position>{p}</position><quantity>{q}</quantity></Point>"
+                     for p, q in zip(positions, quantities))
+    domain = ("<outBiddingZone_Domain.mRID codingScheme='A01'>10YBE----------2"
+              "</outBiddingZone_Domain.mRID>" if consumption else
+              "<inBiddingZone_Domain.mRID codingScheme='A01'>10YBE----------2"
+              "</inBiddingZone_Domain.mRID>")
+    psr = f"<MktPSRType><psrType>{psr_type}</psrType></MktPSRType>" if psr_type else ""
+    return (f"<TimeSeries><curveType>{curve_type}</curveType>{domain}{psr}"
+            f"<Period><timeInterval><start>{start}</start><end>{end}</end></timeInterval>"
+            f"<resolution>{resolution}</resolution>{points}</Period></TimeSeries>")
+
+
+def _document(*series, root="GL_MarketDocument"):
+    return (f"<?xml version='1.0' encoding='UTF-8'?><{root} xmlns='{NS}'>"
+            f"{''.join(series)}</{root}>").encode("utf-8")
+
+
+def _grid():
+    return TimeSeriesGrid(pd.Timestamp("2023-03-01 00:00", tz="UTC"),
+                          pd.Timestamp("2023-03-01 01:00", tz="UTC"))
+
+
+def test_a75_mixed_resolutions_on_15_minute_grid():
+    grid = _grid()
+    document = _document(_series("B16", "PT15M", [1, 2, 3, 4]),
+                         _series("B19", "PT60M", [40]))
+    parse_timeseries(io.BytesIO(document), grid, _generation_key)
+    df = grid.to_frame("Europe/Brussels")
+    assert list(df.columns) == ["Solar", "Wind Onshore"]
+    assert len(df) == 4
+    assert df["Solar"].tolist() == [1, 2, 3, 4]
+    # the hourly value holds for each quarter of its hour
+    assert df["Wind Onshore"].tolist() == [40, 40, 40, 40]
+    assert str(df.index.tz) == "Europe/Brussels"
+
+
+def test_hourly_only_is_thinned_to_hourly_rows():
+    grid = _grid()
+    parse_timeseries(io.BytesIO(_document(_series("B19", "PT60M", [40]))), grid,
+                     _generation_key)
+    df = grid.to_frame("UTC")
+    assert df.index.tolist() == [pd.Timestamp("2023-03-01 00:00", tz="UTC")]
+
+
+def test_a03_curve_forward_fills_missing_positions():
+    grid = _grid()
+    document = _document(_series("B16", "PT15M", [5, 7], curve_type="A03",
+                                  positions=[1, 3]))
+    parse_timeseries(io.BytesIO(document), grid, _generation_key)
+    assert grid.to_frame("UTC")["Solar"].tolist() == [5, 5, 7, 7]
+
+
+def test_a01_curve_leaves_missing_positions_empty():
+    grid = _grid()
+    document = _document(_series("B16", "PT15M", [5, 7], positions=[1, 3]))
+    parse_timeseries(io.BytesIO(document), grid, _generation_key)
+    values = grid.arrays["Solar"]
+    assert values[0] == 5 and np.isnan(values[1]) and values[2] == 7
+
+
+def test_a65_load_document():
+    grid = _grid()
+    document = _document(_series(None, "PT15M", [100, 110, 120, 130], consumption=True))
+    parse_timeseries(io.BytesIO(document), grid, _load_key)
+    df = grid.to_frame("UTC")
+    assert df["Actual Load"].tolist() == [100, 110, 120, 130]
+
+
+def test_acknowledgement_raises_no_matching_data():
+    document = (f"<Acknowledgement_MarketDocument xmlns='{NS}'><Reason><code>999</code>"
+                f"<text>No matching data found for Data item ...</text></Reason>"
+                f"</Acknowledgement_MarketDocument>").encode("utf-8")
+    with pytest.raises(NoMatchingDataError):
+        parse_timeseries(io.BytesIO(document), _grid(), _generation_key)
+
+
+class FakeResponse(object):
+    def __init__(self, body: bytes):
+        self.raw = io.BytesIO(body)
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.closed = True
+
+
+class FakeClient(object):
+    def __init__(self, body: bytes):
+        self.body = body
+        self.requests = []
+        self.responses = []
+
+    def stream_request(self, params, start, end):
+        self.requests.append((params, start, end))
+        response = FakeResponse(self.body)
+        self.responses.append(response)
+        return response
+
+
+def test_query_streaming_parses_raw_response_and_closes_it():
+    client = FakeClient(_document(_series("B16", "PT15M", [1, 2, 3, 4])))
+    start = pd.Timestamp("2023-03-01 01:00", tz="Europe/Brussels")
+    end = pd.Timestamp("2023-03-01 02:00", tz="Europe/Brussels")
+    df = _query_streaming(_generation_params, client, "BE", start, end, _generation_key)
+    assert df["Solar"].tolist() == [1, 2, 3, 4]
+    params, _, _ = client.requests[0]
+    assert params["documentType"] == "A75"
+    assert params["in_Domain"] == "10YBE----------2"
+    assert all(response.closed for response in client.responses)
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.emissions_kernel import EMISSION_COLUMNS, TAG_ORDER, emissions, factor_vector
+from src.factor_store import ALL_COUNTRIES, ALL_YEARS, EmissionFactors, save_factors
+from utils.emission_factors import CO2_FACTORS
+
+
+def _factors(*rows):
+    return EmissionFactors("test", pd.DataFrame(rows, columns=["country_code", "year", "tag",
+                                                               "factor"]))
+
+
+def test_lookup_prefers_the_most_specific_row():
+    factors = _factors((ALL_COUNTRIES, ALL_YEARS, "Gas", 500.0),
+                       ("FR", ALL_YEARS, "Gas", 400.0),
+                       ("FR", 2023, "Gas", 300.0))
+    assert factors.factor("FR", 2023, "Gas") == 300.0
+    assert factors.factor("FR", 2022, "Gas") == 400.0
+    assert factors.factor("BE", 2023, "Gas") == 500.0
+    assert factors.factor("BE", 2023, "Coal") == CO2_FACTORS["Coal"]
+
+
+def test_emissions_use_the_factors_of_the_utc_year():
+    factors = _factors(("FR", 2023, "Gas", 1000.0))
+    # 00:30 local on new year is still 2022 in UTC
+    index = pd.DatetimeIndex(["2022-12-31 23:30", "2023-01-01 00:30"], tz="UTC")
+    generation = np.zeros((2, len(TAG_ORDER)))
+    generation[:, TAG_ORDER.index("Gas")] = 100.0
+    result = factors.emissions("FR", generation, index.tz_convert("Europe/Paris"))
+    gas = EMISSION_COLUMNS.index("Gas_CEI")
+    assert result[0, gas] == pytest.approx(100.0 * CO2_FACTORS["Gas"] / 1e3)
+    assert result[1, gas] == pytest.approx(100.0)
+    np.testing.assert_allclose(result[:1], emissions(generation[:1], factor_vector(CO2_FACTORS)))
+
+
+@pytest.mark.parametrize("factors", [{"Gass": 500}, {"Gas": -1}, {"Gas": "high"}])
+def test_save_factors_rejects_invalid_factors(factors):
+    # rejected before the database is touched
+    with pytest.raises(ValueError):
+        save_factors(None, "v", factors)
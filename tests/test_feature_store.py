@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.feature_store import LAG_FEATURES, LAGS, ROLLING_FEATURES, lag_features
+
+
+@pytest.fixture
+def features():
+    # the target is the position of the hour, so every feature is known in closed form
+    index = pd.date_range("2023-06-01", periods=400, freq="h", tz="UTC")
+    return lag_features(pd.Series(np.arange(400, dtype=float), index=index))
+
+
+def test_lags_look_back_at_least_the_forecast_horizon(features):
+    assert list(features.columns) == LAG_FEATURES + ROLLING_FEATURES
+    assert LAGS[0] == 72
+    assert features["lag_72"].iloc[:72].isna().all()
+    assert features["lag_72"].iloc[72] == 0.0
+    assert features["lag_72"].iloc[300] == 228.0
+    assert features["lag_168"].iloc[300] == 132.0
+
+
+def test_rolling_windows_end_at_the_first_lag(features):
+    # the window of hour 300 ends at hour 228, the newest value known 72 hours before
+    assert features["rolling_mean_24"].iloc[300] == pytest.approx(np.arange(205, 229).mean())
+    assert features["rolling_mean_168"].iloc[300] == pytest.approx(np.arange(61, 229).mean())
+    assert features["rolling_std_24"].iloc[300] == pytest.approx(np.arange(205, 229).std(ddof=1))
+    # no value known yet, then partial windows
+    assert features["rolling_mean_24"].iloc[:72].isna().all()
+    assert features["rolling_mean_24"].iloc[75] == pytest.approx(1.5)
@@ -0,0 +1,67 @@
+import pandas as pd
+
+from src.fetch_cache import (FetchCache, contiguous_intervals, merge_intervals,
+                             missing_intervals)
+
+
+def ts(hour, tz="UTC"):
+    return pd.Timestamp("2024-01-01", tz="UTC") + pd.Timedelta(hours=hour)
+
+
+def hourly(first, last, value=1.0, tz="UTC"):
+    index = pd.date_range(ts(first), ts(last), freq="h", inclusive="left").tz_convert(tz)
+    return pd.DataFrame({"value": value}, index=index)
+
+
+def test_merge_intervals_joins_overlapping_and_touching():
+    merged = merge_intervals([(ts(5), ts(6)), (ts(0), ts(2)), (ts(2), ts(3)), (ts(1), ts(2))])
+    assert merged == [(ts(0), ts(3)), (ts(5), ts(6))]
+
+
+def test_missing_intervals_returns_edges_and_gaps():
+    intervals = [(ts(2), ts(4)), (ts(6), ts(8))]
+    assert missing_intervals(intervals, ts(0), ts(10)) == [
+        (ts(0), ts(2)), (ts(4), ts(6)), (ts(8), ts(10))]
+    assert missing_intervals(intervals, ts(2), ts(4)) == []
+    assert missing_intervals(intervals, ts(3), ts(7)) == [(ts(4), ts(6))]
+    assert missing_intervals([], ts(0), ts(1)) == [(ts(0), ts(1))]
+
+
+def test_contiguous_intervals_breaks_at_gaps():
+    index = hourly(0, 3).index.append(hourly(5, 7).index)
+    assert contiguous_intervals(index) == [(ts(0), ts(3)), (ts(5), ts(7))]
+    assert contiguous_intervals(pd.DatetimeIndex([], tz="UTC")) == []
+
+
+def test_get_fetches_only_the_gap_between_cached_intervals():
+    cache = FetchCache()
+    cache.put("emissions", "BE", ts(0), ts(3), hourly(0, 3))
+    cache.put("emissions", "BE", ts(6), ts(9), hourly(6, 9))
+    calls = []
+
+    def fetcher(start, end):
+        calls.append((start, end))
+        return hourly((start - ts(0)) // pd.Timedelta(hours=1),
+                      (end - ts(0)) // pd.Timedelta(hours=1), value=2.0)
+
+    df = cache.get("emissions", "BE", ts(0), ts(9), fetcher)
+    assert calls == [(ts(3), ts(6))]
+    assert len(df) == 9
+    assert cache.coverage("emissions", "BE") == [(ts(0), ts(9))]
+
+
+def test_trailing_edge_is_only_covered_up_to_the_fetched_data():
+    cache = FetchCache()
+    cache.get("emissions", "BE", ts(0), ts(10), lambda start, end: hourly(0, 4))
+    assert cache.coverage("emissions", "BE") == [(ts(0), ts(4))]
+
+
+def test_rows_fetched_in_local_time_and_utc_are_merged():
+    cache = FetchCache()
+    cache.put("emissions", "BE", ts(0), ts(3), hourly(0, 3, tz="Europe/Brussels"))
+    cache.put("emissions", "BE", ts(3), ts(6), hourly(3, 6))
+    df = cache.get("emissions", "BE", ts(0), ts(6), lambda start, end: pd.DataFrame())
+    assert str(df.index.tz) == "UTC"
+    assert df.index.is_monotonic_increasing and df.index.is_unique
+    assert len(df) == 6
+
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+from src.feature_store import FEATURE_COLUMNS
+from src.forecast_calculator import FEATURES, TARGET, Next3DaysForecast
+from src.model_store import ModelStore, RetrainPolicy
+
+TZ = "Europe/Paris"
+
+
+def _data(target_noise=0.0, columns=None):
+    """A week of history and a day of forecast; `columns` defaults to the weather features"""
+    now = pd.Timestamp.now(tz=TZ).floor("h")
+    rng = np.random.default_rng(0)
+    history_index = pd.date_range(now - pd.Timedelta(days=7), now, freq="H", inclusive="left")
+    forecast_index = pd.date_range(now, periods=24, freq="H")
+    columns = columns or [col for col in FEATURES if col not in ("hour", "dayofweek")]
+    historical = pd.DataFrame(rng.uniform(0, 10, (len(history_index), len(columns))),
+                              index=history_index, columns=columns)
+    historical[TARGET] = 100.0 + historical["temp_c"] + target_noise
+    forecast = pd.DataFrame(rng.uniform(0, 10, (len(forecast_index), len(columns))),
+                            index=forecast_index, columns=columns)
+    return historical, forecast
+
+
+def _forecaster(tmp_path, monkeypatch, data, policy):
+    forecaster = Next3DaysForecast("FR", "France", "Paris", TZ, forecaster="ridge",
+                                   model_store=ModelStore(str(tmp_path)), retrain_policy=policy)
+    calls = []
+
+    def fetch():
+        calls.append("history")
+        return data
+
+    monkeypatch.setattr(forecaster, "fetch_forecast_data", fetch)
+    monkeypatch.setattr(forecaster, "fetch_weather_forecast",
+                        lambda: calls.append("weather") or data[1])
+    return forecaster, calls
+
+
+def test_drift_retrain_fetches_the_history_once(tmp_path, monkeypatch):
+    forecaster, calls = _forecaster(tmp_path, monkeypatch, _data(),
+                                    RetrainPolicy(drift_mae=0.0))
+    forecaster.train_and_predict()
+    assert calls == ["history"]
+    calls.clear()
+    # a drift above 0 always retrains, on the data fetched for the drift check
+    forecast, _ = forecaster.train_and_predict()
+    assert calls == ["history"]
+    assert forecaster.fit_report is not None
+    assert len(forecast) == 24
+
+
+def test_stored_model_reuses_the_drift_check_forecast(tmp_path, monkeypatch):
+    forecaster, calls = _forecaster(tmp_path, monkeypatch, _data(),
+                                    RetrainPolicy(drift_mae=1e9))
+    trained, _ = forecaster.train_and_predict()
+    calls.clear()
+    forecaster.fit_report = None
+    reused, _ = forecaster.train_and_predict()
+    assert calls == ["history"]
+    assert forecaster.fit_report is None
+    pd.testing.assert_index_equal(reused.index, trained.index)
+
+
+class FakeFeatureStore(object):
+    def __init__(self, data):
+        self.data = data
+        self.updates = 0
+
+    def update(self, country_code, city, tz, days_history=7):
+        self.updates += 1
+
+    def training_data(self, country_code, tz, days_history=7):
+        return self.data[0]
+
+    def horizon(self, country_code, tz):
+        return self.data[1]
+
+
+def test_feature_store_is_updated_once_per_run(tmp_path):
+    store = FakeFeatureStore(_data(columns=FEATURE_COLUMNS))
+    forecaster = Next3DaysForecast("FR", "France", "Paris", TZ, forecaster="ridge",
+                                   model_store=ModelStore(str(tmp_path)),
+                                   retrain_policy=RetrainPolicy(drift_mae=1e9),
+                                   feature_store=store)
+    forecaster.train_and_predict()
+    assert store.updates == 1
+    # the stored model with its drift check reads history and horizon without another update
+    forecaster.train_and_predict()
+    assert store.updates == 2
+
+
+def test_history_conditioned_models_are_never_stored(tmp_path, monkeypatch):
+    forecaster, calls = _forecaster(tmp_path, monkeypatch, _data(), RetrainPolicy())
+    forecaster.forecaster = "seasonal_naive"
+    forecaster.train_and_predict()
+    assert ModelStore(str(tmp_path)).metadata("FR") is None
+    forecaster.train_and_predict()
+    assert forecaster.fit_report["forecaster"] == "seasonal_naive"
+    assert calls == ["history", "history"]
+
+
+def test_drift_of_a_model_without_recent_predictions_retrains(tmp_path, monkeypatch):
+    class PastBlind(object):
+        def predict(self, X):
+            return np.full(len(X), np.nan)
+
+    historical, _ = _data()
+    forecaster, _ = _forecaster(tmp_path, monkeypatch, _data(), RetrainPolicy(drift_mae=10.0))
+    drift = forecaster._recent_error(PastBlind(), historical)
+    assert drift == float("inf")
+    assert RetrainPolicy(drift_mae=10.0).reason(
+        {"features": FEATURES, "trained_at": pd.Timestamp.now(tz="UTC").isoformat(),
+         "train_end": pd.Timestamp.now(tz="UTC").isoformat()}, FEATURES, drift=drift) is not None
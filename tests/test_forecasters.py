@@ -0,0 +1,173 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+import xgboost as xgb
+
+from src import forecasters
+from src.forecasters import (FORECASTERS, RidgeForecaster, SarimaxForecaster,
+                             SeasonalNaiveForecaster, build_forecaster, fit_regressor,
+                             fit_with_fallback)
+
+
+def _history(days=10, seed=0):
+    index = pd.date_range("2023-06-01", periods=24 * days, freq="h", tz="UTC")
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame({"hour": index.hour, "wind": rng.random(len(index))}, index=index)
+    y = pd.Series(200 + 10 * X["hour"] - 50 * X["wind"], index=index, name="cei")
+    return X, y
+
+
+@pytest.fixture
+def fitted(monkeypatch):
+    """Records the training rows and evaluation set passed to XGBRegressor.fit"""
+    calls = []
+    fit = xgb.XGBRegressor.fit
+
+    def recording_fit(self, X, y, eval_set=None, **kwargs):
+        calls.append((X, eval_set))
+        return fit(self, X, y, eval_set=eval_set, **kwargs)
+
+    monkeypatch.setattr(xgb.XGBRegressor, "fit", recording_fit)
+    return calls
+
+
+def test_last_hours_are_held_out_for_early_stopping(fitted):
+    X, y = _history()
+    fit_regressor(X, y, validation_hours=24, n_estimators=20)
+    train, eval_set = fitted[0]
+    (X_val, y_val), = eval_set
+    # everything after the cut is validation, never training
+    assert train.index.max() == X.index.max() - pd.Timedelta(hours=24)
+    assert X_val.index.min() > train.index.max()
+    assert len(train) + len(X_val) == len(X)
+    assert y_val.index.equals(X_val.index)
+
+
+def test_short_history_is_evaluated_on_the_training_set(fitted):
+    X, y = _history(days=1)
+    fit_regressor(X, y, validation_hours=24, n_estimators=20)
+    train, eval_set = fitted[0]
+    assert len(train) == len(X)
+    assert eval_set[0][0].index.equals(X.index)
+
+
+def test_report_fields():
+    X, y = _history()
+    reg, report = fit_regressor(X, y, n_estimators=200)
+    assert set(report) == {"best_iteration", "validation_rmse", "fit_seconds", "budget_exceeded"}
+    assert 0 <= report["best_iteration"] < 200
+    assert report["validation_rmse"] == pytest.approx(reg.best_score)
+    assert report["fit_seconds"] > 0
+    assert report["budget_exceeded"] is False
+
+
+def test_time_budget_stops_training_after_the_first_round():
+    X, y = _history()
+    reg, report = fit_regressor(X, y, time_budget=0.0001)
+    assert report["budget_exceeded"] is True
+    assert report["best_iteration"] == 0
+    assert reg.get_booster().num_boosted_rounds() == 1
+    assert np.isfinite(report["validation_rmse"])
+    assert len(reg.predict(X.tail(3))) == 3
+
+
+class Failing(object):
+    name = "failing"
+
+    def fit(self, X, y):
+        raise ValueError("singular matrix")
+
+
+class Stalled(object):
+    """Blocks in fit until released, like a training that never finishes"""
+
+    name = "stalled"
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def fit(self, X, y):
+        self.release.wait(5)
+        return {"fit_seconds": 5.0}
+
+
+def test_fallback_is_served_when_the_primary_fit_raises():
+    X, y = _history()
+    model, report = fit_with_fallback(Failing(), SeasonalNaiveForecaster(), X, y)
+    assert isinstance(model, SeasonalNaiveForecaster)
+    assert report["forecaster"] == "seasonal_naive"
+    assert report["fallback_reason"] == "ValueError('singular matrix')"
+
+
+def test_fallback_is_served_when_the_primary_fit_times_out(monkeypatch):
+    monkeypatch.setattr(forecasters, "GRACE_SECONDS", 0.0)
+    X, y = _history()
+    stalled = Stalled()
+    try:
+        model, report = fit_with_fallback(stalled, SeasonalNaiveForecaster(), X, y,
+                                          time_budget=0.05)
+    finally:
+        stalled.release.set()
+    assert isinstance(model, SeasonalNaiveForecaster)
+    assert report["fallback_reason"] == "fit did not finish within 0s"
+
+
+def test_primary_report_is_returned_when_it_fits():
+    X, y = _history()
+    model, report = fit_with_fallback(RidgeForecaster(), SeasonalNaiveForecaster(), X, y)
+    assert isinstance(model, RidgeForecaster)
+    assert report["forecaster"] == "ridge" and "fallback_reason" not in report
+
+
+def test_seasonal_naive_repeats_the_same_hour_of_the_last_day():
+    X, y = _history(days=2)
+    model = SeasonalNaiveForecaster()
+    model.fit(X, y)
+    future = pd.date_range(X.index.max() + pd.Timedelta(hours=1), periods=30, freq="h")
+    predictions = model.predict(pd.DataFrame(index=future))
+    # the first day comes from the last observed day, later hours step back two days
+    assert predictions[:24] == pytest.approx(y.iloc[-24:].to_numpy())
+    assert predictions[24:] == pytest.approx(y.iloc[-24:-18].to_numpy())
+
+
+def test_seasonal_naive_fills_unobserved_hours_with_the_mean():
+    X, y = _history(days=2)
+    # the hour a day before the first forecast hour is missing
+    y.iloc[-24] = np.nan
+    model = SeasonalNaiveForecaster()
+    model.fit(X, y)
+    future = pd.DatetimeIndex([X.index.max() + pd.Timedelta(hours=1)])
+    assert model.predict(pd.DataFrame(index=future)) == pytest.approx([y.mean()])
+
+
+def test_ridge_learns_the_weather_and_hour_effects():
+    X, y = _history()
+    model = RidgeForecaster(alpha=1e-6)
+    model.fit(X, y)
+    # a feature column it was not fitted on is ignored
+    X_new = X.tail(5).assign(unused=1.0)
+    assert model.predict(X_new) == pytest.approx(y.tail(5).to_numpy(), abs=0.1)
+
+
+@pytest.mark.parametrize("name", ["xgboost", "ridge", "seasonal_naive"])
+def test_save_and_load_round_trip(tmp_path, name):
+    X, y = _history()
+    model = build_forecaster(name, n_estimators=20) if name == "xgboost" else build_forecaster(name)
+    model.fit(X, y)
+    path = str(tmp_path / f"model.{model.extension}")
+    model.save(path)
+    loaded = FORECASTERS[name].load(path)
+    future = X.tail(24).set_index(X.index[-24:] + pd.Timedelta(hours=24))
+    assert loaded.predict(future) == pytest.approx(model.predict(future))
+
+
+def test_sarimax_without_statsmodels_falls_back(monkeypatch):
+    monkeypatch.setattr(forecasters, "SARIMAX", None)
+    X, y = _history()
+    with pytest.raises(ImportError, match="statsmodels"):
+        SarimaxForecaster().fit(X, y)
+    model, report = fit_with_fallback(SarimaxForecaster(), SeasonalNaiveForecaster(), X, y)
+    assert report["forecaster"] == "seasonal_naive"
+    assert "statsmodels" in report["fallback_reason"]
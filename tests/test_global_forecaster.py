@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import global_forecaster
+from src.forecast_calculator import FEATURES
+from src.global_forecaster import (MIX_FEATURES, MIX_LAG, MIX_TAGS, MIX_WINDOW,
+                                   GlobalForecaster)
+
+COUNTRIES = [("France", "FR", "Paris", "Europe/Paris"),
+             ("Germany", "DE", "Berlin", "Europe/Berlin"),
+             ("Belgium", "BE", "Brussels", "Europe/Brussels")]
+
+
+def test_mix_is_the_weekly_mean_before_the_forecast_horizon():
+    index = pd.date_range("2023-06-01", periods=3 * MIX_WINDOW, freq="h", tz="UTC")
+    mix = pd.DataFrame(0.0, index=index, columns=MIX_TAGS)
+    mix["nuclear"] = np.arange(len(index), dtype=float)
+    time = index[2 * MIX_WINDOW]
+    features = GlobalForecaster.mix_features(mix, pd.DatetimeIndex([time]))
+    # mean of the week of hours ending MIX_LAG hours before `time`
+    end = 2 * MIX_WINDOW - MIX_LAG
+    assert features.loc[time, "mix_nuclear"] == pytest.approx(
+        np.arange(end - MIX_WINDOW + 1, end + 1).mean())
+    assert list(features.columns) == MIX_FEATURES
+
+
+def test_mix_of_hours_past_the_stored_data_is_the_last_known_one():
+    index = pd.date_range("2023-06-01", periods=MIX_WINDOW, freq="h", tz="UTC")
+    mix = pd.DataFrame(0.0, index=index, columns=MIX_TAGS)
+    mix["wind_on"] = np.arange(len(index), dtype=float)
+    # hours of the forecast horizon, the last stored hour is less than MIX_LAG before them
+    times = pd.date_range(index[-1] + pd.Timedelta(hours=1), periods=MIX_LAG + 5, freq="h")
+    features = GlobalForecaster.mix_features(mix, times)
+    last = mix["wind_on"].mean()
+    assert np.allclose(features["mix_wind_on"].iloc[MIX_LAG - 1:], last)
+    assert features["mix_wind_on"].iloc[0] == pytest.approx(
+        np.arange(MIX_WINDOW - MIX_LAG + 1).mean())
+
+
+def test_missing_mix_gives_nan_features():
+    times = pd.date_range("2023-06-01", periods=3, freq="h", tz="UTC")
+    features = GlobalForecaster.mix_features(None, times)
+    assert features.index.equals(times) and features.isna().all().all()
+
+
+class LatitudePlusTemperature(object):
+    """Predicts from the features of the row alone, so a misplaced prediction shows"""
+
+    def __init__(self):
+        self.batches = []
+
+    def predict(self, X):
+        self.batches.append(X)
+        return (X["latitude"] + X["temp_c"]).to_numpy()
+
+
+def _weather(city, hours, temperatures, now):
+    index = pd.date_range(now, periods=hours, freq="h", tz="UTC")
+    weather = pd.DataFrame(0.0, index=index, columns=FEATURES)
+    weather["temp_c"] = temperatures
+    weather["city"] = city
+    return weather
+
+
+def test_batched_predictions_are_mapped_back_to_each_country(monkeypatch):
+    now = pd.Timestamp.now(tz="UTC").floor("h") + pd.Timedelta(hours=1)
+    weather = pd.concat([_weather("Paris", 5, np.arange(5.0), now),
+                         _weather("Berlin", 3, [10.0, 11.0, 12.0], now)])
+    monkeypatch.setattr(global_forecaster, "fetch_forecasts", lambda cities, days: weather)
+    forecaster = GlobalForecaster(engine=None, countries=COUNTRIES)
+    reg = LatitudePlusTemperature()
+    monkeypatch.setattr(forecaster, "model", lambda force_retrain=False: reg)
+    monkeypatch.setattr(forecaster, "load_mix", lambda start, end: {})
+
+    forecasts = forecaster.predict()
+
+    assert len(reg.batches) == 1 and len(reg.batches[0]) == 8
+    # Brussels has no weather forecast
+    assert set(forecasts) == {"FR", "DE"}
+    assert forecasts["FR"]["Cei_prediction"].tolist() == pytest.approx(48.86 + np.arange(5.0))
+    assert forecasts["DE"]["Cei_prediction"].tolist() == pytest.approx([62.52, 63.52, 64.52])
+    assert str(forecasts["DE"].index.tz) == "Europe/Berlin"
+    assert "country_code" not in forecasts["FR"] and "mix_solar" not in forecasts["FR"]
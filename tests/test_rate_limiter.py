@@ -0,0 +1,124 @@
+import pytest
+import requests
+
+from src import rate_limiter
+from src.rate_limiter import AdaptiveConcurrency, RateLimiter, TokenBucket
+
+
+class FakeClock(object):
+    """monotonic() and sleep() of the limiter, sleeping only advances the clock"""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock.monotonic)
+    monkeypatch.setattr(rate_limiter.time, "sleep", clock.sleep)
+    return clock
+
+
+def http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+def test_token_bucket_allows_a_burst_then_the_average_rate(clock):
+    bucket = TokenBucket(requests_per_minute=60, burst=3)
+    for _ in range(3):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(1.0)]
+
+
+def test_token_bucket_refills_up_to_its_capacity(clock):
+    bucket = TokenBucket(requests_per_minute=120, burst=2)
+    bucket.acquire()
+    bucket.acquire()
+    clock.now += 60
+    for _ in range(2):
+        bucket.acquire()
+    assert clock.sleeps == []
+    bucket.acquire()
+    assert clock.sleeps == [pytest.approx(0.5)]
+
+
+def test_concurrency_grows_additively_and_halves_when_throttled():
+    concurrency = AdaptiveConcurrency(initial=4, minimum=1, maximum=5)
+    for _ in range(4):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == pytest.approx(5.0, abs=0.1)
+    for _ in range(10):
+        concurrency.acquire()
+        concurrency.release()
+    assert concurrency.limit == 5
+    concurrency.acquire()
+    concurrency.release(throttled=True)
+    assert concurrency.limit == pytest.approx(2.5)
+    for _ in range(5):
+        concurrency.acquire()
+        concurrency.release(throttled=True)
+    assert concurrency.limit == 1
+    assert concurrency.in_flight == 0
+
+
+def test_throttled_requests_are_retried_with_retry_after(clock):
+    limiter = RateLimiter(6000, initial_concurrency=4)
+    responses = [http_error(429, {"Retry-After": "7"}), http_error(503), "ok"]
+
+    def request():
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    assert limiter.call(request) == "ok"
+    assert clock.sleeps[0] == 7.0
+    assert 0 <= clock.sleeps[1] <= limiter.base_delay * 2
+    assert limiter.concurrency.limit < 4
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_retry_after_is_capped_at_max_delay():
+    limiter = RateLimiter(6000, max_delay=30.0)
+    assert limiter.backoff(0, http_error(429, {"Retry-After": "3600"}).response) == 30.0
+    assert limiter.backoff(0, http_error(429, {"Retry-After": "12"}).response) == 12.0
+
+
+def test_other_errors_are_raised_without_retry(clock):
+    limiter = RateLimiter(6000)
+    calls = []
+
+    def request():
+        calls.append(1)
+        raise http_error(400)
+
+    with pytest.raises(requests.HTTPError):
+        limiter.call(request)
+    assert len(calls) == 1
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_throttling_gives_up_after_max_retries(clock):
+    limiter = RateLimiter(6000, max_retries=2)
+
+    def request():
+        raise http_error(429)
+
+    with pytest.raises(requests.HTTPError):
+        limiter.call(request)
+    assert len(clock.sleeps) == 2
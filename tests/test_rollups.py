@@ -0,0 +1,59 @@
+import pandas as pd
+
+from src.rollups import bucket_bounds
+
+TZ = "Europe/Paris"
+
+
+def utc(ts):
+    return pd.Timestamp(ts, tz="UTC")
+
+
+def local(ts):
+    return pd.Timestamp(ts, tz=TZ)
+
+
+def test_day_buckets_start_and_end_at_local_midnight():
+    # 23:30 UTC is already the next local day
+    start, end = bucket_bounds(utc("2023-06-01 23:30"), utc("2023-06-02 10:00"), "day", TZ)
+    assert (start, end) == (local("2023-06-02"), local("2023-06-03"))
+
+
+def test_month_buckets_start_and_end_at_the_local_first():
+    start, end = bucket_bounds(utc("2023-01-31 23:15"), utc("2023-03-31 22:30"), "month", TZ)
+    # both timestamps fall into the next local month
+    assert (start, end) == (local("2023-02-01"), local("2023-05-01"))
+    assert end.utcoffset() == pd.Timedelta(hours=2)
+
+
+def test_day_bucket_of_a_dst_change_keeps_its_local_length():
+    start, end = bucket_bounds(utc("2023-10-29 12:00"), utc("2023-10-29 12:00"), "day", TZ)
+    assert end - start == pd.Timedelta(hours=25)
+    start, end = bucket_bounds(utc("2023-03-26 12:00"), utc("2023-03-26 12:00"), "day", TZ)
+    assert end - start == pd.Timedelta(hours=23)
+
+
+def test_last_bucket_before_the_dst_end_ends_at_the_next_local_midnight():
+    # last write on the Saturday evening, the end bound is midnight in summer time
+    start, end = bucket_bounds(utc("2023-10-27 10:00"), utc("2023-10-28 21:45"), "day", TZ)
+    assert end == local("2023-10-29") == utc("2023-10-28 22:00")
+    start, end = bucket_bounds(utc("2023-10-28 10:00"), utc("2023-10-29 22:45"), "day", TZ)
+    assert end == local("2023-10-30") == utc("2023-10-29 23:00")
+
+
+def test_hour_buckets_around_the_repeated_hour():
+    # 02:00-03:00 local happens twice, as two separate hourly buckets
+    assert bucket_bounds(utc("2023-10-29 00:30"), utc("2023-10-29 00:45"), "hour", TZ) == (
+        utc("2023-10-29 00:00"), utc("2023-10-29 01:00"))
+    assert bucket_bounds(utc("2023-10-29 01:30"), utc("2023-10-29 01:30"), "hour", TZ) == (
+        utc("2023-10-29 01:00"), utc("2023-10-29 02:00"))
+
+
+def test_hour_buckets_follow_half_hour_offsets():
+    assert bucket_bounds(utc("2023-06-01 10:10"), utc("2023-06-01 10:10"), "hour",
+                         "Asia/Kolkata") == (utc("2023-06-01 09:30"), utc("2023-06-01 10:30"))
+
+
+def test_naive_timestamps_are_utc():
+    assert bucket_bounds(pd.Timestamp("2023-06-01 23:30"), pd.Timestamp("2023-06-01 23:30"),
+                         "day", TZ) == (local("2023-06-02"), local("2023-06-03"))
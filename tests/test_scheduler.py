@@ -0,0 +1,37 @@
+import pandas as pd
+
+from scheduler import CountrySchedule
+
+COUNTRY = ("France", "FR", "Paris", "Europe/Paris")
+
+
+def test_reschedule_keeps_the_grid_with_jitter():
+    schedule = CountrySchedule(COUNTRY, interval=900, jitter=60)
+    for tick in range(1, 50):
+        # the tick runs late by up to the jitter, which must not add up
+        schedule.reschedule(schedule.next_run)
+        assert schedule.due == tick * 900
+        assert schedule.due <= schedule.next_run <= schedule.due + 60
+
+
+def test_overrunning_run_skips_missed_ticks():
+    schedule = CountrySchedule(COUNTRY, interval=900, jitter=0)
+    schedule.reschedule(now=10)
+    assert schedule.due == 900
+    # the next tick happens only at 3000 s, after slots 1800 and 2700 passed
+    schedule.reschedule(now=3000)
+    assert schedule.due == 3600
+    assert schedule.next_run == 3600
+    # exactly on a slot, that slot counts as passed
+    schedule.reschedule(now=4500)
+    assert schedule.due == 5400
+
+
+def test_job_window_and_options():
+    schedule = CountrySchedule(COUNTRY, interval=900, jitter=0)
+    engine = object()
+    job = schedule.job(engine, n_jobs=2)
+    assert job.engine is engine
+    assert job.incremental and job.n_jobs == 2
+    assert job.end_date - job.start_date == pd.Timedelta(days=1)
+    assert str(job.end_date.tz) == "Europe/Paris"
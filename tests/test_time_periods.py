@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from time_periods import NO_PERIOD, detect_periods
+
+
+def _forecasts(values: dict, start="2023-06-01 00:00"):
+    frames = []
+    for country_code, cei in values.items():
+        hours = pd.date_range(start, periods=len(cei), freq="H", tz="UTC")
+        frames.append(pd.DataFrame({"country_code": country_code, "hour": hours,
+                                    "cei": np.asarray(cei, dtype=float)}))
+    return pd.concat(frames, ignore_index=True)
+
+
+def _runs(periods, country_code):
+    periods = periods[(periods["country_code"] == country_code)
+                      & (periods["start"] != NO_PERIOD)]
+    return [(start[11:16], end[11:16], mean) for start, end, mean
+            in zip(periods["start"], periods["end"], periods["averageIntensity"])]
+
+
+def test_runs_below_threshold_with_their_means():
+    cei = [200] * 24
+    cei[2:5] = [50, 60, 70]
+    cei[10:12] = [10, 20]
+    periods = detect_periods(_forecasts({"FR": cei}), {"FR": 100.0})
+    assert _runs(periods, "FR") == [("10:00", "12:00", 15.0), ("02:00", "05:00", 60.0)]
+
+
+def test_only_the_lowest_runs_per_day_are_kept():
+    cei = [200] * 24
+    cei[1], cei[5], cei[9] = 30, 10, 20
+    periods = detect_periods(_forecasts({"FR": cei}), {"FR": 100.0}, periods_per_day=2)
+    assert [run[2] for run in _runs(periods, "FR")] == [10.0, 20.0]
+
+
+def test_runs_end_at_the_day_boundary_and_at_missing_hours():
+    cei = [200] * 22 + [50] * 4 + [200] * 22
+    forecasts = _forecasts({"FR": cei}, start="2023-06-01 00:00")
+    periods = detect_periods(forecasts, {"FR": 100.0})
+    assert _runs(periods, "FR") == [("22:00", "00:00", 50.0), ("00:00", "02:00", 50.0)]
+    # a gap in the hours splits a run too
+    gapped = _forecasts({"FR": [50, 50, 50, 50]})
+    gapped = gapped.drop(index=2)
+    periods = detect_periods(gapped, {"FR": 100.0})
+    assert sorted(run[:2] for run in _runs(periods, "FR")) == [("00:00", "02:00"),
+                                                               ("03:00", "04:00")]
+
+
+def test_nan_forecast_does_not_affect_later_runs_or_other_countries():
+    fr = [200] * 24
+    fr[3] = np.nan
+    fr[6:8] = [40, 60]
+    be = [200] * 24
+    be[1:3] = [30, 50]
+    periods = detect_periods(_forecasts({"FR": fr, "BE": be}), {"FR": 100.0, "BE": 100.0})
+    assert _runs(periods, "FR") == [("06:00", "08:00", 50.0)]
+    assert _runs(periods, "BE") == [("01:00", "03:00", 40.0)]
+    assert not periods["averageIntensity"].isna().any()
+
+
+def test_day_without_run_gets_a_placeholder():
+    periods = detect_periods(_forecasts({"FR": [200] * 24}), {"FR": 100.0})
+    assert len(periods) == 1
+    assert periods.iloc[0]["start"] == NO_PERIOD and periods.iloc[0]["end"] == NO_PERIOD
+
+
+def test_hourly_thresholds_override_the_average():
+    cei = [80] * 24
+    hourly = {("FR", hour): 50.0 for hour in range(24)}
+    hourly[("FR", 5)] = 90.0
+    periods = detect_periods(_forecasts({"FR": cei}), {"FR": 100.0}, hourly)
+    assert _runs(periods, "FR") == [("05:00", "06:00", 80.0)]
+
+
+def test_countries_without_threshold_are_skipped():
+    periods = detect_periods(_forecasts({"FR": [50] * 24}), {"BE": 100.0})
+    assert periods.empty
@@ -0,0 +1,56 @@
+import pandas as pd
+
+from src.training_scheduler import (TrainingReport, TrainingResult, expected_cost,
+                                    training_order)
+
+COUNTRIES = [("Austria", "AT", "Vienna", "Europe/Vienna"),
+             ("Belgium", "BE", "Brussels", "Europe/Brussels"),
+             ("France", "FR", "Paris", "Europe/Paris"),
+             ("Germany", "DE", "Berlin", "Europe/Berlin")]
+
+
+class FakeModelStore(object):
+    def __init__(self, metadata):
+        self._metadata = metadata
+
+    def metadata(self, name):
+        return self._metadata.get(name, {})
+
+
+def test_expected_cost_is_the_previous_fit_time():
+    store = FakeModelStore({"FR": {"fit_seconds": 4.5}, "BE": {"trained_at": "2023-06-01"}})
+    assert expected_cost(store, "FR") == 4.5
+    # stored without timings, or never trained
+    assert expected_cost(store, "BE") == float("inf")
+    assert expected_cost(store, "AT") == float("inf")
+    assert expected_cost(None, "FR") == float("inf")
+
+
+def test_never_trained_countries_are_trained_first_then_the_slowest():
+    store = FakeModelStore({"AT": {"fit_seconds": 1.0}, "FR": {"fit_seconds": 9.0},
+                            "DE": {"fit_seconds": 3.0}})
+    order = [country[1] for country in training_order(COUNTRIES, store)]
+    assert order == ["BE", "FR", "DE", "AT"]
+
+
+def _result(country_code, cpu_seconds, error=None):
+    forecast = None if error else pd.DataFrame({"Cei_prediction": [1.0]})
+    return TrainingResult(country_code, forecast, {"forecaster": "xgboost", "fit_seconds": 1.0},
+                          elapsed=2.0, cpu_seconds=cpu_seconds, error=error)
+
+
+def test_cpu_utilization_is_the_share_of_the_core_time():
+    report = TrainingReport([_result("FR", 6.0), _result("DE", 10.0)], wall_seconds=4.0, cpus=8)
+    assert report.cpu_seconds == 16.0
+    assert report.cpu_utilization == 0.5
+    assert TrainingReport(cpus=8).cpu_utilization == 0.0
+
+
+def test_report_summary_and_forecasts():
+    report = TrainingReport([_result("FR", 6.0), _result("DE", 2.0, error="ValueError()")],
+                            wall_seconds=4.0, cpus=4)
+    assert str(report) == ("trained 2 countries in 4.0s (1 failed), 8.0 cpu seconds, "
+                           "50% of 4 cores")
+    assert list(report.forecasts()) == ["FR"]
+    assert str(report.results[1]) == "DE: failed, ValueError()"
+    assert str(TrainingResult("AT", elapsed=0.3)) == "AT: stored model used, 0.3s"
@@ -0,0 +1,78 @@
+import pandas as pd
+import pytest
+from sqlalchemy.exc import ProgrammingError
+
+from src import watermark
+from src.watermark import fetch_window, get_watermark
+
+START = pd.Timestamp("2023-06-01 00:00", tz="Europe/Paris")
+END = pd.Timestamp("2023-06-02 00:00", tz="Europe/Paris")
+
+
+@pytest.fixture
+def stored(monkeypatch):
+    """Sets the watermark returned for the country"""
+    def store(timestamp):
+        monkeypatch.setattr(watermark, "get_watermark",
+                            lambda engine, table_name, country_code, index_label: timestamp)
+    return store
+
+
+def test_nothing_stored_fetches_the_requested_window(stored):
+    stored(None)
+    assert fetch_window(None, "generation", "FR", START, END) == (START, END)
+
+
+def test_window_restarts_lookback_before_the_watermark(stored):
+    stored(pd.Timestamp("2023-06-01 10:30", tz="UTC"))
+    start, end = fetch_window(None, "generation", "FR", START, END,
+                              lookback=pd.Timedelta(hours=3))
+    # 07:30 UTC floored to the hour, in the timezone of the window
+    assert start == pd.Timestamp("2023-06-01 09:00", tz="Europe/Paris")
+    assert str(start.tz) == "Europe/Paris"
+    assert end == END
+
+
+def test_window_is_clamped_to_the_requested_start(stored):
+    stored(pd.Timestamp("2023-05-31 22:30", tz="UTC"))
+    assert fetch_window(None, "generation", "FR", START, END,
+                        lookback=pd.Timedelta(hours=3)) == (START, END)
+
+
+def test_watermark_past_the_end_leaves_an_empty_window(stored):
+    stored(pd.Timestamp("2023-06-03 12:00", tz="UTC"))
+    start, end = fetch_window(None, "generation", "FR", START, END)
+    assert start >= end
+
+
+class FakeEngine(object):
+    def __init__(self, result=None, error=None):
+        self.result, self.error = result, error
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        if self.error:
+            raise self.error
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params):
+        return self
+
+    def scalar(self):
+        return self.result
+
+
+def test_get_watermark_reads_naive_timestamps_as_utc():
+    engine = FakeEngine(result=pd.Timestamp("2023-06-01 10:00").to_pydatetime())
+    assert get_watermark(engine, "generation", "FR") == pd.Timestamp("2023-06-01 10:00", tz="UTC")
+
+
+def test_get_watermark_of_a_missing_table_is_none():
+    error = ProgrammingError("SELECT", {}, Exception("relation does not exist"))
+    assert get_watermark(FakeEngine(error=error), "generation", "FR") is None
+    assert get_watermark(FakeEngine(), "generation", "FR") is None
@@ -0,0 +1,73 @@
+import datetime
+from types import SimpleNamespace
+
+import pandas as pd
+
+from src.weather_store import WeatherHistoryStore
+
+TZ = "Europe/Paris"
+
+
+class FakeEngine(object):
+    """Returns the given (day, hours) rows for the completeness query"""
+
+    def __init__(self, rows):
+        self.rows = [SimpleNamespace(day=day, hours=hours) for day, hours in rows]
+
+    def connect(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params):
+        return iter(self.rows)
+
+
+def test_days_need_23_hours_to_be_complete():
+    spring_forward = datetime.date(2023, 3, 26)
+    fall_back = datetime.date(2023, 10, 29)
+    store = WeatherHistoryStore(FakeEngine([
+        (datetime.date(2023, 3, 25), 24),
+        (spring_forward, 23),
+        (datetime.date(2023, 3, 27), 22),
+        (fall_back, 25),
+    ]))
+    assert store.stored_days("Paris", TZ, None, None) == {
+        datetime.date(2023, 3, 25), spring_forward, fall_back}
+
+
+def _store(stored):
+    store = WeatherHistoryStore(None)
+    store.stored_days = lambda city, tz, start_date, end_date: stored
+    store.requested = []
+    store._fetch_day = lambda city, tz, day: store.requested.append(day) or 24
+    return store
+
+
+def test_only_missing_days_are_requested():
+    start = pd.Timestamp("2023-03-24", tz=TZ)
+    end = pd.Timestamp("2023-03-28", tz=TZ)
+    store = _store({datetime.date(2023, 3, 24), datetime.date(2023, 3, 26)})
+    missing = store.fetch_missing("Paris", TZ, start, end)
+    assert missing == [datetime.date(2023, 3, 25), datetime.date(2023, 3, 27)]
+    assert sorted(store.requested) == missing
+
+
+def test_nothing_is_requested_when_all_days_are_stored():
+    start = pd.Timestamp("2023-03-24", tz=TZ)
+    end = pd.Timestamp("2023-03-26", tz=TZ)
+    store = _store({datetime.date(2023, 3, 24), datetime.date(2023, 3, 25)})
+    assert store.fetch_missing("Paris", TZ, start, end) == []
+    assert store.requested == []
+
+
+def test_today_is_always_requested_again():
+    today = pd.Timestamp.now(tz=TZ).normalize()
+    yesterday = today - pd.Timedelta(days=1)
+    store = _store({yesterday.date(), today.date()})
+    missing = store.fetch_missing("Paris", TZ, yesterday, today + pd.Timedelta(days=1))
+    assert missing == [today.date()]
@@ -0,0 +1,42 @@
+import pandas as pd
+
+from src.weatherapi_collector import HOUR_COLUMNS, decode_json, parse_forecastdays
+
+
+def hour(epoch, tz, **values):
+    time = pd.Timestamp(epoch, unit="s", tz="UTC").tz_convert(tz)
+    row = {tag: 0.0 for tag in HOUR_COLUMNS}
+    row.update({"time_epoch": epoch, "time": time.strftime("%Y-%m-%d %H:%M"),
+                "wind_dir": "N"}, **values)
+    return row
+
+
+def payload(days):
+    return {"forecast": {"forecastday": [{"hour": hours} for hours in days]}}
+
+
+def test_hours_of_all_days_are_flattened_in_order():
+    start = int(pd.Timestamp("2024-06-01", tz="Europe/Paris").timestamp())
+    days = [[hour(start + h * 3600, "Europe/Paris", temp_c=float(h)) for h in range(24)],
+            [hour(start + h * 3600, "Europe/Paris", temp_c=float(h)) for h in range(24, 48)]]
+    df = parse_forecastdays(payload(days), "Europe/Paris")
+    assert list(df.columns) == HOUR_COLUMNS
+    assert len(df) == 48
+    assert df.index.name == "time"
+    assert str(df.index.tz) == "Europe/Paris"
+    assert df.index[0] == pd.Timestamp("2024-06-01", tz="Europe/Paris")
+    assert df["temp_c"].tolist() == [float(h) for h in range(48)]
+
+
+def test_index_is_unambiguous_over_the_autumn_clock_change():
+    # 2023-10-29 02:00-03:00 local time happens twice in Paris
+    start = int(pd.Timestamp("2023-10-29", tz="Europe/Paris").timestamp())
+    hours = [hour(start + h * 3600, "Europe/Paris") for h in range(25)]
+    df = parse_forecastdays(payload([hours]), "Europe/Paris")
+    assert df.index.is_unique
+    assert (df.index.to_series().diff().dropna() == pd.Timedelta(hours=1)).all()
+    assert df.index[-1] == pd.Timestamp("2023-10-29 23:00", tz="Europe/Paris")
+
+
+def test_decode_json_reads_bytes():
+    assert decode_json(b'{"forecast": {"forecastday": []}}') == payload([])
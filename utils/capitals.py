@@ -0,0 +1,37 @@
+# (latitude, longitude) of the capital of each country in utils.cron.european_countries
+
+CAPITAL_COORDINATES: dict[str, tuple[float, float]] = {
+    "AT": (48.21, 16.37),  # Vienna
+    "BE": (50.85, 4.35),  # Brussels
+    "BA": (43.86, 18.41),  # Sarajevo
+    "BG": (42.70, 23.32),  # Sofia
+    "HR": (45.81, 15.98),  # Zagreb
+    "CZ": (50.08, 14.44),  # Prague
+    "DK": (55.68, 12.57),  # Copenhagen
+    "EE": (59.44, 24.75),  # Tallinn
+    "FI": (60.17, 24.94),  # Helsinki
+    "FR": (48.86, 2.35),  # Paris
+    "DE": (52.52, 13.40),  # Berlin
+    "GR": (37.98, 23.73),  # Athens
+    "HU": (47.50, 19.04),  # Budapest
+    "IE": (53.35, -6.26),  # Dublin
+    "IT": (41.90, 12.50),  # Rome
+    "XK": (42.66, 21.17),  # Pristina
+    "LV": (56.95, 24.11),  # Riga
+    "LT": (54.69, 25.28),  # Vilnius
+    "LU": (49.61, 6.13),  # Luxembourg
+    "MD": (47.01, 28.86),  # Chisinau
+    "ME": (42.44, 19.26),  # Podgorica
+    "NL": (52.37, 4.90),  # Amsterdam
+    "MK": (41.998, 21.43),  # Skopje
+    "NO": (59.91, 10.75),  # Oslo
+    "PL": (52.23, 21.01),  # Warsaw
+    "PT": (38.72, -9.14),  # Lisbon
+    "RO": (44.43, 26.10),  # Bucharest
+    "RS": (44.79, 20.45),  # Belgrade
+    "SK": (48.15, 17.11),  # Bratislava
+    "SI": (46.06, 14.51),  # Ljubljana
+    "ES": (40.42, -3.70),  # Madrid
+    "SE": (59.33, 18.07),  # Stockholm
+    "CH": (46.95, 7.45),  # Bern
+}
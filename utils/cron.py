@@ -52,3 +52,6 @@ cronjob_lines = [
     for country in european_countries
 ]
 cronjob_lines[:5]  # Show the first five as an example
+
+# Alternative to the lines above: a single resident process scheduling every country
+daemon_cronjob = "@reboot /root/Stromzeiten_datacollector/venv/bin/python /root/Stromzeiten_datacollector/scheduler.py > /root/tmp/scheduler.log 2>&1"